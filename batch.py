@@ -0,0 +1,98 @@
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from embeddings import ControleTaxa, eh_rate_limit, mapear_em_ordem
+from qa_cache import responder
+from streaming import caminhos_fontes
+from instrumentation import percentis
+
+# Quantidade padrão de perguntas respondidas ao mesmo tempo no modo em lote
+CONCORRENCIA_LOTE = int(os.getenv('REPOCHAT_CONCORRENCIA_LOTE', 4))
+
+# Quantidade de tentativas de cada pergunta quando o limite de requisições da API é atingido
+MAX_TENTATIVAS = 5
+
+
+def ler_perguntas(caminho):
+    """
+    Esta função lê as perguntas de um arquivo JSON lines, sob demanda. Cada linha pode ser uma string
+    (a pergunta) ou um objeto com a pergunta em "pergunta", "question" ou "title" e "body" (como no
+    requests.jsonl), um identificador opcional em "id" ou "request_id" e um histórico opcional em
+    "historico", como pares (pergunta, resposta).
+
+    Args:
+        caminho (str): O arquivo de perguntas.
+
+    Yields:
+        dict: O identificador, a pergunta e o histórico de cada linha.
+    """
+    with open(caminho, encoding='utf-8') as file:
+        for numero, linha in enumerate(file, 1):
+            if not linha.strip():
+                continue
+            item = json.loads(linha)
+            if isinstance(item, str):
+                item = {'pergunta': item}
+            pergunta = item.get('pergunta') or item.get('question') or \
+                "\n\n".join(parte for parte in (item.get('title'), item.get('body')) if parte)
+            if not pergunta:
+                raise ValueError(f"{caminho}:{numero}: linha sem pergunta")
+            yield {'id': item.get('id', item.get('request_id', numero)), 'pergunta': pergunta,
+                   'historico': [tuple(turno) for turno in item.get('historico', [])]}
+
+
+def responder_lote(qa_chain, cache, repo, versao, perguntas, saida, concorrencia=CONCORRENCIA_LOTE):
+    """
+    Esta função responde a um lote de perguntas com a mesma cadeia, com no máximo `concorrencia`
+    perguntas ao mesmo tempo, e grava cada resposta em um arquivo JSON lines, na ordem das perguntas,
+    assim que ela (e as anteriores) termina. As perguntas já respondidas vêm do cache de respostas,
+    então executar o lote também aquece o cache.
+
+    Args:
+        qa_chain (ConversationalRetrievalChain): A cadeia de perguntas e respostas, compartilhada pelas threads.
+        cache (CacheRespostas): O cache de respostas.
+        repo (str): O nome do repositório.
+        versao (int): A versão do índice do repositório no manifesto.
+        perguntas (iterable): As perguntas, como as de ler_perguntas.
+        saida (str): O arquivo JSON lines das respostas.
+        concorrencia (int, optional): A quantidade máxima de perguntas respondidas ao mesmo tempo.
+
+    Returns:
+        dict: O resumo do lote: quantidade de perguntas, erros e acertos do cache, duração, vazão e latências.
+    """
+    controle = ControleTaxa()
+
+    def responder_item(item):
+        inicio = time.perf_counter()
+        resultado = {'id': item['id'], 'pergunta': item['pergunta']}
+        for tentativa in range(MAX_TENTATIVAS):
+            controle.aguardar()
+            try:
+                resposta = responder(qa_chain, cache, repo, versao, item['pergunta'], item['historico'])
+            except Exception as e:
+                if eh_rate_limit(e) and tentativa < MAX_TENTATIVAS - 1:
+                    controle.limite_atingido()
+                    continue
+                resultado.update(resposta=None, fontes=[], cache=False, erro=f"{type(e).__name__}: {e}")
+                break
+            controle.sucesso()
+            resultado.update(resposta=resposta['answer'], fontes=caminhos_fontes(resposta['sources']),
+                             cache=resposta['cache'], erro=None)
+            break
+        resultado['latencia_s'] = round(time.perf_counter() - inicio, 3)
+        return resultado
+
+    latencias, erros, acertos = [], 0, 0
+    inicio = time.perf_counter()
+    with open(saida, 'w', encoding='utf-8') as file, ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        for resultado in mapear_em_ordem(executor, responder_item, perguntas, 2 * concorrencia):
+            file.write(json.dumps(resultado, ensure_ascii=False) + "\n")
+            file.flush()
+            latencias.append(resultado['latencia_s'])
+            erros += resultado['erro'] is not None
+            acertos += resultado['cache']
+    duracao = time.perf_counter() - inicio
+
+    return {'perguntas': len(latencias), 'erros': erros, 'acertos_cache': acertos, 'duracao_s': round(duracao, 3),
+            'perguntas_por_s': round(len(latencias) / duracao, 2) if duracao else None, 'latencia': percentis(latencias)}
@@ -0,0 +1,343 @@
+"""
+Benchmark da ingestão e das perguntas, sem acessar o GitHub nem a OpenAI.
+
+Gera um repositório sintético (quantidade de arquivos, linhas e mistura de linguagens configuráveis),
+serve a página e o zip do repositório em um servidor HTTP local que imita o GitHub e usa incorporações
+e um modelo de chat determinísticos e locais. Mede a vazão da ingestão (arquivos/s e fragmentos/s),
+o pico de memória (RSS), a latência da busca (p50/p99) e a latência de ponta a ponta das perguntas.
+
+O resultado é exibido e acrescentado, como uma linha JSON, ao arquivo de resultados, para acompanhar
+regressões ao longo do tempo.
+
+Uso:
+    python benchmark.py --arquivos 500 --linguagens py=0.5,js=0.3,md=0.2 --saida benchmark.jsonl
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import hashlib
+import zipfile
+import argparse
+import tempfile
+import platform
+import subprocess
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, List, Optional
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from langchain.chat_models.base import SimpleChatModel
+from langchain.chains import ConversationalRetrievalChain
+
+# Diretório do projeto, para importar os módulos depois de mudar o diretório de trabalho
+DIRETORIO_PROJETO = os.path.dirname(os.path.abspath(__file__))
+
+PALAVRAS = ["cache", "token", "arquivo", "repositorio", "fragmento", "consulta", "indice", "lote", "usuario",
+            "sessao", "modelo", "resposta", "historico", "custo", "download", "branch", "manifesto", "busca"]
+
+
+class EmbeddingsDeterministicas(Embeddings):
+    """
+    Incorporações locais e determinísticas (derivadas do hash do texto), com latência opcional por chamada,
+    para medir a ingestão e a busca sem acessar a API da OpenAI.
+    """
+
+    def __init__(self, dimensao=256, latencia=0.0):
+        self.dimensao = dimensao
+        self.latencia = latencia
+        self.model = f"deterministica-{dimensao}"
+
+    def _vetor(self, texto):
+        semente = int.from_bytes(hashlib.sha256(texto.encode('utf-8')).digest()[:8], 'little')
+        vetor = np.random.default_rng(semente).standard_normal(self.dimensao).astype(np.float32)
+        return (vetor / np.linalg.norm(vetor)).tolist()
+
+    def embed_documents(self, texts):
+        if self.latencia:
+            time.sleep(self.latencia)
+        return [self._vetor(texto) for texto in texts]
+
+    def embed_query(self, text):
+        if self.latencia:
+            time.sleep(self.latencia)
+        return self._vetor(text)
+
+
+class ModeloFalso(SimpleChatModel):
+    """Modelo de chat local que responde com um texto fixo depois de uma latência opcional."""
+
+    latencia: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "modelo-falso"
+
+    def _call(self, messages: List[Any], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        if self.latencia:
+            time.sleep(self.latencia)
+        contexto = sum(len(str(mensagem.content)) for mensagem in messages)
+        return f"Resposta gerada a partir de {contexto} caracteres de contexto."
+
+
+def gerar_arquivo(extensao, modulo, unidades, gerador):
+    """
+    Esta função gera o conteúdo de um arquivo sintético com `unidades` funções (ou seções, no Markdown).
+
+    Args:
+        extensao (str): A extensão do arquivo ("py", "js", "go", "css", "yml" ou "md").
+        modulo (str): O nome do módulo, usado nos nomes dos símbolos.
+        unidades (int): A quantidade de funções ou seções.
+        gerador (random.Random): O gerador de números aleatórios.
+
+    Returns:
+        tuple: O conteúdo do arquivo e os nomes dos símbolos definidos.
+    """
+    simbolos = [f"{gerador.choice(PALAVRAS)}_{modulo}_{i}" for i in range(unidades)]
+    frase = lambda: " ".join(gerador.choice(PALAVRAS) for _ in range(8))
+    partes = []
+    for i, nome in enumerate(simbolos):
+        chamada = simbolos[i - 1] if i else nome
+        if extensao == "py":
+            partes.append(f"def {nome}(dados, limite=10):\n    \"\"\"{frase()}.\"\"\"\n"
+                          f"    resultado = [{chamada}(item) for item in dados[:limite]]\n"
+                          f"    # {frase()}\n    return resultado\n\n")
+        elif extensao == "js":
+            partes.append(f"export function {nome}(dados, limite = 10) {{\n  // {frase()}\n"
+                          f"  const resultado = dados.slice(0, limite).map((item) => {chamada}(item));\n"
+                          f"  return resultado;\n}}\n\n")
+        elif extensao == "go":
+            partes.append(f"func {nome}(dados []string, limite int) []string {{\n\t// {frase()}\n"
+                          f"\tresultado := {chamada}(dados[:limite], limite)\n\treturn resultado\n}}\n\n")
+        elif extensao == "css":
+            partes.append(f".{nome.replace('_', '-')} {{\n  /* {frase()} */\n  margin: {i}px;\n  padding: {i % 7}px;\n}}\n\n")
+        elif extensao == "yml":
+            partes.append(f"{nome}:\n  descricao: {frase()}\n  limite: {i}\n  depende_de: {chamada}\n\n")
+        else:
+            partes.append(f"## {nome}\n\n{frase()}. {frase()}. Veja `{chamada}`.\n\n")
+    return "".join(partes), simbolos
+
+
+def gerar_repo_sintetico(destino, arquivos, linguagens, unidades_por_arquivo=12, semente=42):
+    """
+    Esta função gera um repositório sintético em um diretório.
+
+    Args:
+        destino (str): O diretório do repositório.
+        arquivos (int): A quantidade de arquivos.
+        linguagens (dict): A proporção de cada extensão, por exemplo {"py": 0.5, "js": 0.3, "md": 0.2}.
+        unidades_por_arquivo (int, optional): A quantidade de funções (ou seções) de cada arquivo.
+        semente (int, optional): A semente do gerador, para repositórios reproduzíveis.
+
+    Returns:
+        dict: Os símbolos definidos, por extensão.
+    """
+    gerador = random.Random(semente)
+    extensoes = list(linguagens)
+    pesos = [linguagens[extensao] for extensao in extensoes]
+    simbolos = {}
+    for i in range(arquivos):
+        extensao = gerador.choices(extensoes, pesos)[0]
+        pasta = os.path.join(destino, f"pacote{i % 10}")
+        os.makedirs(pasta, exist_ok=True)
+        conteudo, nomes = gerar_arquivo(extensao, f"m{i}", unidades_por_arquivo, gerador)
+        with open(os.path.join(pasta, f"modulo{i}.{extensao}"), 'w', encoding='utf-8') as file:
+            file.write(conteudo)
+        simbolos.setdefault(extensao, []).extend(nomes)
+    return simbolos
+
+
+def compactar_como_github(diretorio, caminho_zip, prefixo):
+    """Compacta um diretório no formato dos zips do GitHub, com todos os arquivos dentro de `prefixo`/."""
+    with zipfile.ZipFile(caminho_zip, 'w', zipfile.ZIP_DEFLATED) as arquivo_zip:
+        for dirpath, _, filenames in os.walk(diretorio):
+            for nome in filenames:
+                caminho = os.path.join(dirpath, nome)
+                arquivo_zip.write(caminho, os.path.join(prefixo, os.path.relpath(caminho, diretorio)))
+
+
+def iniciar_servidor_github(caminho_zip, repo, branch="main"):
+    """
+    Esta função inicia um servidor HTTP local que imita o GitHub: a página do repositório (com o nome
+    da branch principal, como main_repository_branchname espera) e o zip da branch.
+
+    Args:
+        caminho_zip (str): O zip servido.
+        repo (str): O caminho do repositório na URL, por exemplo "benchmark/sintetico".
+        branch (str, optional): O nome da branch principal.
+
+    Returns:
+        ThreadingHTTPServer: O servidor iniciado, em uma thread em segundo plano.
+    """
+    pagina = f'<html><body><span class="css-truncate-target" data-menu-button>{branch}</span></body></html>'.encode('utf-8')
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.rstrip('/') == f"/{repo}":
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html')
+                self.send_header('Content-Length', str(len(pagina)))
+                self.end_headers()
+                self.wfile.write(pagina)
+            elif self.path == f"/{repo}/archive/refs/heads/{branch}.zip":
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/zip')
+                self.send_header('Content-Length', str(os.path.getsize(caminho_zip)))
+                self.end_headers()
+                with open(caminho_zip, 'rb') as file:
+                    shutil.copyfileobj(file, self.wfile)
+            else:
+                self.send_response(404)
+                self.end_headers()
+
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def versao_codigo():
+    """Retorna o commit atual do projeto, se ele estiver em um repositório git."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=DIRETORIO_PROJETO, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def executar(args):
+    """
+    Esta função executa o benchmark em um diretório de trabalho temporário.
+
+    Args:
+        args (argparse.Namespace): Os parâmetros do benchmark.
+
+    Returns:
+        dict: Os parâmetros e as métricas medidas.
+    """
+    linguagens = {extensao: float(peso) for extensao, peso in (item.split('=') for item in args.linguagens.split(','))}
+    trabalho = tempfile.mkdtemp(prefix="repochat-benchmark-")
+    diretorio_original = os.getcwd()
+    sys.path.insert(0, DIRETORIO_PROJETO)
+    os.environ.setdefault('NO_PROXY', '127.0.0.1,localhost')
+    try:
+        # Todos os arquivos da aplicação (bases, manifesto, caches, temporários) ficam no diretório de trabalho
+        os.chdir(trabalho)
+        from embeddings import CacheEmbeddings
+        from vectorstore import BaseRepos
+        from manifest import Manifesto
+        from qa_cache import CacheRespostas, responder
+        from lexical import simbolo_consulta
+        from instrumentation import PADRAO as instrumentacao, percentis, pico_rss_mb
+        from functions import (download_and_extract_repo, escanear_repo, custo_embeddings_repo, db_add_repo_files,
+                               limpar_fonte, get_retriever)
+
+        # Repositório sintético servido por um GitHub local
+        simbolos = gerar_repo_sintetico(os.path.join(trabalho, "origem"), args.arquivos, linguagens,
+                                        args.unidades, args.semente)
+        compactar_como_github(os.path.join(trabalho, "origem"), os.path.join(trabalho, "repo.zip"), "sintetico-main")
+        servidor = iniciar_servidor_github(os.path.join(trabalho, "repo.zip"), "benchmark/sintetico")
+        url = f"http://127.0.0.1:{servidor.server_address[1]}/benchmark/sintetico"
+
+        embeddings = CacheEmbeddings(EmbeddingsDeterministicas(args.dimensao, args.latencia_embeddings))
+        db = BaseRepos(embeddings)
+        manifesto = Manifesto()
+        metricas = {}
+
+        # Ingestão: download e extração, varredura (hashes e tokens) e incorporação e gravação
+        inicio = time.perf_counter()
+        repo, fonte = download_and_extract_repo(url)
+        metricas['download_s'] = round(time.perf_counter() - inicio, 3)
+
+        inicio = time.perf_counter()
+        varredura = escanear_repo(fonte)
+        total_tokens, _ = custo_embeddings_repo(fonte, varredura)
+        metricas['varredura_s'] = round(time.perf_counter() - inicio, 3)
+
+        inicio = time.perf_counter()
+        db_add_repo_files(db, repo, fonte, varredura=varredura, manifesto=manifesto)
+        metricas['ingestao_s'] = round(time.perf_counter() - inicio, 3)
+
+        # Duração de cada etapa da ingestão (fragmentação, incorporação, gravação, índice léxico)
+        metricas['etapas_ingestao'] = {registro['etapa']: registro['duracao_s']
+                                       for registro in instrumentacao.ultima_operacao('ingestao')}
+
+        fragmentos = manifesto.obter(repo)['chunks']
+        total = metricas['download_s'] + metricas['varredura_s'] + metricas['ingestao_s']
+        metricas.update({'arquivos_indexados': len(varredura), 'fragmentos': fragmentos, 'tokens': total_tokens,
+                         'arquivos_por_s': round(len(varredura) / total, 1), 'fragmentos_por_s': round(fragmentos / total, 1)})
+
+        # Sincronização sem alterações (apenas hashes, nenhum fragmento incorporado)
+        inicio = time.perf_counter()
+        db_add_repo_files(db, repo, fonte, incremental=True, manifesto=manifesto)
+        metricas['sincronizacao_s'] = round(time.perf_counter() - inicio, 3)
+        limpar_fonte(fonte)
+        metricas['pico_rss_ingestao_mb'] = pico_rss_mb()
+
+        # Perguntas: localizações de símbolos e perguntas em linguagem natural
+        gerador = random.Random(args.semente)
+        nomes = [nome for lista in simbolos.values() for nome in lista]
+        perguntas = [f"onde `{gerador.choice(nomes)}` é usada?" if i % 2 == 0 else
+                     f"como funciona o {gerador.choice(PALAVRAS)} de {gerador.choice(PALAVRAS)}?" for i in range(args.perguntas)]
+
+        versao = manifesto.versao(repo)
+        retriever = get_retriever(db, repo, versao)
+        retriever.get_relevant_documents(perguntas[0])
+        duracoes = {'simbolo': [], 'texto': []}
+        for pergunta in perguntas:
+            inicio = time.perf_counter()
+            retriever.get_relevant_documents(pergunta)
+            duracoes['simbolo' if simbolo_consulta(pergunta) else 'texto'].append(time.perf_counter() - inicio)
+        metricas['busca'] = percentis(duracoes['simbolo'] + duracoes['texto'])
+        metricas['busca_simbolo'] = percentis(duracoes['simbolo'])
+        metricas['busca_texto'] = percentis(duracoes['texto'])
+
+        # Ponta a ponta: a cadeia completa, sem e com o cache de respostas
+        qa_chain = ConversationalRetrievalChain.from_llm(ModeloFalso(latencia=args.latencia_llm), retriever=retriever,
+                                                         return_source_documents=True)
+        cache = CacheRespostas()
+        for chave in ('ponta_a_ponta', 'ponta_a_ponta_cache'):
+            tempos = []
+            for pergunta in perguntas:
+                inicio = time.perf_counter()
+                responder(qa_chain, cache, repo, versao, pergunta, [])
+                tempos.append(time.perf_counter() - inicio)
+            metricas[chave] = percentis(tempos)
+        metricas['pico_rss_mb'] = pico_rss_mb()
+        servidor.shutdown()
+    finally:
+        os.chdir(diretorio_original)
+        if not args.manter:
+            shutil.rmtree(trabalho, ignore_errors=True)
+
+    return {'instante': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': versao_codigo(), 'python': platform.python_version(),
+            'parametros': {'arquivos': args.arquivos, 'linguagens': linguagens, 'unidades': args.unidades,
+                           'perguntas': args.perguntas, 'dimensao': args.dimensao, 'semente': args.semente,
+                           'latencia_embeddings': args.latencia_embeddings, 'latencia_llm': args.latencia_llm},
+            'metricas': metricas}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark local da ingestão e das perguntas")
+    parser.add_argument('--arquivos', type=int, default=200, help="quantidade de arquivos do repositório sintético")
+    parser.add_argument('--linguagens', default="py=0.4,js=0.3,md=0.1,go=0.1,css=0.05,yml=0.05",
+                        help="proporção de cada extensão, por exemplo py=0.5,js=0.5")
+    parser.add_argument('--unidades', type=int, default=12, help="funções (ou seções) por arquivo")
+    parser.add_argument('--perguntas', type=int, default=50)
+    parser.add_argument('--dimensao', type=int, default=256, help="dimensão das incorporações")
+    parser.add_argument('--latencia-embeddings', type=float, default=0.0, help="latência de cada chamada de incorporação, em segundos")
+    parser.add_argument('--latencia-llm', type=float, default=0.0, help="latência de cada chamada ao modelo, em segundos")
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--saida', default="benchmark.jsonl", help="arquivo JSON lines onde o resultado é acrescentado")
+    parser.add_argument('--manter', action='store_true', help="mantém o diretório de trabalho temporário")
+    args = parser.parse_args()
+
+    resultado = executar(args)
+    print(json.dumps(resultado, indent=2, ensure_ascii=False))
+    with open(args.saida, 'a', encoding='utf-8') as file:
+        file.write(json.dumps(resultado, ensure_ascii=False) + "\n")
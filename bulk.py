@@ -0,0 +1,415 @@
+"""
+Ingestão em lote de vários repositórios, sem interação.
+
+Cada origem (URL do GitHub ou caminho local, com a referência opcional) vira uma tarefa de uma fila
+persistente em SQLite. Os downloads e as ingestões são feitos por grupos de threads separados, cada
+um com o seu limite de concorrência, e o manifesto só é atualizado quando a ingestão de um repositório
+termina. Se o processo for interrompido, a próxima execução retoma as tarefas de onde pararam.
+
+Uso:
+    python bulk.py --lista repos.txt --downloads 4 --ingestoes 2
+"""
+import os
+import time
+import sqlite3
+import argparse
+import threading
+from filelock import FileLock, Timeout
+from filtering import RelatorioFiltro
+from functions import (custo_embeddings_repo, db_add_repo_files, download_and_extract_repo, escanear_repo,
+                       limpar_fonte, nome_repositorio, resolver_fonte_local)
+from embeddings import MAX_CONCORRENCIA
+
+# Arquivo da fila de ingestão
+FILA_FILE = os.getenv('REPOCHAT_FILA', "ingest_queue.db")
+
+# Quantidade de tentativas de cada etapa (download ou ingestão) antes de a tarefa ser marcada com erro
+MAX_TENTATIVAS = 3
+
+# Estados em que uma tarefa ainda não terminou
+ESTADOS_ATIVOS = ('pendente', 'baixando', 'baixado', 'ingerindo')
+
+
+def eh_local(origem):
+    """Retorna True se a origem for um caminho local (lido no lugar, sem download)."""
+    return os.path.exists(os.path.expanduser(origem))
+
+
+def nomes_repositorio(origem):
+    """
+    Esta função retorna os nomes possíveis do repositório de uma origem, em ordem de preferência: o nome
+    curto (o usado pelo chat.py e pelo cmdline.py) e, para evitar conflitos, o nome com o dono do
+    repositório (ou o caminho completo, para origens locais).
+
+    Args:
+        origem (str): A URL do GitHub ou o caminho local.
+
+    Returns:
+        list: Os nomes possíveis.
+    """
+    if eh_local(origem):
+        caminho = os.path.abspath(os.path.expanduser(origem))
+        fonte_local = resolver_fonte_local(origem)
+        return [fonte_local[0], caminho] if fonte_local is not None else [caminho]
+    partes = origem.rstrip("/").split("/")
+    nome = nome_repositorio(origem)
+    return [nome, f"{partes[-2]}/{nome}"] if len(partes) > 1 else [nome]
+
+
+def mesma_origem(source_ref, origem):
+    """
+    Retorna True se a origem registrada no manifesto (origem ou origem@referência) for a origem informada.
+    Uma origem desconhecida (por exemplo, de um repositório importado do repos_list.pkl) não é a mesma, para
+    que a sincronização incremental não apague os fragmentos de um repositório de outra origem.
+    """
+    return source_ref is not None and (source_ref == origem or source_ref.startswith(origem + "@"))
+
+
+def ler_origens(caminho):
+    """
+    Esta função lê uma lista de origens: uma por linha, a URL ou o caminho seguido, opcionalmente,
+    da branch, tag ou commit. Linhas vazias e comentários (#) são ignorados.
+
+    Args:
+        caminho (str): O arquivo da lista.
+
+    Returns:
+        list: As origens, como pares (origem, referência).
+    """
+    origens = []
+    with open(caminho, encoding='utf-8') as file:
+        for linha in file:
+            partes = linha.split('#', 1)[0].split()
+            if partes:
+                origens.append((partes[0], partes[1] if len(partes) > 1 else None))
+    return origens
+
+
+class FilaIngestao:
+    """
+    Fila persistente das tarefas de ingestão, guardada em um banco SQLite.
+
+    Cada tarefa passa pelos estados pendente → baixando → baixado → ingerindo → concluido (ou erro,
+    ou ignorado). As mudanças de estado são transações do SQLite, então um processo interrompido
+    deixa a fila consistente, e retomar() devolve as tarefas em andamento à etapa em que estavam.
+    """
+
+    def __init__(self, caminho=FILA_FILE):
+        self._lock = threading.Lock()
+        self._conexao = sqlite3.connect(caminho, timeout=60, check_same_thread=False, isolation_level=None)
+        self._conexao.execute("PRAGMA journal_mode=WAL")
+        self._conexao.execute("CREATE TABLE IF NOT EXISTS tarefas (id INTEGER PRIMARY KEY, origem TEXT NOT NULL, "
+                              "ref TEXT NOT NULL DEFAULT '', nome TEXT NOT NULL, estado TEXT NOT NULL DEFAULT 'pendente', "
+                              "repo TEXT, fonte TEXT, tentativas INTEGER NOT NULL DEFAULT 0, erro TEXT, tokens INTEGER, "
+                              "custo_usd REAL, fragmentos INTEGER, atualizado REAL, UNIQUE (origem, ref))")
+        self._conexao.execute("CREATE INDEX IF NOT EXISTS tarefas_estado ON tarefas (estado)")
+
+    def _transacao(self, comandos):
+        with self._lock:
+            self._conexao.execute("BEGIN IMMEDIATE")
+            try:
+                resultado = comandos(self._conexao)
+                self._conexao.execute("COMMIT")
+                return resultado
+            except Exception:
+                self._conexao.execute("ROLLBACK")
+                raise
+
+    def _escolher_repo(self, conexao, origem, manifesto=None):
+        # O primeiro nome possível que não é usado por outra origem, na fila ou no manifesto
+        conflito = None
+        for repo in nomes_repositorio(origem):
+            outra = conexao.execute("SELECT origem FROM tarefas WHERE repo = ? AND origem != ? LIMIT 1",
+                                    (repo, origem)).fetchone()
+            outra = outra[0] if outra is not None else None
+            if outra is None and manifesto is not None and manifesto.contem(repo):
+                source_ref = manifesto.obter(repo)['source_ref']
+                outra = None if mesma_origem(source_ref, origem) else source_ref or "uma origem desconhecida"
+            if outra is None:
+                return repo, None
+            conflito = conflito or f"o repositório {repo} já é indexado a partir de {outra}"
+        return None, conflito
+
+    def adicionar(self, origens, atualizar=False, manifesto=None):
+        """
+        Adiciona origens à fila. Origens já presentes são mantidas; com `atualizar`, as já concluídas
+        (ou com erro) voltam a ficar pendentes, para uma sincronização incremental.
+
+        O nome do repositório (e do seu dataset) de cada origem é escolhido ao adicioná-la: o nome curto
+        ou, se ele já for usado por outra origem (forks, repositórios de mesmo nome em donos diferentes),
+        o nome com o dono. Sem um nome livre, a tarefa é ignorada, em vez de sobrescrever o outro repositório.
+
+        Args:
+            origens (list): As origens, como pares (origem, referência).
+            atualizar (bool, optional): Se True, reprocessa as origens já concluídas.
+            manifesto (Manifesto, optional): O manifesto, para não reutilizar o nome de um repositório indexado de outra origem.
+
+        Returns:
+            int: A quantidade de tarefas novas.
+        """
+        def comandos(conexao):
+            novas = 0
+            for origem, ref in origens:
+                ref = ref or ''
+                linha = conexao.execute("SELECT id, estado, repo FROM tarefas WHERE origem = ? AND ref = ?",
+                                        (origem, ref)).fetchone()
+                if linha is None or linha[2] is None:
+                    repo, conflito = self._escolher_repo(conexao, origem, manifesto)
+                    if linha is None:
+                        # Origens locais são lidas no lugar; as URLs são baixadas em um diretório com o nome do repositório
+                        nome = os.path.abspath(os.path.expanduser(origem)) if eh_local(origem) else nome_repositorio(origem)
+                        conexao.execute("INSERT INTO tarefas (origem, ref, nome, repo, estado, erro, atualizado) "
+                                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                        (origem, ref, nome, repo, 'pendente' if repo else 'ignorado', conflito, time.time()))
+                        novas += 1
+                    elif repo is not None:
+                        # Tarefas de versões anteriores da fila, ou ignoradas por um conflito que não existe mais
+                        conexao.execute("UPDATE tarefas SET repo = ?, erro = CASE estado WHEN 'ignorado' THEN NULL ELSE erro END, "
+                                        "estado = CASE estado WHEN 'ignorado' THEN 'pendente' ELSE estado END, atualizado = ? "
+                                        "WHERE id = ?", (repo, time.time(), linha[0]))
+                    elif linha[1] in ('pendente', 'ignorado'):
+                        conexao.execute("UPDATE tarefas SET estado = 'ignorado', erro = ?, atualizado = ? WHERE id = ?",
+                                        (conflito, time.time(), linha[0]))
+                    continue
+                if atualizar:
+                    conexao.execute("UPDATE tarefas SET estado = 'pendente', tentativas = 0, erro = NULL, atualizado = ? "
+                                    "WHERE id = ? AND estado NOT IN (%s)" % ",".join("?" * len(ESTADOS_ATIVOS)),
+                                    (time.time(), linha[0], *ESTADOS_ATIVOS))
+            return novas
+        return self._transacao(comandos)
+
+    def retomar(self):
+        """
+        Devolve as tarefas interrompidas à etapa em que estavam: downloads interrompidos voltam a ficar
+        pendentes, e ingestões interrompidas voltam a ficar baixadas (a ingestão retoma do checkpoint),
+        a não ser que o diretório baixado não exista mais.
+
+        Returns:
+            int: A quantidade de tarefas retomadas.
+        """
+        def comandos(conexao):
+            retomadas = conexao.execute("UPDATE tarefas SET estado = 'pendente' WHERE estado = 'baixando'").rowcount
+            for id, fonte in conexao.execute("SELECT id, fonte FROM tarefas WHERE estado IN ('baixado', 'ingerindo')").fetchall():
+                estado = 'baixado' if fonte is None or os.path.isdir(fonte) else 'pendente'
+                retomadas += conexao.execute("UPDATE tarefas SET estado = ? WHERE id = ? AND estado != ?",
+                                             (estado, id, estado)).rowcount
+            return retomadas
+        return self._transacao(comandos)
+
+    def reservar(self, estado, novo_estado, exclusivo=False):
+        """
+        Reserva a tarefa mais antiga em um estado, passando-a para o novo estado.
+
+        Args:
+            estado (str): O estado das tarefas candidatas.
+            novo_estado (str): O estado da tarefa reservada.
+            exclusivo (bool, optional): Se True, ignora as tarefas cujo repositório (o mesmo nome) já está em andamento,
+                                        para que dois downloads não usem o mesmo diretório temporário.
+
+        Returns:
+            dict: A tarefa reservada, ou None se não houver tarefas disponíveis.
+        """
+        def comandos(conexao):
+            consulta = "SELECT id, origem, ref, nome, repo, fonte, tentativas FROM tarefas WHERE estado = ?"
+            if exclusivo:
+                consulta += " AND nome NOT IN (SELECT nome FROM tarefas WHERE estado IN ('baixando', 'baixado', 'ingerindo'))"
+            linha = conexao.execute(consulta + " ORDER BY id LIMIT 1", (estado,)).fetchone()
+            if linha is None:
+                return None
+            conexao.execute("UPDATE tarefas SET estado = ?, atualizado = ? WHERE id = ?", (novo_estado, time.time(), linha[0]))
+            return dict(zip(('id', 'origem', 'ref', 'nome', 'repo', 'fonte', 'tentativas'), linha))
+        return self._transacao(comandos)
+
+    def atualizar(self, id, **campos):
+        """Atualiza os campos de uma tarefa (estado, repo, fonte, tentativas, erro, tokens, custo_usd, fragmentos)."""
+        campos['atualizado'] = time.time()
+        self._transacao(lambda conexao: conexao.execute(
+            f"UPDATE tarefas SET {', '.join(f'{campo} = ?' for campo in campos)} WHERE id = ?", (*campos.values(), id)))
+
+    def contar(self):
+        """
+        Returns:
+            dict: A quantidade de tarefas em cada estado.
+        """
+        with self._lock:
+            return dict(self._conexao.execute("SELECT estado, COUNT(*) FROM tarefas GROUP BY estado"))
+
+    def tarefas(self, estados=None):
+        """
+        Args:
+            estados (tuple, optional): Se informados, retorna apenas as tarefas nesses estados.
+
+        Returns:
+            list: As tarefas, na ordem em que foram adicionadas.
+        """
+        consulta = "SELECT id, origem, ref, estado, repo, tentativas, erro, tokens, custo_usd, fragmentos FROM tarefas"
+        if estados:
+            consulta += " WHERE estado IN (%s)" % ",".join("?" * len(estados))
+        with self._lock:
+            linhas = self._conexao.execute(consulta + " ORDER BY id", tuple(estados or ())).fetchall()
+        return [dict(zip(('id', 'origem', 'ref', 'estado', 'repo', 'tentativas', 'erro', 'tokens', 'custo_usd', 'fragmentos'),
+                         linha)) for linha in linhas]
+
+
+def ingerir_lote(db, manifesto, fila, downloads=4, ingestoes=2, max_baixados=None, custo_maximo=None,
+                 max_concorrencia=MAX_CONCORRENCIA, max_tentativas=MAX_TENTATIVAS):
+    """
+    Esta função processa a fila de ingestão até que todas as tarefas terminem.
+
+    Os downloads (e extrações) e as ingestões (varredura, estimativa de custo, incorporação e gravação)
+    são feitos por grupos de threads separados: enquanto um repositório é incorporado, os próximos já
+    são baixados. No máximo `max_baixados` repositórios ficam baixados à espera da ingestão, para
+    limitar o uso de disco. Cada repositório é registrado no manifesto apenas ao final da sua ingestão.
+
+    Args:
+        db (BaseRepos): A base de dados particionada.
+        manifesto (Manifesto): O manifesto dos repositórios indexados.
+        fila (FilaIngestao): A fila de ingestão.
+        downloads (int, optional): A quantidade de downloads simultâneos.
+        ingestoes (int, optional): A quantidade de repositórios incorporados ao mesmo tempo.
+        max_baixados (int, optional): A quantidade máxima de repositórios baixados à espera (por padrão, 2 * ingestoes).
+        custo_maximo (float, optional): O custo estimado máximo, em USD, de um repositório novo; os mais caros são ignorados.
+        max_concorrencia (int, optional): A quantidade de requisições de incorporação simultâneas de cada ingestão.
+        max_tentativas (int, optional): A quantidade de tentativas de cada etapa de uma tarefa.
+
+    Returns:
+        dict: A quantidade de tarefas em cada estado ao final.
+    """
+    max_baixados = max_baixados or 2 * ingestoes
+    retomadas = fila.retomar()
+    if retomadas:
+        print(f"{retomadas} tarefas interrompidas retomadas")
+    condicao = threading.Condition()
+
+    def falhar(tarefa, estado, erro):
+        # A tarefa volta para a etapa em que estava, ou é marcada com erro depois de max_tentativas
+        tentativas = tarefa['tentativas'] + 1
+        if tentativas < max_tentativas:
+            fila.atualizar(tarefa['id'], estado=estado, tentativas=tentativas, erro=f"{type(erro).__name__}: {erro}")
+        else:
+            fila.atualizar(tarefa['id'], estado='erro', tentativas=tentativas, erro=f"{type(erro).__name__}: {erro}")
+            if tarefa['fonte']:
+                limpar_fonte(tarefa['fonte'])
+        print(f"Falha em {tarefa['origem']} ({tentativas}/{max_tentativas}): {erro}")
+
+    def baixar(tarefa):
+        try:
+            relatorio = RelatorioFiltro()
+            repo, fonte = download_and_extract_repo(tarefa['origem'], tarefa['ref'] or None, relatorio)
+        except Exception as e:
+            falhar(tarefa, 'pendente', e)
+            return
+        if relatorio.arquivos:
+            print(f"{repo}: {relatorio.arquivos} arquivos não extraídos pelo filtro, "
+                  f"cerca de {relatorio.tokens_economizados} tokens economizados")
+        # Fontes locais são lidas no lugar e resolvidas novamente na ingestão; apenas os diretórios baixados são guardados
+        fila.atualizar(tarefa['id'], estado='baixado', repo=tarefa['repo'] or repo,
+                       fonte=None if eh_local(tarefa['origem']) else fonte)
+
+    def ingerir(tarefa):
+        origem, ref = tarefa['origem'], tarefa['ref'] or None
+        try:
+            fonte = tarefa['fonte'] or resolver_fonte_local(origem, ref)[1]
+            repo = tarefa['repo']
+            relatorio = RelatorioFiltro()
+            varredura = escanear_repo(fonte, relatorio=relatorio)
+            tokens, custo_usd = custo_embeddings_repo(fonte, varredura)
+            if custo_maximo is not None and custo_usd > custo_maximo and not manifesto.contem(repo):
+                fila.atualizar(tarefa['id'], estado='ignorado', tokens=tokens, custo_usd=custo_usd,
+                               erro=f"custo estimado de US$ {custo_usd:.2f} acima do limite de US$ {custo_maximo:.2f}")
+                limpar_fonte(fonte)
+                print(f"{repo} ignorado: custo estimado de US$ {custo_usd:.2f}")
+                return
+            db_add_repo_files(db, repo, fonte, varredura=varredura, manifesto=manifesto, max_concorrencia=max_concorrencia,
+                              source_ref=f"{origem}@{ref}" if ref else origem)
+        except Exception as e:
+            falhar(tarefa, 'baixado', e)
+            return
+        limpar_fonte(fonte)
+        fragmentos = manifesto.obter(repo)['chunks']
+        fila.atualizar(tarefa['id'], estado='concluido', erro=None, tokens=tokens, custo_usd=custo_usd, fragmentos=fragmentos)
+        estados = fila.contar()
+        print(f"[{estados.get('concluido', 0)}/{sum(estados.values())}] {repo} concluído: "
+              f"{fragmentos} fragmentos, US$ {custo_usd:.2f}, {relatorio.arquivos} arquivos ignorados")
+
+    def trabalhador(estado, novo_estado, executar, disponivel, exclusivo=False):
+        # Reserva e executa tarefas até que não haja mais nenhuma em andamento na fila
+        while True:
+            with condicao:
+                while True:
+                    tarefa = fila.reservar(estado, novo_estado, exclusivo) if disponivel() else None
+                    if tarefa is not None:
+                        break
+                    if not any(fila.contar().get(ativo) for ativo in ESTADOS_ATIVOS):
+                        condicao.notify_all()
+                        return
+                    condicao.wait(1.0)
+            try:
+                executar(tarefa)
+            finally:
+                with condicao:
+                    condicao.notify_all()
+
+    def pode_baixar():
+        estados = fila.contar()
+        return estados.get('baixando', 0) + estados.get('baixado', 0) < max_baixados
+
+    threads = [threading.Thread(target=trabalhador, args=('pendente', 'baixando', baixar, pode_baixar, True), daemon=True)
+               for _ in range(downloads)]
+    threads += [threading.Thread(target=trabalhador, args=('baixado', 'ingerindo', ingerir, lambda: True), daemon=True)
+                for _ in range(ingestoes)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return fila.contar()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingestão em lote de repositórios, com uma fila persistente e retomável")
+    parser.add_argument('origens', nargs='*', help="URLs do GitHub ou caminhos locais (na branch principal ou na árvore de trabalho)")
+    parser.add_argument('--lista', action='append', default=[],
+                        help="arquivo com uma origem por linha, seguida opcionalmente da branch, tag ou commit")
+    parser.add_argument('--fila', default=FILA_FILE, help="arquivo SQLite da fila de ingestão")
+    parser.add_argument('--downloads', type=int, default=4, help="downloads simultâneos")
+    parser.add_argument('--ingestoes', type=int, default=2, help="repositórios incorporados ao mesmo tempo")
+    parser.add_argument('--concorrencia-incorporacao', type=int, default=MAX_CONCORRENCIA,
+                        help="requisições de incorporação simultâneas de cada ingestão")
+    parser.add_argument('--custo-maximo', type=float, help="custo estimado máximo, em USD, de cada repositório novo")
+    parser.add_argument('--atualizar', action='store_true', help="sincroniza novamente as origens já concluídas")
+    args = parser.parse_args()
+
+    # Verificando se a chave da API da OpenAI está definida
+    if os.getenv('OPENAI_API_KEY') is None:
+        print("Chave da API não encontrada")
+        exit(-1)
+
+    from langchain.embeddings.openai import OpenAIEmbeddings
+    from embeddings import CacheEmbeddings
+    from vectorstore import BaseRepos, migrar_base_legada
+    from manifest import Manifesto
+
+    origens = [(origem, None) for origem in args.origens]
+    for lista in args.lista:
+        origens += ler_origens(lista)
+
+    # Um único processo por fila, para que retomar() não devolva tarefas de outro processo em andamento
+    try:
+        trava = FileLock(f"{args.fila}.lock", timeout=0)
+        trava.acquire()
+    except Timeout:
+        print(f"A fila {args.fila} já está sendo processada por outro processo")
+        exit(1)
+
+    db = BaseRepos(CacheEmbeddings(OpenAIEmbeddings(disallowed_special=())))
+    migrar_base_legada(db)
+    manifesto = Manifesto()
+
+    fila = FilaIngestao(args.fila)
+    print(f"{fila.adicionar(origens, args.atualizar, manifesto)} novas tarefas na fila")
+
+    estados = ingerir_lote(db, manifesto, fila, args.downloads, args.ingestoes, custo_maximo=args.custo_maximo,
+                           max_concorrencia=args.concorrencia_incorporacao)
+    print(f"Ingestão em lote concluída: {estados}")
+    for tarefa in fila.tarefas(('erro', 'ignorado')):
+        print(f"  {tarefa['estado']}: {tarefa['origem']} {tarefa['ref'] or ''} - {tarefa['erro']}")
@@ -2,55 +2,84 @@
 import streamlit as st
 from streamlit_chat import message
 import os
-import pickle
-import shutil
 from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.vectorstores import DeepLake
 from langchain.chat_models import ChatOpenAI
 from langchain.chains import ConversationalRetrievalChain
-from functions import custo_embeddings_repo, db_add_repo_files, download_and_extract_repo
+from embeddings import CacheEmbeddings
+from vectorstore import BaseRepos, migrar_base_legada
+from manifest import Manifesto
+from qa_cache import CacheRespostas, responder
+from streaming import StreamHandler, caminhos_fontes
+from historico import HistoricoChat, criar_resumidor
+from instrumentation import Instrumentacao, usar
+from filtering import RelatorioFiltro
+from functions import custo_embeddings_repo, db_add_repo_files, download_and_extract_repo, escanear_repo, limpar_fonte, get_retriever
 
 # Função para inicializar o banco de dados
+# (compartilhado por todas as sessões do servidor: os datasets e recuperadores são abertos uma única vez)
+@st.cache_resource
 def init_db():
-    # Definindo as embeddings que serão usadas (neste caso, as embeddings da OpenAI)
-    EMBEDDINGS = OpenAIEmbeddings(disallowed_special=())
-    # Inicializando o banco de dados
-    db = DeepLake(embedding_function=EMBEDDINGS)
+    # Definindo as embeddings que serão usadas (neste caso, as embeddings da OpenAI),
+    # envolvidas pelo cache em disco, para não incorporar novamente fragmentos já vistos
+    EMBEDDINGS = CacheEmbeddings(OpenAIEmbeddings(disallowed_special=()))
+    # Inicializando o banco de dados, com um dataset por repositório
+    db = BaseRepos(EMBEDDINGS)
+    # Copia os repositórios da base única antiga, se ela existir
+    migrar_base_legada(db)
     return db
 
-# Função para carregar a lista de repositórios
-def load_repos_list():
-    # Verifica se o arquivo com a lista de repositórios existe
-    if os.path.exists(REPO_LIST_FILE):
-        # Se existir, carrega a lista de repositórios do arquivo
-        with open(REPO_LIST_FILE, 'rb') as file:
-            repo_list = pickle.load(file)
-            # Remove duplicatas da lista de repositórios
-            repo_list = list(dict.fromkeys(repo_list))
-            return repo_list
-    # Se o arquivo não existir, retorna uma lista vazia
-    return []
-
 # Configuração de variáveis globais e estado de sessão
 #OPENAI_API_KEY = #st.secrets["OPENAI_API_KEY"]
 # Obtém a chave da API da OpenAI do ambiente
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-# Define o nome do arquivo onde a lista de repositórios será armazenada
-REPO_LIST_FILE = "repos_list.pkl"
 
-# Se o banco de dados ainda não foi inicializado, inicializa
-if 'db' not in st.session_state:
-    st.session_state.db = init_db()
+# O manifesto dos repositórios e o cache de respostas também são compartilhados por todas as sessões
+@st.cache_resource
+def init_manifesto():
+    return Manifesto()
+
+@st.cache_resource
+def init_qa_cache():
+    return CacheRespostas(embeddings=init_db().embeddings)
+
+# Função para criar a cadeia de perguntas e respostas de um repositório
+# (compartilhada pelas sessões e criada novamente apenas quando o repositório é reindexado)
+@st.cache_resource(max_entries=32)
+def init_qa_chain(repo, versao):
+    retriever = get_retriever(init_db(), repo, versao)
+    #GPT 4 Turbo (com streaming, para exibir a resposta enquanto ela é gerada):
+    model = ChatOpenAI(model='gpt-4-1106-preview', api_key=OPENAI_API_KEY, streaming=True)
+    #GPT 3.5 Turbo:
+    #model = ChatOpenAI(model='gpt-3.5-turbo', api_key=OPENAI_API_KEY, streaming=True)
+    # A reformulação da pergunta usa um modelo sem streaming, para não aparecer na resposta
+    condense_model = ChatOpenAI(model='gpt-3.5-turbo', api_key=OPENAI_API_KEY)
+    return ConversationalRetrievalChain.from_llm(model, retriever=retriever, condense_question_llm=condense_model,
+                                                 return_source_documents=True)
+
+# Função para criar o resumidor do histórico do chat, compartilhado pelas sessões
+@st.cache_resource
+def init_resumidor():
+    return criar_resumidor(ChatOpenAI(model='gpt-3.5-turbo', api_key=OPENAI_API_KEY))
+
+# Medições das etapas da ingestão e das perguntas desta sessão
+if 'instrumentacao' not in st.session_state:
+    st.session_state.instrumentacao = Instrumentacao()
+usar(st.session_state.instrumentacao)
 
-# Se a lista de repositórios ainda não foi carregada, carrega
-if 'repos_list' not in st.session_state:
-    st.session_state.repos_list = load_repos_list()
+db = init_db()
+manifesto = init_manifesto()
+qa_cache = init_qa_cache()
+
+# Lista de repositórios indexados, lida do manifesto a cada execução (inclui os adicionados por outras sessões)
+repos_list = manifesto.repos()
 
 # Função para inicializar o histórico do chat
 def init_chat_history():    
     print("Inicializando chat_history...")
-    # Inicializa o histórico do chat como uma lista vazia
+    # Inicializa o histórico do chat (exibido) como uma lista vazia
     st.session_state.chat_history = []
+    # e o histórico enviado à cadeia, limitado por um orçamento de tokens (os turnos antigos são resumidos)
+    st.session_state.historico = HistoricoChat(resumidor=init_resumidor())
 
 # Se o histórico do chat ainda não foi inicializado, inicializa
 if 'chat_history' not in st.session_state:
@@ -63,23 +92,31 @@ with st.container():
 
     # Seleção de Repositório
     # Cria uma caixa de seleção para o usuário escolher um repositório
-    selected_repo = st.selectbox("Escolha um repositório", options=st.session_state.repos_list + ["Adicionar novo..."])
+    selected_repo = st.selectbox("Escolha um repositório", options=repos_list + ["Adicionar novo..."])
 
     # Se o usuário escolher "Adicionar novo...", pede para ele digitar a URL do repositório
     if selected_repo == "Adicionar novo...":
-        repo_url = st.text_input("Digite a URL do repositório")
+        repo_url = st.text_input("Digite a URL do repositório (ou o caminho de um diretório, repositório git, zip ou tar local)")
+        repo_ref = st.text_input("Branch, tag ou commit (opcional)")
         # Se o usuário clicar no botão "Processar Repositório", faz o download do repositório e calcula o custo para processá-lo
         if st.button("Processar Repositório"):
-            repo_name, destination_folder = download_and_extract_repo(repo_url)
-            total_tokens, custoUSD = custo_embeddings_repo(destination_folder)
-            # Exibe o total de tokens e o custo para o usuário
+            # Arquivos ignorados pelo filtro (binários, gerados, minificados, dependências, .gitignore)
+            relatorio = RelatorioFiltro()
+            repo_name, destination_folder = download_and_extract_repo(repo_url, repo_ref or None, relatorio)
+            st.session_state['source_ref'] = f"{repo_url}@{repo_ref}" if repo_ref else repo_url
+            # Lê os arquivos uma única vez, para a estimativa de custo e para a ingestão
+            varredura = escanear_repo(destination_folder, relatorio=relatorio)
+            total_tokens, custoUSD = custo_embeddings_repo(destination_folder, varredura)
+            # Exibe o total de tokens, o custo e os arquivos ignorados para o usuário
             st.write(f"Total de tokens: {total_tokens}")
             st.write(f"Custo: {custoUSD:.2f} USD")
+            st.text(relatorio.resumo())
             
             # Guarda as informações no estado da sessão
             st.session_state['processar_repositorio'] = True
             st.session_state['repo_name'] = repo_name
             st.session_state['destination_folder'] = destination_folder
+            st.session_state['varredura'] = varredura
 
     # Se o usuário confirmou o processamento do repositório
     if 'processar_repositorio' in st.session_state:
@@ -88,18 +125,21 @@ with st.container():
         # Se o usuário clicar no botão "Não", cancela o processamento do repositório
         if st.button("Não"):
             print("Repositório não adicionado")
-            shutil.rmtree(st.session_state['destination_folder'])            
+            limpar_fonte(st.session_state['destination_folder'])            
             del st.session_state['processar_repositorio']            
+            st.session_state.pop('varredura', None)
             st.experimental_rerun()
             
         # Se o usuário clicar no botão "Sim", adiciona o repositório ao banco de dados
         if st.button("Sim"):
             print("Adicionando repositório...")
-            db_add_repo_files(st.session_state.db, st.session_state['repo_name'], st.session_state['destination_folder'])
-            st.session_state.repos_list.append(st.session_state['repo_name'])
-            with open(REPO_LIST_FILE, 'wb') as file:
-                pickle.dump(st.session_state.repos_list, file)
-            shutil.rmtree(st.session_state['destination_folder'])            
+            # Se o repositório já estiver indexado, sincroniza apenas os arquivos novos, alterados ou removidos
+            # O repositório é registrado no manifesto ao final da ingestão
+            incremental = manifesto.contem(st.session_state['repo_name'])
+            db_add_repo_files(db, st.session_state['repo_name'], st.session_state['destination_folder'],
+                              incremental=incremental, varredura=st.session_state.pop('varredura', None),
+                              manifesto=manifesto, source_ref=st.session_state.get('source_ref'))
+            limpar_fonte(st.session_state['destination_folder'])            
             del st.session_state['processar_repositorio']
             print("Repositório adicionado com sucesso!")
             st.experimental_rerun()
@@ -111,29 +151,59 @@ with st.container():
         print(msg)
         message(msg['message'], is_user=msg['is_user'])    
 
-# Se o chat ainda não foi inicializado ou se o repositório selecionado mudou, inicializa o chat
-if 'qa_chain' not in st.session_state or selected_repo != st.session_state.get('last_repo', None):
-    retriever = st.session_state.db.as_retriever(search_kwargs={'distance_metric': 'cos', 'fetch_k': 100, 'maximal_marginal_relevance': True, 'k': 10, 'filter': {'metadata': { 'repo': selected_repo }}})    
-    #GPT 4 Turbo:
-    model = ChatOpenAI(model='gpt-4-1106-preview', api_key=OPENAI_API_KEY)
-    #GPT 3.5 Turbo:
-    #model = ChatOpenAI(model='gpt-3.5-turbo', api_key=OPENAI_API_KEY)
-    st.session_state.qa_chain = ConversationalRetrievalChain.from_llm(model, retriever=retriever)
-    st.session_state.last_repo = selected_repo
-    init_chat_history()
+# Obtém a cadeia do repositório selecionado (apenas para repositórios indexados, para não criar um dataset vazio para "Adicionar novo...")
+# e, se o repositório selecionado mudou, reinicia o histórico do chat
+versao_repo = manifesto.versao(selected_repo)
+if selected_repo in repos_list:
+    st.session_state.qa_chain = init_qa_chain(selected_repo, versao_repo)
+    if selected_repo != st.session_state.get('last_repo', None):
+        st.session_state.last_repo = selected_repo
+        init_chat_history()
+else:
+    st.session_state.pop('qa_chain', None)
+
+# Painel de desempenho: as etapas da última ingestão e da última pergunta e o resumo da sessão
+with st.sidebar:
+    st.header("Desempenho")
+    instrumentacao = st.session_state.instrumentacao
+    for titulo, operacao in (("Última ingestão", "ingestao"), ("Última pergunta", "pergunta")):
+        registros = instrumentacao.ultima_operacao(operacao)
+        if registros:
+            st.subheader(titulo)
+            st.table([{'etapa': registro['etapa'], 'segundos': registro['duracao_s'],
+                       'detalhes': ", ".join(f"{chave}={valor}" for chave, valor in registro.items()
+                                             if chave not in ('instante', 'etapa', 'duracao_s', 'operacao') and valor is not None)}
+                      for registro in registros])
+    resumo = instrumentacao.resumo()
+    if resumo:
+        st.subheader("Sessão")
+        st.table([{'etapa': nome, 'n': agregado['n'], 'total (s)': agregado['total_s'], 'média (s)': agregado['media_s']}
+                  for nome, agregado in resumo.items()])
+        st.download_button("Exportar medições (JSON lines)", instrumentacao.jsonl(), file_name="metricas.jsonl",
+                           mime="application/jsonl")
 
 # Cria uma caixa de texto para o usuário digitar sua pergunta
-user_input = st.chat_input('Digite sua pergunta', key="chat_input")
+user_input = st.chat_input('Digite sua pergunta', key="chat_input", disabled='qa_chain' not in st.session_state)
 if user_input:    
-    # Converte o histórico do chat para o formato LangChain
-    langchain_history = [(msg["message"], "user" if msg["is_user"] else "system") for msg in st.session_state.chat_history]
+    # Histórico no formato LangChain: pares (pergunta, resposta) dentro do orçamento de tokens
+    langchain_history = st.session_state.historico.para_cadeia()
+
+    # Exibe a pergunta e, enquanto a resposta é gerada, as fontes recuperadas e os tokens recebidos
+    message(user_input, is_user=True)
+    fontes_placeholder = st.empty()
+    resposta_placeholder = st.empty()
+    handler = StreamHandler(
+        ao_receber_token=lambda token, texto: resposta_placeholder.markdown(texto + "▌"),
+        ao_recuperar=lambda documentos: fontes_placeholder.caption("Fontes: " + ", ".join(caminhos_fontes(documentos))))
 
-    # Processa a pergunta do usuário
-    result = st.session_state.qa_chain({"question": user_input, "chat_history": langchain_history})
+    # Processa a pergunta do usuário (ou reaproveita a resposta do cache, se a mesma pergunta já foi feita)
+    result = responder(st.session_state.qa_chain, qa_cache, selected_repo, versao_repo, user_input, langchain_history,
+                       callbacks=[handler])
 
     # Adiciona a pergunta e a resposta ao histórico do chat
     st.session_state.chat_history.append({"message": user_input, "is_user": True})
     st.session_state.chat_history.append({"message": result['answer'], "is_user": False})
+    st.session_state.historico.adicionar(user_input, result['answer'])
 
     # Atualiza a página
     st.experimental_rerun()
\ No newline at end of file
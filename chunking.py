@@ -0,0 +1,303 @@
+import os
+import re
+import ast
+from collections import namedtuple
+
+# Tamanho máximo de um fragmento, em caracteres
+TAMANHO_FRAGMENTO = int(os.getenv('REPOCHAT_TAMANHO_FRAGMENTO', 1500))
+
+# Versão do fragmentador, registrada nos metadados: quando ela muda, a sincronização incremental
+# fragmenta novamente os arquivos já indexados
+VERSAO_FRAGMENTADOR = 5
+
+# Linguagens com blocos delimitados por chaves
+EXTENSOES_CHAVES = {"js", "ts", "tsx", "jsx", "css", "scss", "less", "java", "cpp", "h", "c", "php",
+                    "go", "swift", "kt", "cs", "rs", "sh", "pl", "ps1"}
+
+# Fragmento de um arquivo: o texto, o símbolo (função, classe, seletor ou título) e as linhas, a partir de 1
+Fragmento = namedtuple('Fragmento', ['texto', 'simbolo', 'linha_inicial', 'linha_final'])
+
+# Trecho de um arquivo, com as linhas (a partir de 0, inclusive), o símbolo e uma função que retorna os subtrechos
+Segmento = namedtuple('Segmento', ['inicio', 'fim', 'simbolo', 'filhos'])
+
+PADROES_SIMBOLO = [
+    # function, class, interface, struct, fn, func, def etc., com os modificadores mais comuns
+    re.compile(r'^\s*(?:export\s+|default\s+|public\s+|private\s+|protected\s+|internal\s+|static\s+|abstract\s+|final\s+|'
+               r'async\s+|override\s+|open\s+|sealed\s+|data\s+|pub(?:\([^)]*\))?\s+|unsafe\s+|partial\s+)*'
+               r'(?:function\*?|class|interface|enum|struct|trait|impl|module|def|fn|fun|sub|object|namespace|procedure)\s+'
+               r'(?:self\.)?([A-Za-z_$][\w$]*)'),
+    # Go: func (r *Tipo) Nome(
+    re.compile(r'^\s*func\s+(?:\([^)]*\)\s*)?([A-Za-z_]\w*)'),
+    # JavaScript: const nome = (...) => / const nome = function
+    re.compile(r'^\s*(?:export\s+)?(?:const|let|var)\s+([A-Za-z_$][\w$]*)\s*=\s*(?:async\s*)?(?:function|\(|[A-Za-z_$][\w$]*\s*=>)'),
+    # Shell: nome() {
+    re.compile(r'^\s*(?:function\s+)?([A-Za-z_][\w-]*)\s*\(\)\s*\{?\s*$'),
+    # C, C++, Java, C#: tipo nome(argumentos) {
+    re.compile(r'^\s*(?:[A-Za-z_][\w<>\[\]:,*&\s]*?[\s*&])?([A-Za-z_~][\w:~]*)\s*\([^;]*$'),
+    # CSS, SCSS, Less: seletor {
+    re.compile(r'^\s*([.#@:&*\w\[][^{;()=]*?)\s*\{\s*$'),
+]
+
+# Palavras-chave que os padrões acima podem confundir com símbolos
+PALAVRAS_RESERVADAS = {'if', 'for', 'foreach', 'while', 'switch', 'catch', 'return', 'else', 'elif', 'try', 'do', 'finally', 'using', 'lock'}
+
+# Linhas que fecham um bloco aberto em uma linha anterior
+PADRAO_FECHAMENTO = re.compile(r'^\s*(?:[}\])]|end\b|</|else\b|elif\b|elsif\b|except\b|finally\b|catch\b|rescue\b|ensure\b)')
+
+PADRAO_TITULO_MD = re.compile(r'^(#{1,6})\s+(.*?)\s*#*\s*$')
+
+# Linhas terminadas apenas por \r\n, \r ou \n, como no módulo ast (str.splitlines também separa em \x0c, \x1c, \u2028 etc.)
+PADRAO_LINHA = re.compile(r'[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+')
+
+PADRAO_LITERAIS = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|`(?:\\.|[^`\\])*`')
+PADRAO_COMENTARIO = re.compile(r'//.*|/\*.*?\*/')
+
+# Linguagens em que "#" também inicia um comentário de linha (no CSS, por exemplo, "#header {" é um seletor).
+# O "#" só inicia um comentário no início da linha ou depois de um espaço ("${#arr[@]}" e "$#lista" não são comentários)
+EXTENSOES_COMENTARIO_CERQUILHA = {"sh", "pl", "ps1", "php"}
+PADRAO_COMENTARIO_CERQUILHA = re.compile(r'//.*|(?:^|(?<=\s))#.*|/\*.*?\*/')
+
+
+def simbolo_linha(linha):
+    """
+    Esta função identifica o símbolo (função, classe etc.) definido em uma linha de código.
+
+    Args:
+        linha (str): A linha de código.
+
+    Returns:
+        str: O nome do símbolo, ou None se a linha não definir um símbolo reconhecido.
+    """
+    for padrao in PADROES_SIMBOLO:
+        encontrado = padrao.match(linha)
+        if encontrado and encontrado.group(1).split()[0] not in PALAVRAS_RESERVADAS:
+            return encontrado.group(1)
+    return None
+
+
+def _qualificar(pai, nome):
+    return f"{pai}.{nome}" if pai and nome else nome or pai
+
+
+def _cobrir(inicio, fim, filhos, simbolo_pai):
+    """Completa os subtrechos com os intervalos entre eles, atribuídos ao símbolo do trecho pai."""
+    resultado = []
+    atual = inicio
+    for filho in filhos:
+        if filho.inicio > atual:
+            resultado.append(Segmento(atual, filho.inicio - 1, simbolo_pai, None))
+        resultado.append(filho)
+        atual = filho.fim + 1
+    if atual <= fim:
+        resultado.append(Segmento(atual, fim, simbolo_pai, None))
+    return resultado
+
+
+def segmentos_python(texto):
+    """
+    Esta função divide um arquivo Python nas suas definições de nível superior, usando o módulo ast.
+    As classes podem ser subdivididas nos seus métodos.
+
+    Args:
+        texto (str): O conteúdo do arquivo.
+
+    Returns:
+        list: Os segmentos do arquivo, ou None se o arquivo tiver erros de sintaxe.
+    """
+    try:
+        arvore = ast.parse(texto)
+    except (SyntaxError, ValueError):
+        return None
+
+    def segmentos(nos, pai):
+        resultado = []
+        for no in nos:
+            inicio = min([no.lineno] + [decorador.lineno for decorador in getattr(no, 'decorator_list', [])]) - 1
+            if isinstance(no, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                simbolo = _qualificar(pai, no.name)
+                filhos = (lambda no=no, simbolo=simbolo: segmentos(no.body, simbolo)) if isinstance(no, ast.ClassDef) else None
+            else:
+                simbolo, filhos = pai, None
+            # Instruções consecutivas que não são definições ficam no mesmo segmento
+            if resultado and filhos is None and simbolo == pai and resultado[-1].filhos is None and resultado[-1].simbolo == pai:
+                resultado[-1] = resultado[-1]._replace(fim=no.end_lineno - 1)
+            else:
+                resultado.append(Segmento(inicio, no.end_lineno - 1, simbolo, filhos))
+        return resultado
+
+    return segmentos(arvore.body, None)
+
+
+def _segmentos_por_nivel(linhas, niveis, inicio, fim, nivel, pai, subnivel):
+    """
+    Divide as linhas [inicio, fim] nos trechos que começam no nível `nivel` (profundidade de chaves ou indentação).
+    Linhas que fecham um bloco e linhas em branco continuam o trecho anterior.
+    """
+    resultado = []
+    for i in range(inicio, fim + 1):
+        linha = linhas[i]
+        if niveis[i] != nivel or not linha.strip() or PADRAO_FECHAMENTO.match(linha):
+            continue
+        resultado.append((i, simbolo_linha(linha)))
+
+    segmentos = []
+    for posicao, (comeco, simbolo) in enumerate(resultado):
+        termino = resultado[posicao + 1][0] - 1 if posicao + 1 < len(resultado) else fim
+        simbolo = _qualificar(pai, simbolo)
+        filhos = (lambda comeco=comeco, termino=termino, simbolo=simbolo:
+                  subnivel(comeco + 1, termino, simbolo, niveis[comeco]))
+        segmentos.append(Segmento(comeco, termino, simbolo, filhos))
+    return _cobrir(inicio, fim, segmentos, pai)
+
+
+def segmentos_chaves(linhas, comentario=PADRAO_COMENTARIO):
+    """
+    Esta função divide um arquivo de uma linguagem com blocos delimitados por chaves nos seus blocos
+    de nível superior, contando as chaves fora de strings e comentários de linha.
+    Os blocos podem ser subdivididos nos blocos do nível seguinte (por exemplo, os métodos de uma classe).
+
+    Args:
+        linhas (list): As linhas do arquivo.
+        comentario (re.Pattern, optional): O padrão dos comentários da linguagem.
+
+    Returns:
+        list: Os segmentos do arquivo.
+    """
+    niveis = []
+    profundidade = 0
+    for linha in linhas:
+        niveis.append(profundidade)
+        codigo = comentario.sub('', PADRAO_LITERAIS.sub('""', linha))
+        profundidade = max(0, profundidade + codigo.count('{') - codigo.count('}'))
+
+    def subnivel(inicio, fim, pai, nivel):
+        if inicio > fim:
+            return []
+        return _segmentos_por_nivel(linhas, niveis, inicio, fim, nivel + 1, pai, subnivel)
+
+    return _segmentos_por_nivel(linhas, niveis, 0, len(linhas) - 1, 0, None, subnivel)
+
+
+def segmentos_indentacao(linhas):
+    """
+    Esta função divide um arquivo pelas linhas sem indentação e, dentro de cada trecho, pelo nível
+    de indentação seguinte. É usada nas linguagens sem um analisador específico (YAML, Ruby, SQL etc.).
+
+    Args:
+        linhas (list): As linhas do arquivo.
+
+    Returns:
+        list: Os segmentos do arquivo.
+    """
+    niveis = [len(linha.expandtabs(4)) - len(linha.expandtabs(4).lstrip()) if linha.strip() else -1 for linha in linhas]
+
+    def subnivel(inicio, fim, pai, nivel):
+        internos = [niveis[i] for i in range(inicio, fim + 1) if niveis[i] > nivel]
+        if not internos:
+            return []
+        return _segmentos_por_nivel(linhas, niveis, inicio, fim, min(internos), pai, subnivel)
+
+    return subnivel(0, len(linhas) - 1, None, -1)
+
+
+def segmentos_markdown(linhas):
+    """
+    Esta função divide um arquivo Markdown pelos seus títulos.
+
+    Args:
+        linhas (list): As linhas do arquivo.
+
+    Returns:
+        list: Os segmentos do arquivo.
+    """
+    titulos = [(i, PADRAO_TITULO_MD.match(linha).group(2)) for i, linha in enumerate(linhas) if PADRAO_TITULO_MD.match(linha)]
+    segmentos = [Segmento(inicio, titulos[posicao + 1][0] - 1 if posicao + 1 < len(titulos) else len(linhas) - 1, titulo, None)
+                 for posicao, (inicio, titulo) in enumerate(titulos)]
+    return _cobrir(0, len(linhas) - 1, segmentos, None)
+
+
+def _limitar(linhas, segmentos, tamanho_maximo):
+    """Subdivide os segmentos maiores que o tamanho máximo, pelos subtrechos ou, na falta deles, pelas linhas."""
+    for segmento in segmentos:
+        tamanho = sum(len(linha) for linha in linhas[segmento.inicio:segmento.fim + 1])
+        if tamanho <= tamanho_maximo:
+            yield segmento
+            continue
+        filhos = segmento.filhos() if segmento.filhos else []
+        if filhos:
+            yield from _limitar(linhas, _cobrir(segmento.inicio, segmento.fim, filhos, segmento.simbolo), tamanho_maximo)
+            continue
+
+        # Sem subtrechos: agrupa as linhas (uma linha maior que o tamanho máximo forma um segmento sozinha)
+        comeco, acumulado = segmento.inicio, 0
+        for i in range(segmento.inicio, segmento.fim + 1):
+            if acumulado and acumulado + len(linhas[i]) > tamanho_maximo:
+                yield Segmento(comeco, i - 1, segmento.simbolo, None)
+                comeco, acumulado = i, 0
+            acumulado += len(linhas[i])
+        yield Segmento(comeco, segmento.fim, segmento.simbolo, None)
+
+
+def _simbolos(simbolos):
+    return ", ".join(dict.fromkeys(simbolo for simbolo in simbolos if simbolo)) or None
+
+
+def fragmentar_codigo(texto, caminho, tamanho_maximo=TAMANHO_FRAGMENTO):
+    """
+    Esta função divide o conteúdo de um arquivo em fragmentos que respeitam os limites das funções,
+    classes e blocos da linguagem, escolhida pela extensão do arquivo: Python pelo módulo ast,
+    linguagens com chaves pela contagem das chaves, Markdown pelos títulos e as demais pela indentação.
+
+    Definições maiores que `tamanho_maximo` são subdivididas (por exemplo, uma classe nos seus métodos)
+    e definições pequenas e vizinhas são agrupadas no mesmo fragmento, até `tamanho_maximo`.
+
+    Args:
+        texto (str): O conteúdo do arquivo.
+        caminho (str): O caminho do arquivo (usado apenas para obter a extensão).
+        tamanho_maximo (int, optional): O tamanho máximo de um fragmento, em caracteres.
+
+    Returns:
+        list: Os fragmentos (Fragmento) do arquivo, com o símbolo e as linhas de cada um.
+    """
+    linhas = PADRAO_LINHA.findall(texto)
+    if not linhas:
+        return []
+
+    extensao = os.path.splitext(caminho)[1][1:].lower()
+    segmentos = None
+    if extensao == "py":
+        segmentos = segmentos_python(texto)
+        if segmentos is not None:
+            segmentos = _cobrir(0, len(linhas) - 1, segmentos, None)
+    if segmentos is None:
+        if extensao in EXTENSOES_CHAVES:
+            comentario = PADRAO_COMENTARIO_CERQUILHA if extensao in EXTENSOES_COMENTARIO_CERQUILHA else PADRAO_COMENTARIO
+            segmentos = segmentos_chaves(linhas, comentario)
+        elif extensao == "md":
+            segmentos = segmentos_markdown(linhas)
+        else:
+            segmentos = segmentos_indentacao(linhas)
+
+    # Agrupa os segmentos vizinhos enquanto couberem em um fragmento
+    grupos = []
+    for segmento in _limitar(linhas, segmentos, tamanho_maximo):
+        trecho = linhas[segmento.inicio:segmento.fim + 1]
+        tamanho = sum(len(linha) for linha in trecho)
+        # Trechos em branco não acrescentam o seu símbolo ao fragmento
+        simbolos = [segmento.simbolo] if any(linha.strip() for linha in trecho) else []
+        if grupos and grupos[-1][2] + tamanho <= tamanho_maximo:
+            inicio, _, acumulado, anteriores = grupos[-1]
+            grupos[-1] = (inicio, segmento.fim, acumulado + tamanho, anteriores + simbolos)
+        else:
+            grupos.append((segmento.inicio, segmento.fim, tamanho, simbolos))
+
+    fragmentos = []
+    for inicio, fim, _, simbolos in grupos:
+        conteudo = "".join(linhas[inicio:fim + 1])
+        if not conteudo.strip():
+            continue
+        # Uma única linha maior que o tamanho máximo (por exemplo, código minificado) é cortada
+        partes = [conteudo[posicao:posicao + tamanho_maximo] for posicao in range(0, len(conteudo), tamanho_maximo)] \
+            if fim == inicio else [conteudo]
+        fragmentos.extend(Fragmento(parte, _simbolos(simbolos), inicio + 1, fim + 1) for parte in partes)
+    return fragmentos
@@ -1,65 +1,77 @@
 import os
-import pickle
+import json
+import argparse
 
 # Importando as bibliotecas necessárias
 from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.vectorstores import DeepLake
-from langchain.document_loaders import TextLoader
-from langchain.text_splitter import CharacterTextSplitter
 from langchain.chat_models import ChatOpenAI
 from langchain.chains import ConversationalRetrievalChain
-from deeplake.core.dataset import Dataset
 import inquirer
-import shutil
 
 # Importando as funções definidas em outro arquivo
-from functions import custo_embeddings_repo, db_add_repo_files, download_and_extract_repo
+from embeddings import CacheEmbeddings
+from vectorstore import BaseRepos, migrar_base_legada
+from manifest import Manifesto
+from qa_cache import CacheRespostas, responder
+from streaming import StreamHandler, caminhos_fontes
+from historico import HistoricoChat, criar_resumidor
+from instrumentation import PADRAO as instrumentacao, formatar
+from batch import CONCORRENCIA_LOTE, ler_perguntas, responder_lote
+from filtering import RelatorioFiltro
+from functions import custo_embeddings_repo, db_add_repo_files, download_and_extract_repo, escanear_repo, limpar_fonte, get_retriever
+
+db = None
+manifesto = None
+qa_cache = None
+repoName = None
+qa_chain = None
 
-# Verificando se a chave da API da OpenAI está definida
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-if OPENAI_API_KEY is None:
-    print("Chave da API não encontrada")
-    exit(-1)
+# Função para inicializar o banco de dados, o manifesto e o cache de respostas
+def inicializar():
+    global db
+    global manifesto
+    global qa_cache
 
-# Definindo as embeddings que serão usadas (neste caso, as embeddings da OpenAI)
-EMBEDDINGS = OpenAIEmbeddings(disallowed_special=())
+    # Definindo as embeddings que serão usadas (neste caso, as embeddings da OpenAI),
+    # envolvidas pelo cache em disco, para não incorporar novamente fragmentos já vistos
+    embeddings = CacheEmbeddings(OpenAIEmbeddings(disallowed_special=()))
 
-print("Inicializando banco de dados...")
+    print("Inicializando banco de dados...")
 
-# Removendo o arquivo de bloqueio do banco de dados, se existir
-arquivo_lock = "deeplake/dataset_lock.lock"
-if os.path.exists(arquivo_lock):
-    os.remove(arquivo_lock)
+    # Inicializando o banco de dados, com um dataset por repositório
+    db = BaseRepos(embeddings)
 
-# Inicializando o banco de dados
-db = DeepLake(embedding_function=EMBEDDINGS)
+    # Copiando os repositórios da base única antiga, se ela existir
+    migrar_base_legada(db)
 
-print("Banco de dados inicializado! ")
+    print("Banco de dados inicializado! ")
 
-# Definindo o arquivo onde a lista de repositórios será armazenada
-REPO_LIST_FILE = "repos_list.pkl"
+    # Abrindo o manifesto dos repositórios indexados
+    manifesto = Manifesto()
 
-# Inicializando a lista de repositórios
-repos_list = [ ]
-repoName = None
-qa_chain = None
+    # Abrindo o cache de respostas
+    qa_cache = CacheRespostas(embeddings=embeddings)
 
-# Carregando a lista de repositórios do arquivo, se ele existir
-if os.path.exists(REPO_LIST_FILE):
-    with open(REPO_LIST_FILE, 'rb') as file:
-        repos_list = pickle.load(file)
+# Função para criar a cadeia de perguntas e respostas de um repositório
+def criar_cadeia(repo, streaming=True):
+    retriever = get_retriever(db, repo, manifesto.versao(repo))
+    # O modelo da resposta usa streaming (no modo interativo), para exibi-la enquanto é gerada;
+    # a reformulação da pergunta usa um modelo sem streaming, para não aparecer na resposta
+    model = ChatOpenAI(model='gpt-3.5-turbo', streaming=streaming)
+    condense_model = ChatOpenAI(model='gpt-3.5-turbo')
+    return ConversationalRetrievalChain.from_llm(model, retriever=retriever, condense_question_llm=condense_model,
+                                                 return_source_documents=True)
 
 # Função para selecionar um repositório
 def seleciona_repo():
     global repoName
-    global repos_list
     global qa_chain    
 
     # Pergunta ao usuário qual repositório ele deseja trabalhar
     questions = [
         inquirer.List('repo',
                     message="Qual repositório você deseja trabalhar?",
-                    choices=repos_list + ["Outro..."],
+                    choices=manifesto.repos() + ["Outro..."],
                 ),
     ]
 
@@ -70,23 +82,31 @@ def seleciona_repo():
     if repoName == "Outro...":
         questions = [
             inquirer.Text('repoURL',
-                        message="Digite a URL do repositório"),
+                        message="Digite a URL do repositório (ou o caminho de um diretório, repositório git, zip ou tar local)"),
+            inquirer.Text('repoRef',
+                        message="Branch, tag ou commit (opcional)"),
         ]
 
         answers_other = inquirer.prompt(questions)
 
         # Adiciona o repositório ao banco de dados
         repoURL = answers_other['repoURL']
+        repoRef = answers_other['repoRef'] or None
 
         assert repoURL is not None, "URL do repositório vazia, abortando..."
-        repoName, destination_folder = download_and_extract_repo(repoURL)
+        # Arquivos ignorados pelo filtro (binários, gerados, minificados, dependências, .gitignore)
+        relatorio = RelatorioFiltro()
+        repoName, destination_folder = download_and_extract_repo(repoURL, repoRef, relatorio)
 
         # Calcula o custo de adicionar o repositório ao banco de dados
-        total_tokens, custoUSD = custo_embeddings_repo(destination_folder)
+        # (os arquivos são lidos uma única vez, para a estimativa de custo e para a ingestão)
+        varredura = escanear_repo(destination_folder, relatorio=relatorio)
+        total_tokens, custoUSD = custo_embeddings_repo(destination_folder, varredura)
 
-        # Exibe o custo em USD
+        # Exibe o custo em USD e os arquivos ignorados
         print(f"Número total de tokens: {total_tokens}")
         print(f"Custo em USD: {custoUSD:.2f}")
+        print(relatorio.resumo())
 
         # Confirma a geração dos embeddings
         questions = [
@@ -99,44 +119,96 @@ def seleciona_repo():
         confirmacao = answers_other['confirmacao']
 
         if confirmacao:
-            # Gera os embeddings
-            db_add_repo_files(db, repoName, destination_folder)
-            
-            # Adicionando na lista de repositórios e salvando no disco
-            repos_list.append(repoName)
-            with open(REPO_LIST_FILE, 'wb') as file:
-                pickle.dump(repos_list, file)
+            # Gera os embeddings (apenas dos arquivos novos ou alterados, se o repositório já estiver indexado)
+            # e registra o repositório no manifesto ao final da ingestão
+            incremental = manifesto.contem(repoName)
+            db_add_repo_files(db, repoName, destination_folder, incremental=incremental, varredura=varredura,
+                              manifesto=manifesto, source_ref=f"{repoURL}@{repoRef}" if repoRef else repoURL)
 
-            # Apagando a pasta do repositório 
-            shutil.rmtree(destination_folder)    
+            # Apagando a pasta temporária do repositório (fontes locais são mantidas)
+            limpar_fonte(destination_folder)
 
             print("Embeddings gerados com sucesso!")
+            print(formatar(instrumentacao.ultima_operacao('ingestao')))
         else:
             print("Geração dos embeddings cancelada.")
             exit(0)
 
     # Seleciona o repositório escolhido pelo usuário
-    retriever = db.as_retriever( search_kwargs={'distance_metric': 'cos', 'fetch_k': 100, 'maximal_marginal_relevance': True, 'k': 10, 'filter': {'metadata': { 'repo': repoName }}})
-    model = ChatOpenAI(model='gpt-3.5-turbo')
-    qa_chain = ConversationalRetrievalChain.from_llm(model,retriever=retriever)
-
-# Chamando a função para selecionar um repositório
-seleciona_repo()
-
-# Inicializando o histórico do chat
-chat_history = []
-
-print("Inicializando chatbot...")
-# Loop principal do chatbot
-while True:
-    print(" para sair, digite \"exit\" ou \"sair\", para voltar a seleção de repositório, digite \"voltar\"")
-    question = input(f"({repoName}) - Digite sua pergunta: ")
-    if question == "exit"  or question == "sair" or question == "":
-        break;
-    if question == "voltar":
-        seleciona_repo()
-        chat_history = []
-        continue
-    result = qa_chain({"question": question, "chat_history": chat_history})
-    chat_history.append((question, result['answer']))    
-    print(f" >>>>> : {result['answer']} \n")
\ No newline at end of file
+    qa_chain = criar_cadeia(repoName)
+
+# Função do chat interativo
+def conversar():
+    # Chamando a função para selecionar um repositório
+    seleciona_repo()
+
+    # Inicializando o histórico do chat, limitado por um orçamento de tokens (os turnos antigos são resumidos)
+    chat_history = HistoricoChat(resumidor=criar_resumidor(ChatOpenAI(model='gpt-3.5-turbo')))
+
+    print("Inicializando chatbot...")
+    # Loop principal do chatbot
+    while True:
+        print(" para sair, digite \"exit\" ou \"sair\", para voltar a seleção de repositório, digite \"voltar\"")
+        question = input(f"({repoName}) - Digite sua pergunta: ")
+        if question == "exit"  or question == "sair" or question == "":
+            # Exibe o resumo das medições da sessão
+            print("Desempenho da sessão:")
+            for nome, agregado in instrumentacao.resumo().items():
+                print(f"  {nome}: {agregado['n']}x, total {agregado['total_s']:.3f}s, média {agregado['media_s']:.3f}s")
+            break;
+        if question == "voltar":
+            seleciona_repo()
+            chat_history.limpar()
+            continue
+        # Exibe as fontes assim que a busca termina e a resposta token a token
+        handler = StreamHandler(
+            ao_receber_token=lambda token, texto: print((" >>>>> : " if texto == token else "") + token, end="", flush=True),
+            ao_recuperar=lambda documentos: print(f" Fontes: {', '.join(caminhos_fontes(documentos))}"))
+
+        # Processa a pergunta (ou reaproveita a resposta do cache, se a mesma pergunta já foi feita)
+        result = responder(qa_chain, qa_cache, repoName, manifesto.versao(repoName), question, chat_history.para_cadeia(), callbacks=[handler])
+        chat_history.adicionar(question, result['answer'])
+        if result['cache']:
+            print(f" Fontes: {', '.join(caminhos_fontes(result['sources']))}")
+            print(f" >>>>> (cache) : {result['answer']} \n")
+        else:
+            print(" \n")
+        # Exibe a duração de cada etapa da pergunta (busca, chamadas ao modelo)
+        print(" | ".join(f"{registro['etapa']} {registro['duracao_s']:.2f}s" for registro in instrumentacao.ultima_operacao('pergunta')) + "\n")
+
+# Função do modo em lote: responde às perguntas de um arquivo JSON lines, sem interação
+def executar_lote(args):
+    if not manifesto.contem(args.repo):
+        print(f"Repositório {args.repo} não encontrado. Repositórios indexados: {', '.join(manifesto.repos())}")
+        exit(1)
+
+    # A cadeia é compartilhada por todas as perguntas, sem streaming
+    cadeia = criar_cadeia(args.repo, streaming=False)
+    resumo = responder_lote(cadeia, qa_cache, args.repo, manifesto.versao(args.repo), ler_perguntas(args.perguntas),
+                            args.saida, args.concorrencia)
+    print(json.dumps(resumo, ensure_ascii=False, indent=2))
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat com repositórios de código. Sem argumentos, abre o chat interativo; "
+                                                 "com --repo e --perguntas, responde a um lote de perguntas sem interação.")
+    parser.add_argument('--repo', help="repositório indexado (como listado no manifesto) usado no modo em lote")
+    parser.add_argument('--perguntas', help="arquivo JSON lines com as perguntas do modo em lote")
+    parser.add_argument('--saida', default="respostas.jsonl", help="arquivo JSON lines das respostas do modo em lote")
+    parser.add_argument('--concorrencia', type=int, default=CONCORRENCIA_LOTE, help="perguntas respondidas ao mesmo tempo no modo em lote")
+    args = parser.parse_args()
+    if bool(args.repo) != bool(args.perguntas):
+        parser.error("o modo em lote precisa de --repo e --perguntas")
+
+    # Verificando se a chave da API da OpenAI está definida
+    if os.getenv('OPENAI_API_KEY') is None:
+        print("Chave da API não encontrada")
+        exit(-1)
+
+    inicializar()
+    if args.perguntas:
+        executar_lote(args)
+    else:
+        conversar()
+
+if __name__ == "__main__":
+    main()
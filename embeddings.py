@@ -0,0 +1,378 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import hashlib
+import threading
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from langchain.embeddings.base import Embeddings
+from instrumentation import registrar
+from vectorstore import nome_particao
+
+# Quantidade de fragmentos enviados em cada requisição de incorporação
+TAMANHO_LOTE = int(os.getenv('REPOCHAT_TAMANHO_LOTE', 100))
+
+# Quantidade máxima de requisições de incorporação simultâneas
+MAX_CONCORRENCIA = int(os.getenv('REPOCHAT_MAX_CONCORRENCIA', 4))
+
+# Quantidade máxima de tentativas de um lote antes de desistir
+MAX_TENTATIVAS = 8
+
+# Diretório onde ficam os checkpoints das ingestões em andamento
+CHECKPOINT_DIR = "checkpoints"
+
+# Arquivo do cache de incorporações e seu tamanho máximo, em MB
+CACHE_FILE = os.getenv('REPOCHAT_CACHE_EMBEDDINGS', "embeddings_cache.db")
+CACHE_MAX_MB = int(os.getenv('REPOCHAT_CACHE_MAX_MB', 1024))
+
+
+def agrupar(iteravel, tamanho):
+    """
+    Esta função agrupa os itens de um iterável em listas de tamanho fixo, sem carregar o iterável inteiro na memória.
+
+    Args:
+        iteravel (iterable): Os itens a serem agrupados.
+        tamanho (int): A quantidade de itens de cada grupo. O último grupo pode ser menor.
+
+    Yields:
+        list: Os grupos de itens.
+    """
+    grupo = []
+    for item in iteravel:
+        grupo.append(item)
+        if len(grupo) == tamanho:
+            yield grupo
+            grupo = []
+    if grupo:
+        yield grupo
+
+
+def mapear_em_ordem(executor, funcao, iteravel, max_pendentes):
+    """
+    Esta função aplica uma função aos itens de um iterável em um executor, como executor.map,
+    mas consome o iterável sob demanda: no máximo `max_pendentes` itens ficam na memória ao mesmo tempo.
+
+    Args:
+        executor (Executor): O executor onde a função será executada.
+        funcao (callable): A função aplicada a cada item.
+        iteravel (iterable): Os itens.
+        max_pendentes (int): A quantidade máxima de itens submetidos e ainda não consumidos.
+
+    Yields:
+        Os resultados da função, na ordem dos itens.
+    """
+    pendentes = deque()
+    for item in iteravel:
+        pendentes.append(executor.submit(funcao, item))
+        while pendentes and (pendentes[0].done() or len(pendentes) >= max_pendentes):
+            yield pendentes.popleft().result()
+    while pendentes:
+        yield pendentes.popleft().result()
+
+
+def eh_rate_limit(erro):
+    """
+    Esta função verifica se uma exceção indica que o limite de requisições da API foi atingido (HTTP 429).
+
+    Args:
+        erro (Exception): A exceção lançada pela chamada de incorporação.
+
+    Returns:
+        bool: True se a exceção indicar limite de requisições, False caso contrário.
+    """
+    if type(erro).__name__ == 'RateLimitError':
+        return True
+    status = getattr(erro, 'status_code', None) or getattr(getattr(erro, 'response', None), 'status_code', None)
+    return status == 429
+
+
+class ControleTaxa:
+    """
+    Backoff adaptativo compartilhado por todas as threads de incorporação.
+
+    Quando uma requisição recebe um erro de limite de requisições, todas as threads
+    pausam até o fim da espera, que dobra a cada novo erro (com uma variação aleatória)
+    e diminui pela metade a cada lote incorporado com sucesso.
+    """
+
+    def __init__(self, espera_inicial=1.0, espera_maxima=60.0):
+        self.espera_inicial = espera_inicial
+        self.espera_maxima = espera_maxima
+        self.espera = 0.0
+        self._pausa_ate = 0.0
+        self._lock = threading.Lock()
+
+    def aguardar(self):
+        """Bloqueia a thread atual enquanto a pausa global estiver ativa."""
+        with self._lock:
+            pausa = self._pausa_ate - time.monotonic()
+        if pausa > 0:
+            time.sleep(pausa)
+
+    def limite_atingido(self):
+        """
+        Registra um erro de limite de requisições e aumenta a pausa global.
+
+        Returns:
+            float: O tempo de espera, em segundos, aplicado.
+        """
+        with self._lock:
+            self.espera = min(max(self.espera * 2, self.espera_inicial), self.espera_maxima)
+            espera = self.espera * random.uniform(1.0, 1.25)
+            self._pausa_ate = max(self._pausa_ate, time.monotonic() + espera)
+            return espera
+
+    def sucesso(self):
+        """Registra um lote incorporado com sucesso e reduz a espera."""
+        with self._lock:
+            self.espera = self.espera / 2 if self.espera > self.espera_inicial else 0.0
+
+
+class Checkpoint:
+    """
+    Registro em disco dos ids dos fragmentos já gravados na base de dados, usado
+    para retomar uma ingestão interrompida sem incorporar novamente o que já foi gravado.
+
+    Cada lote gravado acrescenta uma linha JSON ao arquivo, então o custo de registrar
+    um lote não cresce com o tamanho da ingestão.
+    """
+
+    def __init__(self, repoName):
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+        self.caminho = os.path.join(CHECKPOINT_DIR, f"{nome_particao(repoName)}.jsonl")
+        self.ids = set()
+        if os.path.exists(self.caminho):
+            with open(self.caminho, 'r', encoding='utf-8') as arquivo:
+                for linha in arquivo:
+                    try:
+                        self.ids.update(json.loads(linha))
+                    except json.JSONDecodeError:
+                        # Linha incompleta, gravada durante a falha
+                        pass
+
+    def concluir(self, ids):
+        """Registra os ids de um lote gravado com sucesso."""
+        self.ids.update(ids)
+        with open(self.caminho, 'a', encoding='utf-8') as arquivo:
+            arquivo.write(json.dumps(list(ids)) + "\n")
+
+    def remover(self):
+        """Apaga o checkpoint depois de uma ingestão concluída."""
+        if os.path.exists(self.caminho):
+            os.remove(self.caminho)
+
+
+class CacheEmbeddings(Embeddings):
+    """
+    Cache em disco das incorporações de documentos, endereçado pelo conteúdo.
+
+    A chave de cada entrada é o hash do nome do modelo de incorporação junto com o texto,
+    então fragmentos idênticos (bibliotecas copiadas, forks, licenças ou o mesmo repositório
+    ingerido novamente) são incorporados uma única vez, em qualquer repositório. Quando o cache
+    passa do tamanho máximo, as entradas acessadas há mais tempo são removidas (LRU).
+
+    O cache fica em um banco SQLite, então pode ser compartilhado entre processos.
+    As incorporações de perguntas (embed_query) não passam pelo cache.
+    """
+
+    def __init__(self, embeddings, caminho=CACHE_FILE, tamanho_maximo_mb=CACHE_MAX_MB):
+        self.embeddings = embeddings
+        self.modelo = getattr(embeddings, 'model', type(embeddings).__name__)
+        self.tamanho_maximo = tamanho_maximo_mb * 1024 * 1024
+        self._lock = threading.Lock()
+        self._conexao = sqlite3.connect(caminho, timeout=60, check_same_thread=False, isolation_level=None)
+        self._conexao.execute("PRAGMA journal_mode=WAL")
+        self._conexao.execute("CREATE TABLE IF NOT EXISTS cache (chave TEXT PRIMARY KEY, vetor BLOB NOT NULL, "
+                              "tamanho INTEGER NOT NULL, acesso REAL NOT NULL)")
+        self._conexao.execute("CREATE INDEX IF NOT EXISTS cache_acesso ON cache (acesso)")
+        self._tamanho = self._conexao.execute("SELECT COALESCE(SUM(tamanho), 0) FROM cache").fetchone()[0]
+
+    def _chave(self, texto):
+        return hashlib.sha256(f"{self.modelo}\0{texto}".encode('utf-8')).hexdigest()
+
+    def _buscar(self, chaves):
+        """Retorna {chave: vetor} das chaves encontradas e atualiza o instante do último acesso."""
+        encontrados = {}
+        agora = time.time()
+        with self._lock:
+            for i in range(0, len(chaves), 500):
+                parte = chaves[i:i + 500]
+                marcadores = ",".join("?" * len(parte))
+                for chave, vetor in self._conexao.execute(f"SELECT chave, vetor FROM cache WHERE chave IN ({marcadores})", parte):
+                    encontrados[chave] = array('f', vetor).tolist()
+                self._conexao.execute(f"UPDATE cache SET acesso = ? WHERE chave IN ({marcadores})", [agora] + parte)
+        return encontrados
+
+    def _gravar(self, entradas):
+        """Grava as entradas {chave: vetor} e remove as mais antigas se o cache passar do tamanho máximo."""
+        agora = time.time()
+        linhas = []
+        for chave, vetor in entradas.items():
+            dados = array('f', vetor).tobytes()
+            linhas.append((chave, dados, len(dados), agora))
+        with self._lock:
+            self._conexao.executemany("INSERT OR REPLACE INTO cache (chave, vetor, tamanho, acesso) VALUES (?, ?, ?, ?)", linhas)
+            self._tamanho += sum(linha[2] for linha in linhas)
+            if self._tamanho > self.tamanho_maximo:
+                self._despejar()
+
+    def _despejar(self):
+        """Remove as entradas acessadas há mais tempo até o cache ocupar 90% do tamanho máximo."""
+        self._tamanho = self._conexao.execute("SELECT COALESCE(SUM(tamanho), 0) FROM cache").fetchone()[0]
+        excesso = self._tamanho - int(self.tamanho_maximo * 0.9)
+        removidas = []
+        cursor = self._conexao.execute("SELECT chave, tamanho FROM cache ORDER BY acesso")
+        for chave, tamanho in cursor:
+            if excesso <= 0:
+                break
+            removidas.append((chave,))
+            excesso -= tamanho
+            self._tamanho -= tamanho
+        cursor.close()
+        self._conexao.executemany("DELETE FROM cache WHERE chave = ?", removidas)
+
+    def incorporar(self, texts):
+        """
+        Esta função retorna as incorporações dos textos, do cache ou do modelo, e quantas vieram do cache.
+        A contagem é de cada chamada, então ingestões simultâneas com o mesmo cache não misturam as suas estatísticas.
+
+        Args:
+            texts (list): Os textos.
+
+        Returns:
+            tuple: As incorporações dos textos, na mesma ordem, e a quantidade de textos atendidos pelo cache.
+        """
+        chaves = [self._chave(texto) for texto in texts]
+        vetores = self._buscar(chaves)
+
+        # Incorpora uma única vez cada texto ausente do cache
+        faltando = {}
+        for chave, texto in zip(chaves, texts):
+            if chave not in vetores:
+                faltando.setdefault(chave, texto)
+        if faltando:
+            novos = dict(zip(faltando.keys(), self.embeddings.embed_documents(list(faltando.values()))))
+            self._gravar(novos)
+            vetores.update(novos)
+
+        return [vetores[chave] for chave in chaves], len(texts) - len(faltando)
+
+    def embed_documents(self, texts):
+        return self.incorporar(texts)[0]
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+
+def incorporar_lote(embeddings, textos, controle, max_tentativas=MAX_TENTATIVAS):
+    """
+    Esta função gera as incorporações de um lote de textos, repetindo a requisição com backoff
+    quando o limite de requisições da API é atingido.
+
+    Args:
+        embeddings (Embeddings): O modelo de incorporação (por exemplo, OpenAIEmbeddings).
+        textos (list): Os textos do lote.
+        controle (ControleTaxa): O controle de taxa compartilhado entre as threads.
+        max_tentativas (int, optional): A quantidade máxima de tentativas.
+
+    Returns:
+        tuple: As incorporações dos textos, na mesma ordem, e a quantidade de textos atendidos pelo cache
+               (0 se `embeddings` não for um CacheEmbeddings).
+    """
+    for tentativa in range(max_tentativas):
+        controle.aguardar()
+        try:
+            if isinstance(embeddings, CacheEmbeddings):
+                vetores, acertos = embeddings.incorporar(textos)
+            else:
+                vetores, acertos = embeddings.embed_documents(textos), 0
+        except Exception as e:
+            if not eh_rate_limit(e) or tentativa == max_tentativas - 1:
+                raise
+            espera = controle.limite_atingido()
+            print(f"Limite de requisições atingido, aguardando {espera:.1f}s...")
+            continue
+        controle.sucesso()
+        return vetores, acertos
+
+
+def gravar_fragmentos(db, fragmentos, checkpoint=None, tamanho_lote=TAMANHO_LOTE, max_concorrencia=MAX_CONCORRENCIA):
+    """
+    Esta função gera as incorporações dos fragmentos em lotes, com um número limitado de requisições
+    simultâneas, e grava cada lote na base de dados assim que ele fica pronto.
+
+    Os fragmentos são consumidos sob demanda: no máximo 2 * `max_concorrencia` lotes ficam na memória
+    ao mesmo tempo. As gravações acontecem sempre na thread que chamou a função, na ordem dos lotes,
+    então a base de dados continua tendo um único escritor. Os fragmentos cujos ids já estão no
+    checkpoint são ignorados.
+
+    Args:
+        db (DeepLake): A base de dados onde os fragmentos serão gravados.
+        fragmentos (iterable): Os pares (id, fragmento) a serem gravados.
+        checkpoint (Checkpoint, optional): O checkpoint da ingestão.
+        tamanho_lote (int, optional): A quantidade de fragmentos por requisição de incorporação.
+        max_concorrencia (int, optional): A quantidade máxima de requisições simultâneas.
+
+    Returns:
+        int: A quantidade de fragmentos gravados.
+    """
+    embeddings = db._embedding_function
+    controle = ControleTaxa()
+
+    ignorados = 0
+    gravados = 0
+    # Fragmentos desta ingestão atendidos pelo cache de incorporações e incorporados pelo modelo
+    cache = {'acertos': 0, 'falhas': 0}
+    # Tempo acumulado das requisições de incorporação (somado entre as threads) e das gravações
+    tempos = {'incorporacao': 0.0, 'gravacao': 0.0}
+    lock = threading.Lock()
+
+    def pendentes():
+        nonlocal ignorados
+        for id, chunk in fragmentos:
+            if checkpoint is not None and id in checkpoint.ids:
+                ignorados += 1
+                continue
+            yield id, chunk
+
+    def incorporar(lote):
+        inicio = time.perf_counter()
+        vetores, acertos = incorporar_lote(embeddings, [chunk.page_content for _, chunk in lote], controle)
+        with lock:
+            tempos['incorporacao'] += time.perf_counter() - inicio
+            cache['acertos'] += acertos
+            cache['falhas'] += len(lote) - acertos
+        return lote, vetores
+
+    def gravar(lote, vetores):
+        nonlocal gravados
+        ids_lote = [id for id, _ in lote]
+        inicio = time.perf_counter()
+        db.vectorstore.add(text=[chunk.page_content for _, chunk in lote],
+                           metadata=[chunk.metadata for _, chunk in lote],
+                           embedding=vetores,
+                           id=ids_lote)
+        tempos['gravacao'] += time.perf_counter() - inicio
+        if checkpoint is not None:
+            checkpoint.concluir(ids_lote)
+        gravados += len(lote)
+        print(f"{gravados} fragmentos gravados" + (f" ({ignorados} já gravados anteriormente)" if ignorados else ""))
+
+    with ThreadPoolExecutor(max_workers=max_concorrencia) as executor:
+        # Grava os lotes prontos, em ordem, com no máximo 2 * max_concorrencia lotes na memória
+        for lote, vetores in mapear_em_ordem(executor, incorporar, agrupar(pendentes(), tamanho_lote), 2 * max_concorrencia):
+            gravar(lote, vetores)
+
+    usa_cache = isinstance(embeddings, CacheEmbeddings)
+    registrar('incorporacao', tempos['incorporacao'], fragmentos=gravados, threads=max_concorrencia,
+              acertos_cache=cache['acertos'] if usa_cache else None, falhas_cache=cache['falhas'] if usa_cache else None)
+    registrar('gravacao', tempos['gravacao'], fragmentos=gravados)
+
+    if usa_cache:
+        total = cache['acertos'] + cache['falhas']
+        print(f"Cache de incorporações: {cache['acertos']} acertos, {cache['falhas']} falhas "
+              f"({cache['acertos'] / total if total else 0.0:.0%} de acertos)")
+    return gravados
@@ -0,0 +1,307 @@
+import os
+import re
+import fnmatch
+import threading
+
+# Diretórios de dependências, artefatos de build e caches, que não são código do repositório
+DIRETORIOS_IGNORADOS = {
+    "node_modules", "bower_components", "jspm_packages", "vendor", "third_party", "site-packages",
+    "dist", "build", "target", "coverage", "htmlcov", "Pods", "DerivedData",
+    ".git", ".hg", ".svn", "__pycache__", ".venv", "venv", ".tox", ".nox", ".mypy_cache", ".pytest_cache",
+    ".ruff_cache", ".next", ".nuxt", ".svelte-kit", ".angular", ".parcel-cache", ".gradle", ".terraform", ".idea", ".vscode",
+}
+
+# Arquivos de lock de gerenciadores de pacotes, minificados, mapas de código e gerados por nome
+ARQUIVOS_IGNORADOS = [
+    "package-lock.json", "npm-shrinkwrap.json", "yarn.lock", "pnpm-lock.yaml", "bun.lockb", "composer.lock",
+    "Gemfile.lock", "Cargo.lock", "poetry.lock", "Pipfile.lock", "pdm.lock", "uv.lock", "go.sum", "packages.lock.json",
+    "*.min.js", "*.min.css", "*.min.map", "*.map", "*.bundle.js", "*.chunk.js", "*.chunk.css",
+    "*_pb2.py", "*_pb2_grpc.py", "*.pb.go", "*.pb.cc", "*.pb.h", "*.g.dart", "*.freezed.dart", "*.designer.cs", "*.generated.*",
+]
+
+# Padrões adicionais a ignorar, no formato do .gitignore, separados por vírgulas
+PADROES_IGNORADOS = [padrao.strip() for padrao in os.getenv('REPOCHAT_IGNORAR', '').split(',') if padrao.strip()]
+
+# Arquivos de regras de exclusão lidos em cada diretório do repositório
+ARQUIVOS_REGRAS = (".gitignore", ".repochatignore")
+
+# Bytes do início do arquivo analisados para detectar conteúdo binário e gerado
+TAMANHO_AMOSTRA = 8192
+
+# Linhas do início do arquivo onde os marcadores de arquivos gerados são procurados
+LINHAS_CABECALHO = 5
+
+# Marcadores de arquivos gerados: "@generated" em um comentário ou o cabeçalho padrão do Go
+PADRAO_GERADO = re.compile(rb'\s*(?:#|//|/\*|\*|--|;|<!--).*@generated\b.*|// Code generated .* DO NOT EDIT\.')
+
+# Arquivos minificados: linhas muito longas em média e quase sem espaços
+MEDIA_LINHA_MINIFICADO = 200
+PROPORCAO_ESPACOS_MINIFICADO = 0.1
+
+# Caracteres de controle aceitos em textos (tab, nova linha, form feed, retorno, backspace, escape)
+BYTES_TEXTO = bytes([8, 9, 10, 12, 13, 27]) + bytes(range(32, 256))
+
+# Tokens estimados por byte de código, para calcular a economia sem tokenizar os arquivos ignorados
+BYTES_POR_TOKEN = 4
+
+
+def _regex_padrao(padrao):
+    """Converte um padrão do .gitignore (sem "/" nas pontas) em uma expressão regular."""
+    regex, i = "", 0
+    while i < len(padrao):
+        if padrao.startswith("**/", i):
+            regex, i = regex + "(?:.*/)?", i + 3
+        elif padrao.startswith("/**", i) and i + 3 == len(padrao):
+            regex, i = regex + "/.*", i + 3
+        elif padrao.startswith("**", i):
+            regex, i = regex + ".*", i + 2
+        elif padrao[i] == "*":
+            regex, i = regex + "[^/]*", i + 1
+        elif padrao[i] == "?":
+            regex, i = regex + "[^/]", i + 1
+        elif padrao[i] == "[" and "]" in padrao[i + 2:]:
+            fim = padrao.index("]", i + 2)
+            classe = padrao[i + 1:fim].replace("\\", "\\\\")
+            regex, i = regex + "[" + ("^" + classe[1:] if classe.startswith("!") else classe) + "]", fim + 1
+        elif padrao[i] == "\\" and i + 1 < len(padrao):
+            regex, i = regex + re.escape(padrao[i + 1]), i + 2
+        else:
+            regex, i = regex + re.escape(padrao[i]), i + 1
+    return regex
+
+
+class RegrasIgnorar:
+    """
+    Regras de exclusão no formato do .gitignore: padrões com curingas (*, ?, ** e classes), negação (!),
+    padrões apenas de diretórios (terminados em /) e padrões ancorados no diretório do arquivo de regras
+    (com / no início ou no meio). Como no git, a última regra que corresponde a um caminho decide.
+    """
+
+    def __init__(self, padroes=()):
+        self.regras = []
+        self.adicionar(padroes)
+
+    def adicionar(self, linhas, base=""):
+        """
+        Adiciona as regras de um arquivo de regras.
+
+        Args:
+            linhas (iterable): As linhas do arquivo.
+            base (str, optional): O diretório do arquivo de regras, relativo à raiz do repositório.
+        """
+        prefixo = re.escape(base.strip("/") + "/") if base.strip("/") else ""
+        for linha in linhas:
+            linha = linha.rstrip("\n\r")
+            if not linha.endswith("\\ "):
+                linha = linha.rstrip()
+            if not linha or linha.startswith("#"):
+                continue
+            negacao = linha.startswith("!")
+            padrao = linha[1:] if negacao else linha
+            if padrao.startswith("\\"):
+                padrao = padrao[1:]
+            apenas_diretorios = padrao.endswith("/")
+            padrao = padrao.rstrip("/")
+            # Padrões com "/" no início ou no meio valem a partir do diretório do arquivo de regras; os demais, em qualquer nível
+            ancorado = "/" in padrao
+            padrao = padrao.lstrip("/")
+            if not padrao:
+                continue
+            regex = prefixo + ("" if ancorado else "(?:.*/)?") + _regex_padrao(padrao)
+            self.regras.append((re.compile(regex + "$", re.DOTALL), negacao, apenas_diretorios))
+
+    def ignorado(self, caminho, diretorio=False):
+        """
+        Args:
+            caminho (str): O caminho relativo à raiz do repositório, separado por "/".
+            diretorio (bool, optional): Se o caminho é um diretório.
+
+        Returns:
+            bool: True se a última regra que corresponde ao caminho o excluir.
+        """
+        resultado = False
+        for regex, negacao, apenas_diretorios in self.regras:
+            if (diretorio or not apenas_diretorios) and regex.match(caminho):
+                resultado = not negacao
+        return resultado
+
+
+def motivo_conteudo(conteudo):
+    """
+    Esta função detecta, por heurísticas baratas, conteúdo que não deve ser incorporado: binário
+    (bytes nulos ou muitos caracteres de controle), gerado (o marcador "@generated" em um comentário
+    ou o cabeçalho "// Code generated ... DO NOT EDIT." do Go nas primeiras linhas) ou minificado
+    (linhas muito longas em média, quase sem espaços).
+
+    Args:
+        conteudo (bytes): O conteúdo do arquivo.
+
+    Returns:
+        str: O motivo ("binario", "gerado" ou "minificado"), ou None se o conteúdo deve ser incorporado.
+    """
+    amostra = conteudo[:TAMANHO_AMOSTRA]
+    if b"\0" in amostra or len(amostra.translate(None, BYTES_TEXTO)) > 0.1 * len(amostra):
+        return "binario"
+    if any(PADRAO_GERADO.fullmatch(linha.rstrip(b"\r")) for linha in amostra.split(b"\n", LINHAS_CABECALHO)[:LINHAS_CABECALHO]):
+        return "gerado"
+    if len(conteudo) > 2048 and len(conteudo) / (conteudo.count(b"\n") + 1) > MEDIA_LINHA_MINIFICADO \
+            and (conteudo.count(b" ") + conteudo.count(b"\t")) < PROPORCAO_ESPACOS_MINIFICADO * len(conteudo):
+        return "minificado"
+    return None
+
+
+class RelatorioFiltro:
+    """
+    Registro dos arquivos ignorados pelo filtro, por motivo: a quantidade, o total de bytes,
+    alguns exemplos e a estimativa dos tokens que deixaram de ser incorporados. Os diretórios
+    ignorados inteiros são contados à parte, sem percorrê-los (o seu conteúdo não entra na estimativa).
+    """
+
+    def __init__(self, exemplos=3):
+        self.exemplos = exemplos
+        self.motivos = {}
+        self._lock = threading.Lock()
+
+    def _registrar(self, caminho, motivo, arquivos, tamanho, diretorios):
+        with self._lock:
+            registro = self.motivos.setdefault(motivo, {'arquivos': 0, 'diretorios': 0, 'bytes': 0, 'exemplos': []})
+            registro['arquivos'] += arquivos
+            registro['diretorios'] += diretorios
+            registro['bytes'] += tamanho
+            if len(registro['exemplos']) < self.exemplos:
+                registro['exemplos'].append(caminho)
+
+    def registrar(self, caminho, motivo, tamanho):
+        """
+        Registra um arquivo ignorado.
+
+        Args:
+            caminho (str): O caminho relativo do arquivo.
+            motivo (str): O motivo.
+            tamanho (int): O tamanho, em bytes.
+        """
+        self._registrar(caminho, motivo, 1, tamanho, 0)
+
+    def registrar_diretorio(self, caminho, motivo):
+        """
+        Registra um diretório ignorado inteiro, que não é percorrido.
+
+        Args:
+            caminho (str): O caminho relativo do diretório.
+            motivo (str): O motivo.
+        """
+        self._registrar(caminho.rstrip("/") + "/", motivo, 0, 0, 1)
+
+    @property
+    def arquivos(self):
+        """A quantidade de arquivos ignorados."""
+        return sum(registro['arquivos'] for registro in self.motivos.values())
+
+    @property
+    def diretorios(self):
+        """A quantidade de diretórios ignorados inteiros."""
+        return sum(registro['diretorios'] for registro in self.motivos.values())
+
+    @property
+    def tokens_economizados(self):
+        """A estimativa dos tokens dos arquivos ignorados."""
+        return sum(registro['bytes'] for registro in self.motivos.values()) // BYTES_POR_TOKEN
+
+    def resumo(self):
+        """
+        Returns:
+            str: Os arquivos ignorados por motivo e a estimativa dos tokens economizados, para exibição.
+        """
+        if not self.motivos:
+            return "Nenhum arquivo ignorado pelo filtro"
+        diretorios = f" e {self.diretorios} diretórios" if self.diretorios else ""
+        linhas = [f"{self.arquivos} arquivos{diretorios} ignorados, cerca de {self.tokens_economizados} tokens economizados:"]
+        for motivo, registro in sorted(self.motivos.items(), key=lambda item: (-item[1]['bytes'], -item[1]['diretorios'])):
+            quantidade = f"{registro['arquivos']} arquivos"
+            if registro['diretorios']:
+                quantidade += f", {registro['diretorios']} diretórios"
+            linhas.append(f"  {motivo}: {quantidade}, {registro['bytes'] / 1024:.0f} KB "
+                          f"(por exemplo, {', '.join(registro['exemplos'])})")
+        return "\n".join(linhas)
+
+
+class FiltroArquivos:
+    """
+    Filtro dos arquivos de um repositório, aplicado pelos caminhos, antes de ler os arquivos: extensões,
+    diretórios e arquivos da lista de exclusão, regras do .gitignore (e do .repochatignore) e tamanho máximo.
+    Os arquivos ignorados, exceto pela extensão, são registrados no relatório.
+
+    Args:
+        valido (callable): Função que recebe o caminho de um arquivo e retorna True se a sua extensão deve ser indexada.
+        tamanho_maximo (int): O tamanho máximo, em bytes, de um arquivo.
+        relatorio (RelatorioFiltro, optional): O relatório dos arquivos ignorados.
+    """
+
+    def __init__(self, valido, tamanho_maximo, relatorio=None):
+        self.valido = valido
+        self.tamanho_maximo = tamanho_maximo
+        self.relatorio = relatorio if relatorio is not None else RelatorioFiltro()
+        self.regras = RegrasIgnorar(PADROES_IGNORADOS)
+
+    def carregar_regras(self, caminho, texto):
+        """Adiciona as regras de um arquivo de regras (caminho relativo à raiz do repositório)."""
+        self.regras.adicionar(texto.splitlines(), os.path.dirname(caminho))
+
+    def motivo_diretorio(self, caminho):
+        """Retorna o motivo para ignorar um diretório inteiro (caminho relativo), ou None."""
+        if os.path.basename(caminho) in DIRETORIOS_IGNORADOS:
+            return "diretorio_ignorado"
+        if self.regras.ignorado(caminho, diretorio=True):
+            return "gitignore"
+        return None
+
+    def aceitar_diretorio(self, caminho_relativo):
+        """
+        Verifica se um diretório deve ser percorrido; se não, registra o diretório no relatório, sem percorrê-lo.
+
+        Args:
+            caminho_relativo (str): O caminho relativo à raiz do repositório, separado por "/".
+
+        Returns:
+            bool: True se o diretório deve ser percorrido.
+        """
+        motivo = self.motivo_diretorio(caminho_relativo)
+        if motivo is None:
+            return True
+        self.relatorio.registrar_diretorio(caminho_relativo, motivo)
+        return False
+
+    def aceitar(self, caminho_relativo, tamanho, verificar_diretorios=True):
+        """
+        Verifica se um arquivo deve ser lido, registrando o motivo no relatório se ele for ignorado.
+
+        Args:
+            caminho_relativo (str): O caminho relativo à raiz do repositório, separado por "/".
+            tamanho (int): O tamanho do arquivo, em bytes.
+            verificar_diretorios (bool, optional): Se os diretórios do caminho devem ser verificados
+                                                   (desnecessário quando eles já foram verificados ao percorrê-los).
+
+        Returns:
+            bool: True se o arquivo deve ser lido.
+        """
+        if not self.valido(caminho_relativo):
+            return False
+        motivo = None
+        if verificar_diretorios:
+            partes = caminho_relativo.split("/")[:-1]
+            for i in range(len(partes)):
+                motivo = self.motivo_diretorio("/".join(partes[:i + 1]))
+                if motivo is not None:
+                    break
+        if motivo is None:
+            nome = os.path.basename(caminho_relativo)
+            if any(fnmatch.fnmatch(nome, padrao) for padrao in ARQUIVOS_IGNORADOS):
+                motivo = "arquivo_ignorado"
+            elif self.regras.ignorado(caminho_relativo):
+                motivo = "gitignore"
+            elif tamanho > self.tamanho_maximo:
+                motivo = "tamanho"
+        if motivo is not None:
+            self.relatorio.registrar(caminho_relativo, motivo, tamanho)
+            return False
+        return True
@@ -1,20 +1,37 @@
 import os
 import shutil
+import time
+import hashlib
 from bs4 import BeautifulSoup
 import requests
-import io
+import fnmatch
+import tarfile
+import zipfile
 from zipfile import ZipFile
-from langchain.document_loaders import TextLoader
-from langchain.text_splitter import CharacterTextSplitter
+from collections import namedtuple
+from langchain.schema import Document
 from deeplake.core.dataset import Dataset
+from vectorstore import BaseRepos
+from embeddings import Checkpoint, agrupar, gravar_fragmentos, mapear_em_ordem, TAMANHO_LOTE, MAX_CONCORRENCIA
+from chunking import fragmentar_codigo, VERSAO_FRAGMENTADOR
+from lexical import RecuperadorHibrido
+from filtering import ARQUIVOS_REGRAS, FiltroArquivos, RelatorioFiltro, motivo_conteudo
+from retrieval import config_busca
+from instrumentation import anotar, etapa, medir, registrar
 
 EXTENSOES_DEV = ["py", "js", "ts", "html", "css", "scss", "json", "xml", "yml", "md", 
             "java", "cpp", "h", "c", "php", "rb", "go", "swift", "kt", "sql",
-            "cs", "sh", "pyc", "rs", "tsx", "jsx", "sass", "less", "vue", "rbw",
+            "cs", "sh", "rs", "tsx", "jsx", "sass", "less", "vue", "rbw",
             "pl", "ps1", "bat", "cmd"]
 
 TMP_DIR = "tmp"
 
+# Tamanho máximo, em bytes, de um arquivo extraído para indexação
+TAMANHO_MAXIMO_ARQUIVO = int(os.getenv('REPOCHAT_TAMANHO_MAXIMO_ARQUIVO', 1024 * 1024))
+
+# Tamanho dos blocos lidos no download e na extração
+TAMANHO_BLOCO = 1024 * 1024
+
 import requests
 
 def main_repository_branchname(url):
@@ -50,31 +67,220 @@ def main_repository_branchname(url):
         raise Exception("Nome do branch principal não encontrado")
 
 
-def download_and_extract_repo(url):    
+def extensao_valida(nome_arquivo, extensoes_dev=EXTENSOES_DEV):
     """
-    Esta função é usada para fazer o download e extrair um repositório do GitHub em um diretório temporário.
+    Esta função verifica se um arquivo tem uma das extensões especificadas.
+
+    Args:
+        nome_arquivo (str): O nome (ou caminho) do arquivo.
+        extensoes_dev (list, optional): Lista de extensões de arquivo a serem consideradas. Se None, todos os arquivos serão considerados.
+
+    Returns:
+        bool: True se o arquivo deve ser considerado, False caso contrário.
+    """
+    nome = os.path.basename(nome_arquivo)
+    return extensoes_dev is None or any(fnmatch.fnmatch(nome, '*.' + ext) for ext in extensoes_dev)
+
+def baixar_arquivo(url, destino):
+    """
+    Esta função faz o download de um arquivo direto para o disco, em blocos, sem carregá-lo inteiro na memória.
+
+    Args:
+        url (str): A URL do arquivo.
+        destino (str): O caminho onde o arquivo será gravado.
+
+    Returns:
+        int: O total de bytes baixados.
+    """
+    total = 0
+    with requests.get(url, stream=True) as response:
+        response.raise_for_status()
+        with open(destino, 'wb') as arquivo:
+            for bloco in response.iter_content(chunk_size=TAMANHO_BLOCO):
+                arquivo.write(bloco)
+                total += len(bloco)
+    return total
+
+def extrair_zip_filtrado(caminho_zip, destino, extensoes_dev=EXTENSOES_DEV, tamanho_maximo=TAMANHO_MAXIMO_ARQUIVO,
+                         relatorio=None):
+    """
+    Esta função extrai de um zip apenas os arquivos que serão indexados: os que têm uma das extensões
+    especificadas, não passam do tamanho máximo e não são excluídos pelo filtro de caminhos (dependências,
+    arquivos de lock e gerados, regras do .gitignore; veja filtering.FiltroArquivos). A pasta raiz comum a
+    todos os arquivos (por exemplo, "repo-main/" nos zips do GitHub) é removida dos caminhos durante a extração.
+
+    Args:
+        caminho_zip (str): O caminho do arquivo zip.
+        destino (str): O diretório onde os arquivos serão extraídos.
+        extensoes_dev (list, optional): Lista de extensões de arquivo a serem consideradas. Se None, todos os arquivos serão considerados.
+        tamanho_maximo (int, optional): O tamanho máximo, em bytes, de um arquivo extraído.
+        relatorio (RelatorioFiltro, optional): O relatório onde os arquivos ignorados pelo filtro são registrados.
+
+    Returns:
+        tuple: A quantidade de arquivos extraídos e a quantidade de arquivos ignorados.
+    """
+    destino_real = os.path.realpath(destino)
+    filtro = FiltroArquivos(lambda caminho: extensao_valida(caminho, extensoes_dev), tamanho_maximo, relatorio)
+    extraidos = 0
+    ignorados = 0
+    with ZipFile(caminho_zip) as zip_file:
+        membros = [membro for membro in zip_file.infolist() if not membro.is_dir()]
+
+        # Remove a pasta raiz, se todos os arquivos estiverem dentro dela
+        prefixo = prefixo_comum([membro.filename for membro in membros])
+        carregar_regras(filtro, [(membro.filename[len(prefixo):], lambda membro=membro: zip_file.read(membro))
+                                 for membro in membros])
+
+        for membro in membros:
+            caminho_relativo = membro.filename[len(prefixo):]
+            if not filtro.aceitar(caminho_relativo, membro.file_size):
+                ignorados += 1
+                continue
+
+            # Impede que um membro seja extraído para fora do diretório de destino
+            alvo = os.path.realpath(os.path.join(destino_real, caminho_relativo))
+            if not alvo.startswith(destino_real + os.sep):
+                ignorados += 1
+                continue
+
+            os.makedirs(os.path.dirname(alvo), exist_ok=True)
+            with zip_file.open(membro) as origem, open(alvo, 'wb') as saida:
+                shutil.copyfileobj(origem, saida, TAMANHO_BLOCO)
+            extraidos += 1
+    return extraidos, ignorados
+
+def carregar_regras(filtro, arquivos):
+    """
+    Esta função carrega no filtro as regras de exclusão (.gitignore e .repochatignore) de uma fonte compactada
+    ou de um repositório git, dos diretórios mais rasos para os mais profundos, antes de filtrar os arquivos.
+
+    Args:
+        filtro (FiltroArquivos): O filtro.
+        arquivos (list): Os arquivos da fonte, como pares (caminho relativo, função que retorna o conteúdo em bytes).
+    """
+    regras = [(caminho, ler) for caminho, ler in arquivos if os.path.basename(caminho) in ARQUIVOS_REGRAS]
+    for caminho, ler in sorted(regras, key=lambda regra: regra[0].count('/')):
+        filtro.carregar_regras(caminho, decodificar(ler()))
+
+# Fontes lidas diretamente do disco, sem cópia para o TMP_DIR: um arquivo zip ou tar,
+# ou uma referência (branch, tag ou commit) de um repositório git local
+FonteArquivo = namedtuple('FonteArquivo', ['caminho'])
+FonteGit = namedtuple('FonteGit', ['caminho', 'ref'])
+
+def prefixo_comum(nomes):
+    """
+    Esta função obtém a pasta raiz comum a todos os caminhos de um arquivo compactado (por exemplo, "repo-main/").
+
+    Args:
+        nomes (list): Os caminhos dos arquivos, separados por "/".
+
+    Returns:
+        str: A pasta raiz, terminada em "/", ou uma string vazia se não houver pasta raiz comum.
+    """
+    raizes = set(nome.split('/', 1)[0] for nome in nomes)
+    if len(raizes) == 1 and all('/' in nome for nome in nomes):
+        return raizes.pop() + '/'
+    return ''
+
+def resolver_fonte_local(origem, ref=None):
+    """
+    Esta função identifica uma origem local: um diretório, um repositório git com uma referência
+    escolhida, ou um arquivo zip ou tar.
+
+    Args:
+        origem (str): O caminho local.
+        ref (str, optional): A branch, tag ou commit, para repositórios git. Se None, lê a árvore de trabalho.
+
+    Returns:
+        tuple: O nome do repositório e a fonte (o diretório, FonteGit ou FonteArquivo),
+               ou None se a origem não for um caminho local.
+    """
+    origem = os.path.expanduser(origem)
+    if os.path.isdir(origem):
+        repo_name = os.path.basename(os.path.abspath(origem)).replace(".git", "")
+        if ref:
+            return repo_name, FonteGit(origem, ref)
+        return repo_name, origem
+    if os.path.isfile(origem) and (zipfile.is_zipfile(origem) or tarfile.is_tarfile(origem)):
+        repo_name = os.path.basename(origem)
+        for sufixo in (".zip", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz", ".tar"):
+            if repo_name.endswith(sufixo):
+                repo_name = repo_name[:-len(sufixo)]
+                break
+        return repo_name, FonteArquivo(origem)
+    return None
+
+def limpar_fonte(fonte):
+    """
+    Esta função apaga os arquivos temporários de uma fonte. Fontes locais nunca são apagadas.
+
+    Args:
+        fonte (str | FonteGit | FonteArquivo): A fonte retornada por download_and_extract_repo.
+    """
+    if isinstance(fonte, str) and os.path.realpath(fonte).startswith(os.path.realpath(TMP_DIR) + os.sep):
+        shutil.rmtree(fonte, ignore_errors=True)
+
+def nome_repositorio(url):
+    """
+    Esta função extrai o nome de um repositório da sua URL (também o nome do seu diretório temporário).
 
     Args:
         url (str): A URL do repositório do GitHub.
 
     Returns:
-        tuple: O nome do repositório e o caminho do diretório onde o repositório foi extraído.
+        str: O nome do repositório.
+    """
+    return url.rstrip("/").split("/")[-1].replace(".git", "")
+
+@medir('obter_repositorio')
+def download_and_extract_repo(url, ref=None, relatorio=None):    
+    """
+    Esta função é usada para fazer o download e extrair um repositório do GitHub em um diretório temporário.
+
+    O zip é baixado em blocos direto para o disco e apenas os arquivos que serão indexados
+    são extraídos (veja extrair_zip_filtrado).
+
+    A URL também pode ser um caminho local: um diretório, um repositório git (lido na referência `ref`,
+    direto do banco de objetos) ou um arquivo zip ou tar. Nesses casos nada é baixado nem copiado,
+    e os arquivos são lidos no lugar.
+
+    Args:
+        url (str): A URL do repositório do GitHub ou um caminho local.
+        ref (str, optional): A branch, tag ou commit a ser indexado. Se None, usa a branch principal
+                             (ou a árvore de trabalho, para repositórios locais).
+        relatorio (RelatorioFiltro, optional): O relatório onde os arquivos não extraídos pelo filtro são registrados.
+
+    Returns:
+        tuple: O nome do repositório e a fonte dos arquivos: o caminho do diretório onde o repositório
+               foi extraído (ou o diretório local), FonteGit ou FonteArquivo.
     """
 
+    # Origens locais são lidas no lugar, sem acesso à rede
+    fonte_local = resolver_fonte_local(url, ref)
+    if fonte_local is not None:
+        return fonte_local
+
     # Cria um diretório temporário se não existir
     os.makedirs(TMP_DIR, exist_ok=True)
 
     # Extrai o nome do repositório da URL
-    repo_name = url.split("/")[-1].replace(".git", "")
+    repo_name = nome_repositorio(url)
     
-    # Obtém o nome da branch principal do repositório
-    main_branch = main_repository_branchname(url)
-    print(f"Branch principal: {main_branch}")
-
     # Faz o download do arquivo zip do repositório
-    zip_url = f"{url}/archive/refs/heads/{main_branch}.zip"
+    if ref:
+        # Com a referência informada, não é preciso consultar a página do repositório
+        zip_url = f"{url}/archive/{ref}.zip"
+    else:
+        # Obtém o nome da branch principal do repositório
+        with etapa('pagina_repositorio'):
+            main_branch = main_repository_branchname(url)
+        print(f"Branch principal: {main_branch}")
+        zip_url = f"{url}/archive/refs/heads/{main_branch}.zip"
     print(f"Baixando {zip_url}...")
-    response = requests.get(zip_url)
+    caminho_zip = os.path.join(TMP_DIR, f"{repo_name}.zip")
+    with etapa('download') as medicao:
+        total_bytes = medicao['bytes'] = baixar_arquivo(zip_url, caminho_zip)
+    print(f"{total_bytes / (1024 * 1024):.1f} MB baixados")
     
     # Cria uma pasta com o nome do repositório e extrai o conteúdo do zip nela
     destination_folder = os.path.join(TMP_DIR, repo_name)
@@ -84,99 +290,461 @@ def download_and_extract_repo(url):
         shutil.rmtree(destination_folder)
 
     os.makedirs(destination_folder, exist_ok=True)
-    with ZipFile(io.BytesIO(response.content)) as zip_file:
-        zip_file.extractall(destination_folder)
-    
-    extracted_dir = None
-
-    # Procura o diretório que foi extraído do zip
-    for dir_branch in os.listdir(destination_folder):
-        if os.path.isdir(os.path.join(destination_folder, dir_branch)):
-            extracted_dir = os.path.join(destination_folder, dir_branch)
-            break
-
-    if extracted_dir != None:
-        # Move o conteúdo da pasta extraída para a pasta do repositório
-        for dir in os.listdir(extracted_dir):
-            os.rename(os.path.join(extracted_dir, dir), os.path.join(destination_folder, dir))
-        # Deleta a pasta extraída
-        os.rmdir(extracted_dir)
+    try:
+        with etapa('extracao') as medicao:
+            extraidos, ignorados = extrair_zip_filtrado(caminho_zip, destination_folder, relatorio=relatorio)
+            medicao.update(arquivos=extraidos, ignorados=ignorados)
+    finally:
+        os.remove(caminho_zip)
+    print(f"{extraidos} arquivos extraídos, {ignorados} ignorados")
 
     # Retorna o nome do repositório e o caminho do diretório onde o repositório foi extraído
     return repo_name, destination_folder
 
-def db_add_repo_files(db, repoName, repoFolder, extensoes_dev=EXTENSOES_DEV) -> Dataset:
+def hash_conteudo(conteudo):
     """
-    Percorre a base de código alvo e carrega todos os arquivos
-    para fragmentação e, em seguida, incorporação de texto
+    Esta função calcula o hash SHA-256 de um conteúdo, usado para detectar arquivos e fragmentos alterados.
+
+    Args:
+        conteudo (str | bytes): O conteúdo a ser processado. Textos são codificados em utf-8.
+
+    Returns:
+        str: O hash do conteúdo em hexadecimal.
+    """
+    if isinstance(conteudo, str):
+        conteudo = conteudo.encode('utf-8')
+    return hashlib.sha256(conteudo).hexdigest()
+
+def hashes_repo_db(db, tamanho_lote=1000):
+    """
+    Esta função obtém do dataset de um repositório o hash e os ids dos fragmentos de cada arquivo já indexado.
+
+    Args:
+        db (DeepLake): O dataset do repositório.
+        tamanho_lote (int, optional): A quantidade de fragmentos lidos do dataset de cada vez.
+
+    Returns:
+        dict: Um dicionário {caminho relativo: {'file_hash': hash, 'fragmentador': versão, 'ids': [ids dos fragmentos]}}.
+              Fragmentos indexados antes do registro dos hashes ficam agrupados na chave None.
+    """
+    # O dataset é lido em partes, e apenas o caminho, os hashes e os ids de cada fragmento ficam na memória
+    dataset = db.vectorstore.dataset
+    arquivos = {}
+    for inicio in range(0, len(dataset), tamanho_lote):
+        parte = dataset[inicio:inicio + tamanho_lote]
+        for id, metadata in zip(parte.id.data(aslist=True)['value'], parte.metadata.data(aslist=True)['value']):
+            info = arquivos.setdefault(metadata.get('path'), {'file_hash': metadata.get('file_hash'),
+                                                              'fragmentador': metadata.get('fragmentador'), 'ids': []})
+            info['ids'].append(id)
+    return arquivos
+
+def reconstruir_indice_lexico(db, indice, tamanho_lote=1000):
+    """
+    Esta função preenche o índice lexical de um repositório com os fragmentos já gravados no seu dataset,
+    sem ler o repositório novamente (para repositórios indexados antes do índice lexical).
+
+    Args:
+        db (DeepLake): O dataset do repositório.
+        indice (IndiceLexico): O índice lexical do repositório.
+        tamanho_lote (int, optional): A quantidade de fragmentos lidos do dataset e gravados no índice de cada vez.
+    """
+    # O dataset é lido em partes, para que a memória não cresça com o tamanho do repositório
+    dataset = db.vectorstore.dataset
+    for inicio in range(0, len(dataset), tamanho_lote):
+        parte = dataset[inicio:inicio + tamanho_lote]
+        indice.adicionar([(id, Document(page_content=texto, metadata=metadata))
+                          for id, metadata, texto in zip(parte.id.data(aslist=True)['value'],
+                                                         parte.metadata.data(aslist=True)['value'],
+                                                         parte.text.data(aslist=True)['value'])])
+
+def listar_arquivos_repo(repoFolder, extensoes_dev=EXTENSOES_DEV, filtro=None):
     """
-    # Lista para armazenar os documentos
-    documents = []
+    Esta função percorre o diretório de um repositório e gera os arquivos com as extensões especificadas
+    que passam pelo filtro de caminhos: os diretórios ignorados (dependências, builds, regras do .gitignore
+    de cada diretório) não são percorridos.
 
-    # Percorre todos os arquivos no diretório do repositório
+    Args:
+        repoFolder (str): O diretório do repositório.
+        extensoes_dev (list, optional): Lista de extensões de arquivo a serem consideradas. Se None, todos os arquivos serão considerados.
+        filtro (FiltroArquivos, optional): O filtro de caminhos. Se None, usa um filtro com o tamanho máximo padrão.
+
+    Yields:
+        tuple: O caminho do arquivo e o caminho relativo ao diretório do repositório.
+    """
+    if filtro is None:
+        filtro = FiltroArquivos(lambda caminho: extensao_valida(caminho, extensoes_dev), TAMANHO_MAXIMO_ARQUIVO)
     for dirpath, dirnames, filenames in os.walk(repoFolder):
-        for file in filenames:
-            # Verifica se o arquivo tem uma das extensões especificadas
-            if extensoes_dev is None or any(fnmatch.fnmatch(file, '*.' + ext) for ext in extensoes_dev):
-                try: 
-                    # Carrega o arquivo e divide em documentos
-                    loader = TextLoader(os.path.join(dirpath, file), encoding='utf-8')
-                    documents.extend(loader.load_and_split())
-                except UnicodeDecodeError:
-                    # Se ocorrer um erro de decodificação, tenta novamente com outro encoding
-                    loader = TextLoader(os.path.join(dirpath, file), encoding='ISO-8859-1')
-                    documents.extend(loader.load_and_split())    
-                except Exception as e: 
+        base = os.path.relpath(dirpath, repoFolder).replace(os.sep, '/')
+        base = '' if base == '.' else base + '/'
+
+        # As regras de exclusão de um diretório valem para ele e para os seus subdiretórios
+        for nome in ARQUIVOS_REGRAS:
+            if nome in filenames:
+                try:
+                    with open(os.path.join(dirpath, nome), 'rb') as arquivo:
+                        filtro.carregar_regras(base + nome, decodificar(arquivo.read()))
+                except OSError as e:
                     print(e)
 
-    # Adiciona o nome do repositório aos metadados de cada documento
-    for doc in documents:
-      doc.metadata['repo'] = repoName
-    
-    # Fragmenta os documentos
-    text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=0)
-    chunks = text_splitter.split_documents(documents)
+        # Não desce no banco de objetos de repositórios git locais nem nos diretórios ignorados
+        if '.git' in dirnames:
+            dirnames.remove('.git')
+        dirnames[:] = [nome for nome in dirnames if filtro.aceitar_diretorio(base + nome)]
+
+        for file in filenames:
+            caminho = os.path.join(dirpath, file)
+            try:
+                tamanho = os.path.getsize(caminho)
+            except OSError:
+                continue
+            if filtro.aceitar(base + file, tamanho, verificar_diretorios=False):
+                yield caminho, os.path.relpath(caminho, repoFolder)
+
+def iterar_arquivos(fonte, extensoes_dev=EXTENSOES_DEV, tamanho_maximo=TAMANHO_MAXIMO_ARQUIVO, relatorio=None):
+    """
+    Esta função gera os arquivos de uma fonte (diretório, arquivo zip ou tar, ou referência de um
+    repositório git) com as extensões especificadas, sem passar do tamanho máximo e que não são excluídos
+    pelo filtro de caminhos (dependências, arquivos de lock e gerados, regras do .gitignore).
+
+    Os arquivos de diretórios são lidos sob demanda, e podem ser lidos em paralelo. Os de arquivos
+    compactados e de repositórios git são lidos durante a iteração, na ordem em que estão armazenados,
+    porque essas fontes não podem ser lidas por várias threads ao mesmo tempo.
+
+    Args:
+        fonte (str | FonteGit | FonteArquivo): A fonte dos arquivos.
+        extensoes_dev (list, optional): Lista de extensões de arquivo a serem consideradas. Se None, todos os arquivos serão considerados.
+        tamanho_maximo (int, optional): O tamanho máximo, em bytes, de um arquivo.
+        relatorio (RelatorioFiltro, optional): O relatório onde os arquivos ignorados pelo filtro são registrados.
+
+    Yields:
+        tuple: O caminho do arquivo (usado para identificá-lo), o caminho relativo à raiz do repositório
+               e uma função sem argumentos que retorna o conteúdo do arquivo em bytes. O arquivo só é lido
+               quando a função é chamada, e os de zips, tars e repositórios git apenas antes de o próximo ser
+               gerado, na mesma thread (com a fonte ainda aberta).
+    """
+    filtro = FiltroArquivos(lambda caminho: extensao_valida(caminho, extensoes_dev), tamanho_maximo, relatorio)
+
+    if isinstance(fonte, FonteGit):
+        # Importado apenas quando necessário, porque o GitPython exige o executável do git instalado
+        import git
+        commit = git.Repo(fonte.caminho).commit(fonte.ref)
+        blobs = [item for item in commit.tree.traverse() if item.type == 'blob']
+        carregar_regras(filtro, [(item.path, lambda item=item: item.data_stream.read()) for item in blobs])
+        for item in blobs:
+            if filtro.aceitar(item.path, item.size):
+                yield f"{fonte.ref}:{item.path}", item.path, lambda item=item: item.data_stream.read()
+
+    elif isinstance(fonte, FonteArquivo) and zipfile.is_zipfile(fonte.caminho):
+        with ZipFile(fonte.caminho) as zip_file:
+            membros = [membro for membro in zip_file.infolist() if not membro.is_dir()]
+            prefixo = prefixo_comum([membro.filename for membro in membros])
+            carregar_regras(filtro, [(membro.filename[len(prefixo):], lambda membro=membro: zip_file.read(membro))
+                                     for membro in membros])
+            for membro in membros:
+                caminho_relativo = membro.filename[len(prefixo):]
+                if filtro.aceitar(caminho_relativo, membro.file_size):
+                    yield f"{fonte.caminho}!{membro.filename}", caminho_relativo, lambda membro=membro: zip_file.read(membro)
+
+    elif isinstance(fonte, FonteArquivo):
+        with tarfile.open(fonte.caminho, 'r:*') as tar_file:
+            membros = [membro for membro in tar_file.getmembers() if membro.isfile()]
+            prefixo = prefixo_comum([membro.name for membro in membros])
+            carregar_regras(filtro, [(membro.name[len(prefixo):], lambda membro=membro: tar_file.extractfile(membro).read())
+                                     for membro in membros])
+            for membro in membros:
+                caminho_relativo = membro.name[len(prefixo):]
+                if filtro.aceitar(caminho_relativo, membro.size):
+                    yield (f"{fonte.caminho}!{membro.name}", caminho_relativo,
+                           lambda membro=membro: tar_file.extractfile(membro).read())
+
+    else:
+        for caminho, caminho_relativo in listar_arquivos_repo(fonte, extensoes_dev, filtro):
+            def ler(caminho=caminho):
+                with open(caminho, 'rb') as arquivo:
+                    return arquivo.read()
+            yield caminho, caminho_relativo, ler
+
+def decodificar(conteudo):
+    """
+    Esta função decodifica o conteúdo de um arquivo como utf-8 ou, se não for possível, como ISO-8859-1.
+
+    Args:
+        conteudo (bytes): O conteúdo do arquivo.
+
+    Returns:
+        str: O texto do arquivo.
+    """
+    try:
+        return conteudo.decode('utf-8')
+    except UnicodeDecodeError:
+        return conteudo.decode('ISO-8859-1')
+
+@medir('ingestao')
+def db_add_repo_files(db, repoName, repoFolder, extensoes_dev=EXTENSOES_DEV, incremental=False,
+                      tamanho_lote=TAMANHO_LOTE, max_concorrencia=MAX_CONCORRENCIA, varredura=None,
+                      manifesto=None, source_ref=None, indice_lexico=None) -> Dataset:
+    """
+    Percorre a base de código alvo e carrega todos os arquivos
+    para fragmentação e, em seguida, incorporação de texto
+
+    A ingestão é um pipeline de geradores (percorrer → carregar → fragmentar → incorporar → gravar):
+    cada arquivo é lido apenas quando o lote anterior já foi enviado, e os fragmentos são gravados
+    na base de dados em lotes de `tamanho_lote`, com até `max_concorrencia` requisições de incorporação
+    simultâneas. O uso de memória não depende do tamanho do repositório, e o progresso é gravado
+    à medida que a ingestão avança.
+
+    Os arquivos são fragmentados nos limites das funções, classes e blocos da linguagem (fragmentar_codigo),
+    e o símbolo e as linhas de cada fragmento são registrados nos metadados ('symbol', 'start_line', 'end_line').
+
+    No modo incremental, apenas os arquivos novos ou alterados (segundo o hash do conteúdo
+    registrado nos metadados) são incorporados novamente, e os fragmentos de arquivos
+    alterados ou removidos são apagados da base de dados.
+
+    O progresso é registrado em um checkpoint, então uma ingestão interrompida retoma
+    do ponto onde parou ao ser executada novamente.
+
+    Se `varredura` (o resultado de escanear_repo) for informada, os arquivos, hashes e textos
+    já obtidos na estimativa de custo são reaproveitados, sem ler o repositório novamente.
+
+    `db` pode ser a base particionada (BaseRepos), e nesse caso os fragmentos são gravados no
+    dataset do repositório, com um único escritor por repositório. `repoFolder` pode ser qualquer fonte retornada por download_and_extract_repo (um diretório,
+    FonteGit ou FonteArquivo).
+
+    Os fragmentos também são gravados no índice lexical do repositório (`indice_lexico`, obtido da base
+    particionada quando não for informado), usado na busca híbrida.
+
+    Se `manifesto` for informado, o repositório é registrado nele (com a quantidade de fragmentos,
+    o hash de cada arquivo, o modelo de incorporação e `source_ref`) apenas ao final da ingestão.
+    """
+    # Cada repositório é gravado no seu próprio dataset, por um escritor de cada vez
+    if isinstance(db, BaseRepos):
+        with db.escrita(repoName) as base:
+            # Outra sessão ou processo pode ter indexado o repositório enquanto a trava era aguardada
+            incremental = incremental or (manifesto is not None and manifesto.contem(repoName))
+            return db_add_repo_files(base, repoName, repoFolder, extensoes_dev, incremental, tamanho_lote,
+                                     max_concorrencia, varredura, manifesto, source_ref, db.lexico(repoName))
+
+    # Repositórios indexados antes do índice lexical têm o índice preenchido a partir do dataset
+    if indice_lexico is not None and indice_lexico.vazio() and len(db.vectorstore) > 0:
+        reconstruir_indice_lexico(db, indice_lexico)
+
+    # Checkpoint com os fragmentos já gravados por uma execução anterior interrompida
+    checkpoint = Checkpoint(repoName)
+
+    # Hashes dos arquivos já indexados (apenas no modo incremental)
+    indexados = hashes_repo_db(db) if incremental else {}
+    inalterados = set()
+    processados = set()
+    file_hashes = {}
+    removidos = 0
+    # Arquivos ignorados pelo filtro (os arquivos removidos do repositório ou que passaram a ser ignorados
+    # têm os seus fragmentos apagados ao final)
+    relatorio = RelatorioFiltro()
+    # Tempo acumulado da fragmentação e do índice lexical, que acontecem intercalados no pipeline
+    tempos = {'fragmentacao': 0.0, 'indice_lexico': 0.0}
+
+    def remover_fragmentos(info):
+        # Apaga os fragmentos antigos de um arquivo (exceto os gravados por uma execução interrompida)
+        nonlocal removidos
+        ids = [id for id in info['ids'] if id not in checkpoint.ids]
+        if ids:
+            db.vectorstore.delete(ids=ids)
+            if indice_lexico is not None:
+                indice_lexico.remover(ids)
+            removidos += len(ids)
+
+    def manter(caminho_relativo):
+        # Um arquivo que não pôde ser lido (por exemplo, um erro transitório) mantém os fragmentos e o hash
+        # da ingestão anterior, em vez de ser removido da base ao final
+        info = indexados.get(caminho_relativo)
+        if info:
+            inalterados.add(caminho_relativo)
+            file_hashes[caminho_relativo] = info['file_hash']
+        else:
+            file_hashes.pop(caminho_relativo, None)
+
+    def carregar_documentos():
+        for caminho, caminho_relativo, ler in iterar_arquivos(repoFolder, extensoes_dev, relatorio=relatorio):
+            # Reaproveita o hash e o texto da varredura da estimativa de custo, quando houver
+            arquivo = varredura.get(caminho_relativo) if varredura is not None else None
+            conteudo = None
+            if arquivo is not None and arquivo.file_hash is None:
+                # Erro de leitura na varredura
+                manter(caminho_relativo)
+                continue
+            elif arquivo is not None:
+                file_hash, texto = arquivo.file_hash, arquivo.texto
+            elif varredura is not None:
+                # Arquivo descartado pela varredura (conteúdo binário, gerado ou minificado)
+                continue
+            else:
+                try:
+                    conteudo = ler()
+                except OSError as e:
+                    print(e)
+                    manter(caminho_relativo)
+                    continue
+                motivo = motivo_conteudo(conteudo)
+                if motivo is not None:
+                    relatorio.registrar(caminho_relativo, motivo, len(conteudo))
+                    continue
+                file_hash, texto = hash_conteudo(conteudo), None
+
+            # Ignora os arquivos que não mudaram
+            # (arquivos gravados parcialmente por uma execução interrompida ou por outra versão do fragmentador
+            # são processados novamente)
+            file_hashes[caminho_relativo] = file_hash
+            info = indexados.get(caminho_relativo)
+            if info and info['file_hash'] == file_hash and info['fragmentador'] == VERSAO_FRAGMENTADOR \
+                    and checkpoint.ids.isdisjoint(info['ids']):
+                inalterados.add(caminho_relativo)
+                continue
+
+            if texto is None:
+                try:
+                    texto = decodificar(conteudo if conteudo is not None else ler())
+                except OSError as e:
+                    print(e)
+                    manter(caminho_relativo)
+                    continue
+
+            # Os fragmentos antigos de um arquivo alterado são apagados antes de os novos serem gravados
+            processados.add(caminho_relativo)
+            if info:
+                remover_fragmentos(info)
+
+            yield Document(page_content=texto,
+                           metadata={'source': caminho, 'path': caminho_relativo, 'file_hash': file_hash, 'repo': repoName})
+
+    def fragmentar(documentos):
+        for doc in documentos:
+            # Fragmentos que respeitam os limites das funções e classes, com o símbolo e as linhas de cada um
+            inicio = time.perf_counter()
+            fragmentos_doc = fragmentar_codigo(doc.page_content, doc.metadata['path'])
+            tempos['fragmentacao'] += time.perf_counter() - inicio
+            for posicao, fragmento in enumerate(fragmentos_doc):
+                chunk = Document(page_content=fragmento.texto,
+                                 metadata={**doc.metadata, 'symbol': fragmento.simbolo, 'start_line': fragmento.linha_inicial,
+                                           'end_line': fragmento.linha_final, 'fragmentador': VERSAO_FRAGMENTADOR})
+                # Registra o hash do fragmento e gera um id determinístico, para que uma ingestão
+                # interrompida possa ser retomada
+                chunk.metadata['chunk_hash'] = hash_conteudo(chunk.page_content)
+                yield hash_conteudo(f"{repoName}:{chunk.metadata['path']}:{posicao}:{chunk.metadata['chunk_hash']}"), chunk
+
+    def indexar_lexico(fragmentos):
+        # Grava os fragmentos no índice lexical, um lote por transação, à medida que eles passam pelo pipeline
+        for lote in agrupar(fragmentos, tamanho_lote):
+            inicio = time.perf_counter()
+            indice_lexico.adicionar(lote)
+            tempos['indice_lexico'] += time.perf_counter() - inicio
+            yield from lote
+
+    fragmentos = fragmentar(carregar_documentos())
+    if indice_lexico is not None:
+        fragmentos = indexar_lexico(fragmentos)
 
     # Gera as incorporações de texto para a base de código alvo
-    db.add_documents(chunks)
+    gravados = gravar_fragmentos(db, fragmentos, checkpoint=checkpoint,
+                                 tamanho_lote=tamanho_lote, max_concorrencia=max_concorrencia)
+
+    # Apaga os fragmentos dos arquivos removidos (e os fragmentos antigos, sem hash registrado)
+    for caminho, info in indexados.items():
+        if caminho not in inalterados and caminho not in processados:
+            remover_fragmentos(info)
+
+    if incremental:
+        print(f"Sincronização de {repoName}: {len(processados)} arquivos novos ou alterados, "
+              f"{len(inalterados)} inalterados, {removidos} fragmentos removidos")
+
+    checkpoint.remover()
+
+    registrar('fragmentacao', tempos['fragmentacao'], arquivos=len(processados), fragmentos=gravados)
+    if indice_lexico is not None:
+        registrar('indice_lexico', tempos['indice_lexico'], fragmentos=gravados)
+    anotar(repo=repoName, arquivos_processados=len(processados), arquivos_inalterados=len(inalterados),
+           arquivos_ignorados=relatorio.arquivos, fragmentos_gravados=gravados, fragmentos_removidos=removidos)
+
+    # Registra o repositório no manifesto apenas depois da ingestão concluída
+    if manifesto is not None:
+        embeddings = db._embedding_function
+        manifesto.registrar(repoName, len(db.vectorstore), file_hashes,
+                            embedding_model=getattr(embeddings, 'modelo', None) or getattr(embeddings, 'model', None),
+                            source_ref=source_ref)
     return db
 
-def get_retriever(db, repo):
+def get_retriever(db, repo, versao=None):
     """
-    Esta função cria um recuperador para um repositório específico.
+    Esta função retorna o recuperador híbrido de um repositório específico, que combina a busca vetorial
+    com o índice lexical do repositório (e responde às localizações de símbolos apenas pelo índice lexical).
+    O recuperador vetorial é compartilhado e só é criado novamente quando a versão do índice do repositório muda.
 
     Args:
-        db (Dataset): A base de dados onde os documentos estão armazenados.
+        db (BaseRepos): A base de dados particionada onde os documentos estão armazenados.
         repo (str): O nome do repositório para o qual o recuperador será criado.
+        versao (int, optional): A versão do índice do repositório no manifesto.
 
     Returns:
         Retriever: O recuperador criado para o repositório especificado.
     """
 
-    # Retorna um recuperador para o repositório especificado
-    # O recuperador é configurado para usar a métrica de distância cosseno, buscar os 100 documentos mais próximos,
-    # usar a Relevância Marginal Máxima (Maximal Marginal Relevance - MMR) para diversificar os resultados,
-    # retornar os 10 documentos mais relevantes e filtrar os documentos para incluir apenas aqueles do repositório especificado
-    return db.as_retriever( search_kwargs={'distance_metric': 'cos', 'fetch_k': 100, 'maximal_marginal_relevance': True, 'k': 10, 'filter': {'metadata': { 'repo':repo }}})
+    # A configuração da busca (quantidade de candidatos e de resultados, MMR) é a do repositório em busca.json,
+    # ou a padrão (retrieval.CONFIG_BUSCA). A busca vetorial usa a similaridade de cosseno, ajusta a quantidade de
+    # candidatos ao tamanho do repositório e a de resultados à dispersão das similaridades, e diversifica os
+    # resultados com a Relevância Marginal Máxima (MMR). Como cada repositório tem o seu próprio dataset, não é preciso filtrar.
+    config = config_busca(repo)
+    vetorial = db.recuperador(repo, versao, config)
+    # Os resultados vetoriais são combinados com os do índice lexical (BM25 e símbolos) pela fusão RRF
+    return RecuperadorHibrido(vetorial=vetorial, indice=db.lexico(repo), k=config['k'])
 
 
-def check_repo_in_db(db, repo):
+def check_repo_in_db(manifesto, repo):
     """
     Esta função verifica se um repositório específico já está na base de dados.
 
     Args:
-        db (Dataset): A base de dados onde os documentos estão armazenados.
+        manifesto (Manifesto): O manifesto dos repositórios indexados.
         repo (str): O nome do repositório a ser verificado.
 
     Returns:
         bool: True se o repositório estiver na base de dados, False caso contrário.
     """
 
-    # Faz uma busca na base de dados filtrando pelos documentos do repositório especificado
-    # Retorna True se algum documento for encontrado, False caso contrário
-    return len(db.vectorstore.search(filter={'metadata': { 'repo':repo }})['id']) > 0
+    # Consulta o manifesto pela chave do repositório, sem acessar a base de dados vetorial
+    return manifesto.contem(repo)
 
 import tiktoken
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Resultado da varredura de um arquivo: o texto só é mantido enquanto couber no limite de memória da varredura,
+# e o hash é None se o arquivo não pôde ser lido (a ingestão mantém os fragmentos anteriores)
+ArquivoRepo = namedtuple('ArquivoRepo', ['caminho', 'caminho_relativo', 'file_hash', 'tokens', 'texto'])
+
+@functools.lru_cache(maxsize=None)
+def obter_encoding(nome="cl100k_base"):
+    """
+    Esta função obtém o encoding do tiktoken, criado uma única vez por processo.
+
+    Args:
+        nome (str, optional): O nome do encoding.
+
+    Returns:
+        Encoding: O encoding do tiktoken.
+    """
+    return tiktoken.get_encoding(nome)
+
+def contar_tokens(texto):
+    """
+    Esta função conta os tokens de um texto com o encoding cl100k_base.
+
+    Args:
+        texto (str): O texto a ser analisado.
+
+    Returns:
+        int: O total de tokens no texto.
+    """
+    return len(obter_encoding().encode(texto, disallowed_special=()))
 
 def calcular_total_tokens(nome_arquivo):
     """
@@ -188,32 +756,84 @@ def calcular_total_tokens(nome_arquivo):
     Returns:
         int: O total de tokens no arquivo.
     """
+    with open(nome_arquivo, 'rb') as arquivo:
+        return contar_tokens(decodificar(arquivo.read()))
 
-    # Obtém o encoding do modelo cl100k_base do tiktoken
-    encoding = tiktoken.get_encoding("cl100k_base")
+#total = calcular_total_tokens('meu_arquivo.txt')
 
-    # Tenta abrir o arquivo com a codificação utf-8
-    try:
-        with open(nome_arquivo, 'r', encoding='utf-8') as arquivo:
-            conteudo = arquivo.read()
-    # Se ocorrer um erro de decodificação, tenta abrir o arquivo com a codificação ISO-8859-1
-    except UnicodeDecodeError:
-        with open(nome_arquivo, 'r', encoding='ISO-8859-1') as arquivo:  # Tente uma codificação diferente
-            conteudo = arquivo.read()
+import os
+import fnmatch
 
-    # Codifica o conteúdo do arquivo em tokens
-    tokens = list(encoding.encode(conteudo, disallowed_special=()))
+@medir('varredura')
+def escanear_repo(diretorio, extensoes_dev=EXTENSOES_DEV, max_workers=None, limite_texto_mb=256, relatorio=None):
+    """
+    Esta função lê uma única vez cada arquivo de um diretório, calculando o hash e o total de tokens
+    de cada um em paralelo. O resultado é usado tanto para estimar o custo quanto pela ingestão,
+    que reaproveita os textos já decodificados em vez de ler os arquivos novamente.
 
-    # Calcula o total de tokens
-    total_tokens = len(tokens)
+    A contagem roda em um pool de threads: o tiktoken, a leitura dos arquivos e o hashlib liberam o GIL,
+    então as threads rodam em paralelo sem o custo de copiar os textos entre processos.
 
-    # Retorna o total de tokens
-    return total_tokens
+    Os arquivos passam pelo filtro antes da contagem: os excluídos pelo caminho (veja iterar_arquivos)
+    não são lidos, e os de conteúdo binário, gerado ou minificado não são tokenizados. Como a ingestão
+    reaproveita a varredura, os arquivos ignorados não entram nem na estimativa de custo nem na base.
 
-#total = calcular_total_tokens('meu_arquivo.txt')
+    Args:
+        diretorio (str | FonteGit | FonteArquivo): O diretório (ou a fonte) a ser analisado.
+        extensoes_dev (list, optional): Lista de extensões de arquivo a serem consideradas. Se None, todos os arquivos serão considerados.
+        max_workers (int, optional): A quantidade de threads. Se None, usa o padrão do ThreadPoolExecutor.
+        limite_texto_mb (int, optional): O total de texto, em MB, mantido na memória para a ingestão.
+                                         Os arquivos que passarem do limite são lidos novamente na ingestão.
+        relatorio (RelatorioFiltro, optional): O relatório onde os arquivos ignorados pelo filtro são registrados.
 
-import os
-import fnmatch
+    Returns:
+        dict: Um dicionário {caminho relativo: ArquivoRepo}.
+    """
+    relatorio = relatorio if relatorio is not None else RelatorioFiltro()
+    limite = limite_texto_mb * 1024 * 1024
+    em_memoria = 0
+    total_bytes = 0
+    lock = threading.Lock()
+
+    def processar(arquivo):
+        nonlocal em_memoria, total_bytes
+        caminho, caminho_relativo, ler = arquivo
+        try:
+            conteudo = ler()
+        except OSError as e:
+            print(e)
+            return ArquivoRepo(caminho, caminho_relativo, None, 0, None)
+        motivo = motivo_conteudo(conteudo)
+        if motivo is not None:
+            relatorio.registrar(caminho_relativo, motivo, len(conteudo))
+            return None
+        texto = decodificar(conteudo)
+        tokens = contar_tokens(texto)
+
+        # Descarta o texto dos arquivos que passarem do limite de memória
+        with lock:
+            total_bytes += len(conteudo)
+            if em_memoria + len(texto) > limite:
+                texto = None
+            else:
+                em_memoria += len(texto)
+        return ArquivoRepo(caminho, caminho_relativo, hash_conteudo(conteudo), tokens, texto)
+
+    max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+    varredura = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        arquivos = iterar_arquivos(diretorio, extensoes_dev, relatorio=relatorio)
+        if not isinstance(diretorio, str):
+            # Os zips, tars e repositórios git são lidos na thread que os percorre, enquanto estão abertos
+            # (os seus leitores não são compartilhados entre threads); as threads calculam os tokens e os hashes
+            arquivos = ((caminho, caminho_relativo, lambda conteudo=ler(): conteudo)
+                        for caminho, caminho_relativo, ler in arquivos)
+        for arquivo in mapear_em_ordem(executor, processar, arquivos, 4 * max_workers):
+            if arquivo is not None:
+                varredura[arquivo.caminho_relativo] = arquivo
+    anotar(arquivos=len(varredura), bytes=total_bytes, tokens=sum(arquivo.tokens for arquivo in varredura.values()),
+           ignorados=relatorio.arquivos, tokens_economizados=relatorio.tokens_economizados)
+    return varredura
 
 def calcular_total_tokens_diretorio(diretorio, extensoes_dev=None):   
     """
@@ -226,12 +846,8 @@ def calcular_total_tokens_diretorio(diretorio, extensoes_dev=None):
     Returns:
         int: O total de tokens em todos os arquivos do diretório.
     """
-    total_tokens = 0
-    for root, dirs, files in os.walk(diretorio):
-        for file in files:
-            if extensoes_dev is None or any(fnmatch.fnmatch(file, '*.' + ext) for ext in extensoes_dev):
-                total_tokens += calcular_total_tokens(os.path.join(root, file))
-    return total_tokens
+    varredura = escanear_repo(diretorio, extensoes_dev=extensoes_dev, limite_texto_mb=0)
+    return sum(arquivo.tokens for arquivo in varredura.values())
 
 def custo(total_tokens):
     """
@@ -246,18 +862,23 @@ def custo(total_tokens):
     #$0.0001 / 1K tokens
     return (total_tokens / 1000) * 0.0001
     
-def custo_embeddings_repo(diretorio):
+@medir('estimativa_custo')
+def custo_embeddings_repo(diretorio, varredura=None):
     """
     Esta função calcula o total de tokens e o custo em dólares para processar todos os arquivos de um diretório.
 
     Args:
         diretorio (str): O diretório a ser analisado.
+        varredura (dict, optional): O resultado de escanear_repo, se o diretório já tiver sido varrido.
 
     Returns:
         tuple: O total de tokens e o custo em dólares para processar todos os arquivos do diretório.
     """
-    total_tokens = calcular_total_tokens_diretorio(diretorio, extensoes_dev=EXTENSOES_DEV)
+    if varredura is None:
+        varredura = escanear_repo(diretorio, extensoes_dev=EXTENSOES_DEV, limite_texto_mb=0)
+    total_tokens = sum(arquivo.tokens for arquivo in varredura.values())
     custoUSD = custo(total_tokens)
+    anotar(tokens=total_tokens, custo_usd=round(custoUSD, 4))
     return total_tokens, custoUSD
 
 
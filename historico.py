@@ -0,0 +1,95 @@
+import os
+from functions import contar_tokens
+
+# Orçamento de tokens do histórico enviado à cadeia a cada pergunta (resumo + turnos recentes)
+HISTORICO_MAX_TOKENS = int(os.getenv('REPOCHAT_HISTORICO_MAX_TOKENS', 1500))
+
+# Pergunta usada para apresentar o resumo à cadeia como se fosse um turno da conversa
+PERGUNTA_RESUMO = "Resumo da conversa até aqui"
+
+PROMPT_RESUMO = """Resuma a conversa abaixo sobre um repositório de código em no máximo {palavras} palavras,
+mantendo os nomes de arquivos, funções, classes, erros e decisões mencionados.
+
+Resumo anterior:
+{resumo}
+
+Novos trechos da conversa:
+{conversa}
+
+Resumo atualizado:"""
+
+
+def criar_resumidor(llm, palavras=150):
+    """
+    Esta função cria um resumidor do histórico que usa um modelo de linguagem.
+
+    Args:
+        llm (BaseLanguageModel): O modelo usado para resumir (de preferência sem streaming).
+        palavras (int, optional): O tamanho máximo do resumo, em palavras.
+
+    Returns:
+        callable: Uma função que recebe o resumo anterior e os turnos removidos e retorna o novo resumo.
+    """
+    def resumir(resumo, turnos):
+        conversa = "\n".join(f"Usuário: {pergunta}\nAssistente: {resposta}" for pergunta, resposta in turnos)
+        return llm.predict(PROMPT_RESUMO.format(palavras=palavras, resumo=resumo or "(vazio)", conversa=conversa)).strip()
+    return resumir
+
+
+class HistoricoChat:
+    """
+    Histórico da conversa com um orçamento de tokens, contados com o tiktoken.
+
+    Os turnos mais recentes são mantidos na íntegra. Quando o total passa de `max_tokens`, os turnos
+    mais antigos saem do histórico: se houver um `resumidor`, eles são incorporados a um resumo
+    da conversa, enviado à cadeia como o primeiro turno; caso contrário, são descartados.
+    Assim, o custo de cada pergunta não cresce com o tamanho da conversa.
+    """
+
+    def __init__(self, max_tokens=HISTORICO_MAX_TOKENS, resumidor=None):
+        self.max_tokens = max_tokens
+        self.resumidor = resumidor
+        self.resumo = ""
+        self.turnos = []
+
+    def _tokens(self, turno):
+        return contar_tokens(turno[0]) + contar_tokens(turno[1])
+
+    def adicionar(self, pergunta, resposta):
+        """
+        Esta função adiciona um turno ao histórico e o compacta, se necessário.
+
+        Args:
+            pergunta (str): A pergunta do usuário.
+            resposta (str): A resposta do assistente.
+        """
+        self.turnos.append((pergunta, resposta, self._tokens((pergunta, resposta))))
+        self.compactar()
+
+    def compactar(self):
+        """
+        Esta função retira os turnos mais antigos até que o histórico caiba no orçamento de tokens
+        (o último turno é sempre mantido) e os incorpora ao resumo, se houver um resumidor.
+        """
+        total = contar_tokens(self.resumo) + sum(turno[2] for turno in self.turnos)
+        removidos = []
+        while total > self.max_tokens and len(self.turnos) > 1:
+            turno = self.turnos.pop(0)
+            removidos.append(turno[:2])
+            total -= turno[2]
+        if removidos and self.resumidor is not None:
+            self.resumo = self.resumidor(self.resumo, removidos)
+
+    def limpar(self):
+        """Esta função apaga o histórico e o resumo."""
+        self.resumo = ""
+        self.turnos = []
+
+    def para_cadeia(self):
+        """
+        Returns:
+            list: O histórico no formato da ConversationalRetrievalChain, como pares (pergunta, resposta),
+            com o resumo (se houver) como o primeiro par.
+        """
+        historico = [(PERGUNTA_RESUMO, self.resumo)] if self.resumo else []
+        return historico + [turno[:2] for turno in self.turnos]
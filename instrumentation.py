@@ -0,0 +1,294 @@
+import os
+import sys
+import json
+import time
+import threading
+import functools
+import contextvars
+import numpy as np
+from collections import deque
+from contextlib import contextmanager
+from langchain.callbacks.base import BaseCallbackHandler
+
+# Arquivo JSON lines onde as medições são acrescentadas (se não for definido, elas ficam apenas na memória)
+METRICAS_FILE = os.getenv('REPOCHAT_METRICAS')
+
+# Quantidade de medições mantidas na memória por instrumentação
+MAX_REGISTROS = int(os.getenv('REPOCHAT_METRICAS_MAX', 1000))
+
+
+def pico_rss_mb():
+    """Retorna o pico de memória residente (RSS) do processo, em MB, ou None se não for possível medir."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # No macOS o valor é em bytes; no Linux, em KB
+    return round(pico / (1024 * 1024) if sys.platform == 'darwin' else pico / 1024, 1)
+
+
+def rss_mb():
+    """Retorna a memória residente (RSS) atual do processo, em MB (no Linux; nos demais sistemas, o pico)."""
+    try:
+        with open('/proc/self/statm') as file:
+            paginas = int(file.read().split()[1])
+        return round(paginas * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024), 1)
+    except (OSError, ValueError, AttributeError):
+        return pico_rss_mb()
+
+
+def percentis(duracoes):
+    """Retorna o p50, o p99 e a média de uma lista de durações em segundos, em milissegundos."""
+    if not duracoes:
+        return {}
+    valores = np.asarray(duracoes) * 1000
+    return {'p50_ms': round(float(np.percentile(valores, 50)), 2), 'p99_ms': round(float(np.percentile(valores, 99)), 2),
+            'media_ms': round(float(valores.mean()), 2)}
+
+
+class Instrumentacao:
+    """
+    Registro das medições de cada etapa da ingestão e das perguntas: duração, memória e
+    contadores da etapa (bytes, tokens, arquivos, fragmentos etc.).
+
+    As etapas podem ser aninhadas; cada medição registra a etapa de nível superior em que
+    aconteceu ('operacao'). As medições mais recentes ficam na memória e, se `arquivo` for
+    informado, cada uma também é acrescentada a ele como uma linha JSON.
+    """
+
+    def __init__(self, arquivo=METRICAS_FILE, max_registros=MAX_REGISTROS):
+        self.arquivo = arquivo
+        self.registros = deque(maxlen=max_registros)
+        self._lock = threading.Lock()
+        self._pilhas = threading.local()
+
+    def _pilha(self):
+        if not hasattr(self._pilhas, 'etapas'):
+            self._pilhas.etapas = []
+        return self._pilhas.etapas
+
+    @contextmanager
+    def etapa(self, nome, **dados):
+        """
+        Mede uma etapa: a duração, a memória residente ao final e a sua variação.
+
+        Args:
+            nome (str): O nome da etapa.
+            **dados: Contadores e atributos da etapa.
+
+        Yields:
+            dict: Os dados da etapa, que podem ser completados dentro do bloco (por exemplo, dados['bytes'] = ...).
+        """
+        pilha = self._pilha()
+        operacao = pilha[0][0] if pilha else nome
+        pilha.append((nome, dados))
+        memoria = rss_mb()
+        inicio = time.perf_counter()
+        try:
+            yield dados
+        except BaseException as e:
+            dados['erro'] = type(e).__name__
+            raise
+        finally:
+            pilha.pop()
+            final = rss_mb()
+            self.registrar(nome, time.perf_counter() - inicio, operacao=operacao, rss_mb=final,
+                           delta_rss_mb=round(final - memoria, 1) if final is not None and memoria is not None else None,
+                           **dados)
+
+    def registrar(self, nome, duracao_s, **dados):
+        """
+        Registra a medição de uma etapa já medida (por exemplo, o tempo acumulado de várias chamadas).
+
+        Args:
+            nome (str): O nome da etapa.
+            duracao_s (float): A duração da etapa, em segundos.
+            **dados: Contadores e atributos da etapa.
+        """
+        pilha = self._pilha()
+        dados.setdefault('operacao', pilha[0][0] if pilha else nome)
+        registro = {'instante': round(time.time(), 3), 'etapa': nome, 'duracao_s': round(duracao_s, 4), **dados}
+        with self._lock:
+            self.registros.append(registro)
+            if self.arquivo:
+                with open(self.arquivo, 'a', encoding='utf-8') as file:
+                    file.write(json.dumps(registro, ensure_ascii=False, default=str) + "\n")
+
+    def em_andamento(self, nome):
+        """Retorna True se a etapa estiver sendo medida na thread atual."""
+        return any(aberta == nome for aberta, _ in self._pilha())
+
+    def anotar(self, **dados):
+        """Acrescenta contadores ou atributos à etapa mais interna em andamento na thread atual."""
+        pilha = self._pilha()
+        if pilha:
+            pilha[-1][1].update(dados)
+
+    def resumo(self, operacao=None):
+        """
+        Agrega as medições por etapa.
+
+        Args:
+            operacao (str, optional): Se informada, considera apenas as medições dessa operação.
+
+        Returns:
+            dict: Para cada etapa, a quantidade de medições, a duração total e média e a soma dos contadores numéricos.
+        """
+        with self._lock:
+            registros = [registro for registro in self.registros if operacao is None or registro['operacao'] == operacao]
+        resumo = {}
+        for registro in registros:
+            agregado = resumo.setdefault(registro['etapa'], {'n': 0, 'total_s': 0.0})
+            agregado['n'] += 1
+            agregado['total_s'] += registro['duracao_s']
+            for chave, valor in registro.items():
+                if chave not in ('instante', 'duracao_s', 'rss_mb', 'delta_rss_mb') and isinstance(valor, (int, float)) \
+                        and not isinstance(valor, bool):
+                    agregado[chave] = agregado.get(chave, 0) + valor
+        for agregado in resumo.values():
+            agregado['total_s'] = round(agregado['total_s'], 4)
+            agregado['media_s'] = round(agregado['total_s'] / agregado['n'], 4)
+        return resumo
+
+    def ultima(self, nome):
+        """Retorna a medição mais recente de uma etapa, ou None."""
+        with self._lock:
+            return next((registro for registro in reversed(self.registros) if registro['etapa'] == nome), None)
+
+    def ultima_operacao(self, nome):
+        """
+        Retorna as medições da execução mais recente de uma operação: a própria operação e as etapas medidas dentro dela.
+
+        Args:
+            nome (str): O nome da operação (a etapa de nível superior, por exemplo 'ingestao' ou 'pergunta').
+
+        Returns:
+            list: As medições da execução mais recente da operação, na ordem em que terminaram.
+        """
+        with self._lock:
+            registros = list(self.registros)
+        fim = next((i for i in range(len(registros) - 1, -1, -1)
+                    if registros[i]['etapa'] == nome and registros[i]['operacao'] == nome), None)
+        if fim is None:
+            return []
+        operacao = [registros[fim]]
+        for registro in reversed(registros[:fim]):
+            if registro['operacao'] != nome or registro['etapa'] == nome:
+                break
+            operacao.insert(0, registro)
+        return operacao
+
+    def jsonl(self):
+        """Retorna as medições na memória como JSON lines."""
+        with self._lock:
+            return "".join(json.dumps(registro, ensure_ascii=False, default=str) + "\n" for registro in self.registros)
+
+    def exportar(self, caminho):
+        """Grava as medições na memória em um arquivo JSON lines."""
+        with open(caminho, 'w', encoding='utf-8') as file:
+            file.write(self.jsonl())
+
+    def limpar(self):
+        """Apaga as medições na memória."""
+        with self._lock:
+            self.registros.clear()
+
+
+# Instrumentação usada quando nenhuma foi definida para o contexto atual (por exemplo, no cmdline.py)
+PADRAO = Instrumentacao()
+
+_atual = contextvars.ContextVar('instrumentacao', default=None)
+
+
+def atual():
+    """Retorna a instrumentação do contexto atual (a de cada sessão, no Streamlit) ou a padrão."""
+    return _atual.get() or PADRAO
+
+
+def usar(instrumentacao):
+    """Define a instrumentação do contexto atual."""
+    _atual.set(instrumentacao)
+
+
+def etapa(nome, **dados):
+    """Mede uma etapa na instrumentação atual (veja Instrumentacao.etapa)."""
+    return atual().etapa(nome, **dados)
+
+
+def registrar(nome, duracao_s, **dados):
+    """Registra uma medição na instrumentação atual (veja Instrumentacao.registrar)."""
+    atual().registrar(nome, duracao_s, **dados)
+
+
+def anotar(**dados):
+    """Acrescenta contadores ou atributos à etapa em andamento (veja Instrumentacao.anotar)."""
+    atual().anotar(**dados)
+
+
+def formatar(registros):
+    """
+    Esta função formata medições para exibição, uma por linha, com a duração e os contadores.
+
+    Args:
+        registros (list): As medições.
+
+    Returns:
+        str: As medições formatadas.
+    """
+    linhas = []
+    for registro in registros:
+        contadores = ", ".join(f"{chave}={valor}" for chave, valor in registro.items()
+                               if chave not in ('instante', 'etapa', 'duracao_s', 'operacao', 'rss_mb') and valor is not None)
+        linhas.append(f"{registro['etapa']}: {registro['duracao_s']:.3f}s" + (f" ({contadores})" if contadores else ""))
+    return "\n".join(linhas)
+
+
+def medir(nome):
+    """
+    Decorador que mede cada chamada de uma função como uma etapa. Chamadas aninhadas da mesma
+    etapa (por exemplo, recursivas) são medidas uma única vez.
+
+    Args:
+        nome (str): O nome da etapa.
+    """
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def medida(*args, **kwargs):
+            if atual().em_andamento(nome):
+                return funcao(*args, **kwargs)
+            with etapa(nome):
+                return funcao(*args, **kwargs)
+        return medida
+    return decorador
+
+
+class CallbackInstrumentacao(BaseCallbackHandler):
+    """
+    Callback da LangChain que registra a duração da busca e de cada chamada ao modelo
+    (e os tokens usados, quando a API os informa) na instrumentação.
+    """
+
+    def __init__(self, instrumentacao=None):
+        self.instrumentacao = instrumentacao or atual()
+        self._inicios = {}
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._inicios[run_id] = (time.perf_counter(), None)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        inicio, _ = self._inicios.pop(run_id, (time.perf_counter(), None))
+        self.instrumentacao.registrar('busca', time.perf_counter() - inicio, documentos=len(documents),
+                                      caracteres=sum(len(documento.page_content) for documento in documents))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._inicios[run_id] = (time.perf_counter(), (serialized or {}).get('kwargs', {}).get('model_name'))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.on_llm_start(serialized, [], run_id=run_id, **kwargs)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        inicio, modelo = self._inicios.pop(run_id, (time.perf_counter(), None))
+        uso = (response.llm_output or {}).get('token_usage') or {}
+        self.instrumentacao.registrar('llm', time.perf_counter() - inicio, modelo=modelo,
+                                      tokens_prompt=uso.get('prompt_tokens'), tokens_resposta=uso.get('completion_tokens'))
@@ -0,0 +1,264 @@
+import re
+import json
+import sqlite3
+import threading
+from typing import Any, List
+from langchain.schema import BaseRetriever, Document
+from langchain.callbacks.manager import CallbackManagerForRetrieverRun
+
+# Constante da fusão por posição recíproca (Reciprocal Rank Fusion)
+K_RRF = 60
+
+# Identificadores no código (nomes de funções, classes, variáveis)
+PADRAO_IDENTIFICADOR = re.compile(r'[A-Za-z_][A-Za-z0-9_]{2,}')
+
+# Identificadores que dificilmente são palavras comuns: snake_case, camelCase, PascalCase composto ou entre crases
+PADRAO_SIMBOLO_CONSULTA = re.compile(r'`([A-Za-z_][\w.]*)(?:\(\))?`|\b([A-Za-z_]\w*_\w+|[a-z]+[A-Z]\w*|[A-Z][a-z0-9]+[A-Z]\w*)\b')
+
+# Termos que indicam que a pergunta é a localização de um símbolo
+PADRAO_LOCALIZACAO = re.compile(r'\b(onde|where|defin\w*|usad\w*|used|uses?|usa|chamad\w*|called|calls?|chama\w*|encontr\w*|find|'
+                                r'implementad\w*|implemented|declarad\w*|declared|referenciad\w*|referenced)\b', re.IGNORECASE)
+
+PALAVRAS_VAZIAS = {'a', 'o', 'as', 'os', 'de', 'da', 'do', 'das', 'dos', 'e', 'é', 'em', 'no', 'na', 'nos', 'nas', 'um', 'uma',
+                   'que', 'qual', 'quais', 'como', 'para', 'por', 'com', 'se', 'ao', 'the', 'an', 'of', 'to', 'in', 'is',
+                   'and', 'or', 'what', 'how', 'does', 'do', 'it', 'this', 'that', 'for', 'on', 'with'}
+
+
+def simbolo_consulta(consulta):
+    """
+    Esta função identifica se uma pergunta é a localização de um símbolo do código, como
+    "onde `custo_embeddings_repo` é usada?" ou apenas "custo_embeddings_repo". Apenas nomes em
+    snake_case, camelCase, PascalCase composto ou entre crases são considerados símbolos.
+
+    Args:
+        consulta (str): A pergunta (já reformulada pela cadeia, se houver histórico).
+
+    Returns:
+        str: O nome do símbolo procurado, ou None se a pergunta não for uma localização de símbolo.
+    """
+    texto = consulta.strip().rstrip('?!.').strip()
+    # Uma palavra sozinha só é um símbolo se estiver entre crases ou tiver a forma de um identificador
+    # ("README" ou "authentication" são palavras comuns, que também aparecem como identificadores)
+    encontrado = re.fullmatch(r'(`?)([A-Za-z_][\w.]*)(?:\(\))?\1', texto)
+    if encontrado is not None and (encontrado.group(1) or PADRAO_SIMBOLO_CONSULTA.fullmatch(encontrado.group(2).split('.')[-1])):
+        return encontrado.group(2)
+    encontrado = PADRAO_SIMBOLO_CONSULTA.search(texto)
+    if encontrado is None or not PADRAO_LOCALIZACAO.search(texto):
+        return None
+    return encontrado.group(1) or encontrado.group(2)
+
+
+def _consulta_fts(consulta):
+    termos = [termo for termo in re.findall(r'\w+', consulta.lower()) if len(termo) > 1 and termo not in PALAVRAS_VAZIAS]
+    return " OR ".join(f'"{termo}"' for termo in dict.fromkeys(termos))
+
+
+def chave_documento(documento):
+    """Retorna a chave de um fragmento (caminho e hash do conteúdo), igual nos resultados vetoriais e lexicais."""
+    return documento.metadata.get('path'), documento.metadata.get('chunk_hash')
+
+
+class IndiceLexico:
+    """
+    Índice lexical dos fragmentos de um repositório, guardado em um banco SQLite ao lado do seu dataset.
+
+    Contém um índice invertido FTS5, consultado com a pontuação BM25 (o símbolo e o caminho pesam mais
+    que o texto), a tabela dos identificadores de cada fragmento (marcando os que ele define) e um índice
+    de trigramas dos identificadores, para encontrar nomes parciais. As consultas não dependem da rede.
+    """
+
+    def __init__(self, caminho):
+        self._lock = threading.Lock()
+        self._conexao = sqlite3.connect(caminho, timeout=60, check_same_thread=False, isolation_level=None)
+        self._conexao.execute("PRAGMA journal_mode=WAL")
+        self._conexao.execute("CREATE TABLE IF NOT EXISTS fragmentos (id TEXT UNIQUE NOT NULL, texto TEXT NOT NULL, metadata TEXT NOT NULL)")
+        # O rowid de cada linha do índice invertido é o rowid do fragmento
+        self._conexao.execute("CREATE VIRTUAL TABLE IF NOT EXISTS fts USING fts5 (texto, symbol, path, "
+                              "tokenize = \"unicode61 tokenchars '_'\")")
+        self._conexao.execute("CREATE TABLE IF NOT EXISTS simbolos (nome TEXT NOT NULL, id TEXT NOT NULL, definicao INTEGER NOT NULL, "
+                              "PRIMARY KEY (nome, id)) WITHOUT ROWID")
+        self._conexao.execute("CREATE INDEX IF NOT EXISTS simbolos_id ON simbolos (id)")
+        self._conexao.execute("CREATE TABLE IF NOT EXISTS nomes (nome TEXT UNIQUE NOT NULL)")
+        self._conexao.execute("CREATE VIRTUAL TABLE IF NOT EXISTS identificadores USING fts5 (nome, tokenize = 'trigram')")
+
+    def _transacao(self, operacao):
+        with self._lock:
+            self._conexao.execute("BEGIN IMMEDIATE")
+            try:
+                operacao(self._conexao)
+                self._conexao.execute("COMMIT")
+            except Exception:
+                self._conexao.execute("ROLLBACK")
+                raise
+
+    def fechar(self):
+        """Fecha a conexão com o banco do índice."""
+        with self._lock:
+            self._conexao.close()
+
+    def vazio(self):
+        """Retorna True se o índice não tiver nenhum fragmento."""
+        with self._lock:
+            return self._conexao.execute("SELECT 1 FROM fragmentos LIMIT 1").fetchone() is None
+
+    def adicionar(self, fragmentos):
+        """
+        Esta função adiciona (ou substitui) fragmentos no índice, em uma única transação.
+
+        Args:
+            fragmentos (list): Pares (id, Document) com os fragmentos.
+        """
+        def operacao(conexao):
+            for id, documento in fragmentos:
+                metadata = documento.metadata
+                simbolos = metadata.get('symbol') or ""
+                existente = conexao.execute("SELECT rowid FROM fragmentos WHERE id = ?", (id,)).fetchone()
+                if existente is not None:
+                    rowid = existente[0]
+                    conexao.execute("UPDATE fragmentos SET texto = ?, metadata = ? WHERE rowid = ?",
+                                    (documento.page_content, json.dumps(metadata), rowid))
+                    conexao.execute("DELETE FROM fts WHERE rowid = ?", (rowid,))
+                    conexao.execute("DELETE FROM simbolos WHERE id = ?", (id,))
+                else:
+                    rowid = conexao.execute("INSERT INTO fragmentos (id, texto, metadata) VALUES (?, ?, ?)",
+                                            (id, documento.page_content, json.dumps(metadata))).lastrowid
+                conexao.execute("INSERT INTO fts (rowid, texto, symbol, path) VALUES (?, ?, ?, ?)",
+                                (rowid, documento.page_content, simbolos, metadata.get('path') or ""))
+                # Os símbolos definidos no fragmento, pelo nome completo e pelo último nome ("Classe.metodo" e "metodo")
+                definidos = {parte for simbolo in simbolos.split(", ") if simbolo
+                             for parte in (simbolo, simbolo.rsplit(".", 1)[-1])}
+                nomes = definidos | set(PADRAO_IDENTIFICADOR.findall(documento.page_content))
+                conexao.executemany("INSERT OR IGNORE INTO simbolos (nome, id, definicao) VALUES (?, ?, ?)",
+                                    [(nome, id, int(nome in definidos)) for nome in nomes])
+                for nome in nomes:
+                    cursor = conexao.execute("INSERT OR IGNORE INTO nomes (nome) VALUES (?)", (nome,))
+                    if cursor.rowcount:
+                        conexao.execute("INSERT INTO identificadores (rowid, nome) VALUES (?, ?)", (cursor.lastrowid, nome))
+        self._transacao(operacao)
+
+    def remover(self, ids):
+        """
+        Esta função remove fragmentos do índice.
+
+        Args:
+            ids (list): Os ids dos fragmentos.
+        """
+        def operacao(conexao):
+            parametros = [(id,) for id in ids]
+            nomes = [nome for id in ids for nome, in conexao.execute("SELECT nome FROM simbolos WHERE id = ?", (id,))]
+            conexao.executemany("DELETE FROM fts WHERE rowid = (SELECT rowid FROM fragmentos WHERE id = ?)", parametros)
+            conexao.executemany("DELETE FROM fragmentos WHERE id = ?", parametros)
+            conexao.executemany("DELETE FROM simbolos WHERE id = ?", parametros)
+            # Identificadores que não aparecem em mais nenhum fragmento saem do índice de trigramas
+            for nome in set(nomes):
+                linha = conexao.execute("SELECT rowid FROM nomes WHERE nome = ? AND NOT EXISTS (SELECT 1 FROM simbolos WHERE nome = ?)",
+                                        (nome, nome)).fetchone()
+                if linha is not None:
+                    conexao.execute("DELETE FROM identificadores WHERE rowid = ?", linha)
+                    conexao.execute("DELETE FROM nomes WHERE rowid = ?", linha)
+        self._transacao(operacao)
+
+    def _documentos(self, ids):
+        documentos = []
+        with self._lock:
+            for id in ids:
+                linha = self._conexao.execute("SELECT texto, metadata FROM fragmentos WHERE id = ?", (id,)).fetchone()
+                if linha is not None:
+                    documentos.append(Document(page_content=linha[0], metadata=json.loads(linha[1])))
+        return documentos
+
+    def buscar(self, consulta, k=10):
+        """
+        Esta função busca os fragmentos mais relevantes para uma consulta pela pontuação BM25.
+
+        Args:
+            consulta (str): A consulta em texto livre.
+            k (int, optional): A quantidade de fragmentos retornados.
+
+        Returns:
+            list: Os fragmentos (Document), do mais para o menos relevante.
+        """
+        expressao = _consulta_fts(consulta)
+        if not expressao:
+            return []
+        with self._lock:
+            ids = [id for id, in self._conexao.execute("SELECT fragmentos.id FROM fts JOIN fragmentos ON fragmentos.rowid = fts.rowid "
+                                                       "WHERE fts MATCH ? ORDER BY bm25(fts, 1.0, 5.0, 2.0) LIMIT ?", (expressao, k))]
+        return self._documentos(ids)
+
+    def buscar_simbolo(self, nome, k=10):
+        """
+        Esta função busca os fragmentos que definem ou usam um símbolo: primeiro as definições e depois os usos.
+        Se o nome não for encontrado, procura os identificadores que o contêm (pelo índice de trigramas).
+
+        Args:
+            nome (str): O nome do símbolo (por exemplo, "funcao", "Classe" ou "Classe.metodo").
+            k (int, optional): A quantidade de fragmentos retornados.
+
+        Returns:
+            list: Os fragmentos (Document) encontrados.
+        """
+        nomes = list(dict.fromkeys([nome, nome.rsplit(".", 1)[-1]]))
+        with self._lock:
+            consulta = ("SELECT id, MAX(definicao) FROM simbolos WHERE nome IN ({}) GROUP BY id "
+                        "ORDER BY MAX(definicao) DESC, id LIMIT ?")
+            linhas = self._conexao.execute(consulta.format(", ".join("?" * len(nomes))), (*nomes, k)).fetchall()
+            if not linhas and len(nomes[-1]) >= 3:
+                parecidos = [parecido for parecido, in self._conexao.execute(
+                    "SELECT nome FROM identificadores WHERE identificadores MATCH ? LIMIT 20",
+                    ('"' + nomes[-1].replace('"', '""') + '"',))]
+                if parecidos:
+                    linhas = self._conexao.execute(consulta.format(", ".join("?" * len(parecidos))), (*parecidos, k)).fetchall()
+        return self._documentos([id for id, _ in linhas])
+
+
+def fundir_rrf(listas, k, k_rrf=K_RRF):
+    """
+    Esta função combina listas de fragmentos ordenadas por relevância pela fusão por posição recíproca (RRF):
+    cada fragmento recebe a soma de 1 / (k_rrf + posição) nas listas em que aparece.
+
+    Args:
+        listas (list): As listas de fragmentos (Document).
+        k (int): A quantidade de fragmentos retornados.
+        k_rrf (int, optional): A constante da fusão.
+
+    Returns:
+        list: Os k fragmentos com a maior pontuação.
+    """
+    pontuacoes = {}
+    documentos = {}
+    for lista in listas:
+        for posicao, documento in enumerate(lista):
+            chave = chave_documento(documento)
+            pontuacoes[chave] = pontuacoes.get(chave, 0.0) + 1.0 / (k_rrf + posicao + 1)
+            documentos.setdefault(chave, documento)
+    return [documentos[chave] for chave in sorted(pontuacoes, key=pontuacoes.get, reverse=True)[:k]]
+
+
+class RecuperadorHibrido(BaseRetriever):
+    """
+    Recuperador que combina a busca vetorial com o índice lexical do repositório.
+
+    Perguntas que são a localização de um símbolo (um identificador entre crases, ou um nome em snake_case ou
+    camelCase com "onde", "definida", "usada" etc.) são respondidas apenas pelo índice lexical, sem incorporar
+    a pergunta. As demais combinam os resultados vetoriais e os resultados BM25 pela fusão RRF.
+    """
+
+    vetorial: BaseRetriever
+    indice: Any
+    k: int = 10
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        simbolo = simbolo_consulta(query)
+        if simbolo is not None:
+            documentos = self.indice.buscar_simbolo(simbolo, self.k)
+            if documentos:
+                return documentos
+
+        lexicos = self.indice.buscar(query, self.k)
+        # Sem os callbacks da cadeia: apenas o resultado da fusão (o enviado ao modelo) dispara on_retriever_end
+        vetoriais = self.vetorial.get_relevant_documents(query, callbacks=None)
+        return fundir_rrf([vetoriais, lexicos], self.k)
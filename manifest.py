@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import pickle
+import sqlite3
+import threading
+
+# Arquivo do manifesto dos repositórios indexados
+MANIFEST_FILE = "manifest.db"
+
+# Lista de repositórios usada antes do manifesto, importada na primeira execução
+REPO_LIST_FILE = "repos_list.pkl"
+
+
+class Manifesto:
+    """
+    Registro dos repositórios indexados, guardado em um banco SQLite indexado pelo nome do repositório.
+
+    Para cada repositório são guardados a quantidade de fragmentos, o hash de cada arquivo, o modelo
+    de incorporação, a origem (URL ou caminho e referência), o instante da última ingestão e uma versão,
+    incrementada a cada ingestão. As consultas são feitas pela chave primária e as gravações são
+    transações do SQLite, então são atômicas e seguras entre processos.
+    """
+
+    def __init__(self, caminho=MANIFEST_FILE, repo_list_file=REPO_LIST_FILE):
+        self._lock = threading.Lock()
+        self._conexao = sqlite3.connect(caminho, timeout=60, check_same_thread=False, isolation_level=None)
+        self._conexao.execute("PRAGMA journal_mode=WAL")
+        self._conexao.execute("CREATE TABLE IF NOT EXISTS repos (repo TEXT PRIMARY KEY, chunks INTEGER NOT NULL DEFAULT 0, "
+                              "file_hashes TEXT NOT NULL DEFAULT '{}', embedding_model TEXT, source_ref TEXT, "
+                              "last_ingest REAL, versao INTEGER NOT NULL DEFAULT 0)")
+        self._importar_lista_antiga(repo_list_file)
+
+    def _importar_lista_antiga(self, repo_list_file):
+        """Importa os repositórios da lista em pickle usada antes do manifesto e a renomeia."""
+        if not repo_list_file or not os.path.exists(repo_list_file):
+            return
+        with open(repo_list_file, 'rb') as file:
+            repos_list = pickle.load(file)
+        with self._lock:
+            self._conexao.execute("BEGIN IMMEDIATE")
+            try:
+                self._conexao.executemany("INSERT OR IGNORE INTO repos (repo) VALUES (?)", [(repo,) for repo in dict.fromkeys(repos_list)])
+                self._conexao.execute("COMMIT")
+            except Exception:
+                self._conexao.execute("ROLLBACK")
+                raise
+        os.replace(repo_list_file, f"{repo_list_file}.importado")
+
+    def repos(self):
+        """
+        Returns:
+            list: Os nomes dos repositórios indexados, na ordem em que foram adicionados.
+        """
+        with self._lock:
+            return [repo for repo, in self._conexao.execute("SELECT repo FROM repos ORDER BY rowid")]
+
+    def contem(self, repo):
+        """Retorna True se o repositório estiver indexado."""
+        with self._lock:
+            return self._conexao.execute("SELECT 1 FROM repos WHERE repo = ?", (repo,)).fetchone() is not None
+
+    def obter(self, repo):
+        """
+        Args:
+            repo (str): O nome do repositório.
+
+        Returns:
+            dict: Os dados do repositório no manifesto, ou None se ele não estiver indexado.
+        """
+        with self._lock:
+            linha = self._conexao.execute("SELECT repo, chunks, file_hashes, embedding_model, source_ref, last_ingest, versao "
+                                          "FROM repos WHERE repo = ?", (repo,)).fetchone()
+        if linha is None:
+            return None
+        return {'repo': linha[0], 'chunks': linha[1], 'file_hashes': json.loads(linha[2]), 'embedding_model': linha[3],
+                'source_ref': linha[4], 'last_ingest': linha[5], 'versao': linha[6]}
+
+    def versao(self, repo):
+        """Retorna a versão do índice do repositório (0 se ele não estiver indexado)."""
+        with self._lock:
+            linha = self._conexao.execute("SELECT versao FROM repos WHERE repo = ?", (repo,)).fetchone()
+        return linha[0] if linha else 0
+
+    def registrar(self, repo, chunks, file_hashes, embedding_model=None, source_ref=None):
+        """
+        Registra (ou atualiza) um repositório depois de uma ingestão concluída e incrementa a sua versão.
+
+        Args:
+            repo (str): O nome do repositório.
+            chunks (int): A quantidade de fragmentos do repositório na base de dados.
+            file_hashes (dict): O hash de cada arquivo indexado, por caminho relativo.
+            embedding_model (str, optional): O modelo de incorporação usado.
+            source_ref (str, optional): A origem do repositório (URL ou caminho, e a referência).
+        """
+        with self._lock:
+            self._conexao.execute("BEGIN IMMEDIATE")
+            try:
+                self._conexao.execute(
+                    "INSERT INTO repos (repo, chunks, file_hashes, embedding_model, source_ref, last_ingest, versao) "
+                    "VALUES (?, ?, ?, ?, ?, ?, 1) "
+                    "ON CONFLICT (repo) DO UPDATE SET chunks = excluded.chunks, file_hashes = excluded.file_hashes, "
+                    "embedding_model = excluded.embedding_model, source_ref = COALESCE(excluded.source_ref, source_ref), "
+                    "last_ingest = excluded.last_ingest, versao = versao + 1",
+                    (repo, chunks, json.dumps(file_hashes), embedding_model, source_ref, time.time()))
+                self._conexao.execute("COMMIT")
+            except Exception:
+                self._conexao.execute("ROLLBACK")
+                raise
+
+    def remover(self, repo):
+        """Remove um repositório do manifesto."""
+        with self._lock:
+            self._conexao.execute("DELETE FROM repos WHERE repo = ?", (repo,))
@@ -0,0 +1,191 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from instrumentation import CallbackInstrumentacao, etapa
+
+# Arquivo do cache de respostas
+QA_CACHE_FILE = os.getenv('REPOCHAT_QA_CACHE', "qa_cache.db")
+
+# Tempo de validade de uma resposta, em segundos, e quantidade máxima de respostas guardadas
+QA_CACHE_TTL = int(os.getenv('REPOCHAT_QA_CACHE_TTL', 7 * 24 * 3600))
+QA_CACHE_MAX = int(os.getenv('REPOCHAT_QA_CACHE_MAX', 5000))
+
+# Similaridade mínima (cosseno) para reaproveitar a resposta de uma pergunta parecida. 0 desativa a busca por similaridade
+QA_CACHE_SIMILARIDADE = float(os.getenv('REPOCHAT_QA_CACHE_SIMILARIDADE', 0))
+
+
+def normalizar_pergunta(pergunta):
+    """
+    Esta função normaliza uma pergunta para comparação: minúsculas, espaços simplificados e sem pontuação final.
+
+    Args:
+        pergunta (str): A pergunta do usuário.
+
+    Returns:
+        str: A pergunta normalizada.
+    """
+    return re.sub(r'\s+', ' ', pergunta).strip().lower().rstrip('?!. ')
+
+
+class CacheRespostas:
+    """
+    Cache das respostas às perguntas, guardado em um banco SQLite.
+
+    A chave de cada resposta é o repositório, a versão do índice do repositório no manifesto,
+    a pergunta normalizada e o histórico da conversa. Como a versão muda a cada ingestão, as respostas
+    de um repositório reindexado deixam de ser usadas automaticamente (e são apagadas na próxima gravação).
+    As respostas expiram depois de `ttl` segundos e, acima de `max_entradas`, as acessadas há mais tempo
+    são removidas (LRU).
+
+    Se `embeddings` for informado, perguntas sem histórico também são comparadas, pela similaridade
+    das incorporações, às perguntas já respondidas no mesmo repositório e versão.
+    """
+
+    def __init__(self, caminho=QA_CACHE_FILE, ttl=QA_CACHE_TTL, max_entradas=QA_CACHE_MAX,
+                 embeddings=None, limiar_similaridade=QA_CACHE_SIMILARIDADE):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.embeddings = embeddings if limiar_similaridade > 0 else None
+        self.limiar_similaridade = limiar_similaridade
+        self._lock = threading.Lock()
+        self._conexao = sqlite3.connect(caminho, timeout=60, check_same_thread=False, isolation_level=None)
+        self._conexao.execute("PRAGMA journal_mode=WAL")
+        self._conexao.execute("CREATE TABLE IF NOT EXISTS respostas (chave TEXT PRIMARY KEY, repo TEXT NOT NULL, "
+                              "versao INTEGER NOT NULL, pergunta TEXT NOT NULL, vetor BLOB, resposta TEXT NOT NULL, "
+                              "fontes TEXT NOT NULL, criado REAL NOT NULL, acesso REAL NOT NULL)")
+        self._conexao.execute("CREATE INDEX IF NOT EXISTS respostas_repo ON respostas (repo, versao)")
+        self._conexao.execute("CREATE INDEX IF NOT EXISTS respostas_acesso ON respostas (acesso)")
+
+    def _chave(self, repo, versao, pergunta, historico):
+        dados = json.dumps([repo, versao, normalizar_pergunta(pergunta), [list(turno) for turno in historico]])
+        return hashlib.sha256(dados.encode('utf-8')).hexdigest()
+
+    def _vetor(self, pergunta):
+        vetor = np.asarray(self.embeddings.embed_query(normalizar_pergunta(pergunta)), dtype=np.float32)
+        return vetor / (np.linalg.norm(vetor) or 1.0)
+
+    def buscar(self, repo, versao, pergunta, historico=()):
+        """
+        Esta função busca a resposta de uma pergunta no cache.
+
+        Args:
+            repo (str): O nome do repositório.
+            versao (int): A versão do índice do repositório.
+            pergunta (str): A pergunta do usuário.
+            historico (list, optional): O histórico da conversa, como pares (pergunta, resposta).
+
+        Returns:
+            dict: A resposta ('answer') e as fontes ('sources'), ou None se a pergunta não estiver no cache.
+        """
+        agora = time.time()
+        chave = self._chave(repo, versao, pergunta, historico)
+        with self._lock:
+            linha = self._conexao.execute("SELECT chave, resposta, fontes FROM respostas WHERE chave = ? AND criado > ?",
+                                          (chave, agora - self.ttl)).fetchone()
+
+        # Sem resultado exato, procura uma pergunta parecida (apenas no início da conversa)
+        if linha is None and self.embeddings is not None and not historico:
+            vetor = self._vetor(pergunta)
+            with self._lock:
+                candidatos = self._conexao.execute("SELECT chave, resposta, fontes, vetor FROM respostas WHERE repo = ? AND versao = ? "
+                                                   "AND criado > ? AND vetor IS NOT NULL", (repo, versao, agora - self.ttl)).fetchall()
+            if candidatos:
+                vetores = np.stack([np.frombuffer(candidato[3], dtype=np.float32) for candidato in candidatos])
+                similaridades = vetores @ vetor
+                melhor = int(np.argmax(similaridades))
+                if similaridades[melhor] >= self.limiar_similaridade:
+                    linha = candidatos[melhor][:3]
+
+        if linha is None:
+            return None
+        with self._lock:
+            self._conexao.execute("UPDATE respostas SET acesso = ? WHERE chave = ?", (agora, linha[0]))
+        return {'answer': linha[1], 'sources': json.loads(linha[2])}
+
+    def gravar(self, repo, versao, pergunta, historico, resposta, fontes):
+        """
+        Esta função grava a resposta de uma pergunta no cache e remove as respostas de versões antigas
+        do repositório, as expiradas e, se necessário, as acessadas há mais tempo.
+
+        Args:
+            repo (str): O nome do repositório.
+            versao (int): A versão do índice do repositório.
+            pergunta (str): A pergunta do usuário.
+            historico (list): O histórico da conversa, como pares (pergunta, resposta).
+            resposta (str): A resposta gerada.
+            fontes (list): Os fragmentos recuperados, como dicionários com 'path' e 'chunk_hash'.
+        """
+        agora = time.time()
+        vetor = self._vetor(pergunta).tobytes() if self.embeddings is not None and not historico else None
+        with self._lock:
+            self._conexao.execute("BEGIN IMMEDIATE")
+            try:
+                self._conexao.execute("INSERT OR REPLACE INTO respostas (chave, repo, versao, pergunta, vetor, resposta, fontes, criado, acesso) "
+                                      "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                      (self._chave(repo, versao, pergunta, historico), repo, versao, normalizar_pergunta(pergunta),
+                                       vetor, resposta, json.dumps(fontes), agora, agora))
+                self._conexao.execute("DELETE FROM respostas WHERE (repo = ? AND versao < ?) OR criado <= ?", (repo, versao, agora - self.ttl))
+                self._conexao.execute("DELETE FROM respostas WHERE chave IN (SELECT chave FROM respostas ORDER BY acesso DESC LIMIT -1 OFFSET ?)",
+                                      (self.max_entradas,))
+                self._conexao.execute("COMMIT")
+            except Exception:
+                self._conexao.execute("ROLLBACK")
+                raise
+
+    def invalidar(self, repo):
+        """Remove todas as respostas de um repositório."""
+        with self._lock:
+            self._conexao.execute("DELETE FROM respostas WHERE repo = ?", (repo,))
+
+
+def fontes_resultado(result):
+    """
+    Esta função extrai os fragmentos recuperados do resultado da cadeia de perguntas e respostas.
+
+    Args:
+        result (dict): O resultado da ConversationalRetrievalChain (com return_source_documents=True).
+
+    Returns:
+        list: Os fragmentos recuperados, como dicionários com 'path' e 'chunk_hash'.
+    """
+    return [{'path': doc.metadata.get('path'), 'chunk_hash': doc.metadata.get('chunk_hash')}
+            for doc in result.get('source_documents', [])]
+
+
+def responder(qa_chain, cache, repo, versao, pergunta, historico, callbacks=None):
+    """
+    Esta função responde a uma pergunta usando o cache e, se a pergunta não estiver nele,
+    a cadeia de perguntas e respostas, gravando a resposta no cache.
+
+    Args:
+        qa_chain (ConversationalRetrievalChain): A cadeia de perguntas e respostas do repositório.
+        cache (CacheRespostas): O cache de respostas. Se None, a cadeia é sempre usada.
+        repo (str): O nome do repositório.
+        versao (int): A versão do índice do repositório.
+        pergunta (str): A pergunta do usuário.
+        historico (list): O histórico da conversa, como pares (pergunta, resposta).
+        callbacks (list, optional): Callbacks da LangChain repassados à cadeia (por exemplo, StreamHandler).
+
+    Returns:
+        dict: A resposta ('answer'), as fontes ('sources') e se ela veio do cache ('cache').
+    """
+    # A pergunta é medida como uma etapa, e a busca e as chamadas ao modelo, pelo callback de instrumentação
+    with etapa('pergunta', repo=repo, turnos_historico=len(historico)) as medicao:
+        if cache is not None:
+            resultado = cache.buscar(repo, versao, pergunta, historico)
+            if resultado is not None:
+                medicao['cache'] = True
+                return {**resultado, 'cache': True}
+
+        result = qa_chain({"question": pergunta, "chat_history": historico},
+                          callbacks=list(callbacks or []) + [CallbackInstrumentacao()])
+        fontes = fontes_resultado(result)
+        if cache is not None:
+            cache.gravar(repo, versao, pergunta, historico, result['answer'], fontes)
+        medicao.update(cache=False, fragmentos=len(fontes))
+        return {'answer': result['answer'], 'sources': fontes, 'cache': False}
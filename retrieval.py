@@ -0,0 +1,216 @@
+import os
+import json
+import math
+from typing import Any, List
+import numpy as np
+from langchain.schema import BaseRetriever, Document
+from langchain.callbacks.manager import CallbackManagerForRetrieverRun
+from instrumentation import etapa
+
+# Arquivo JSON com a configuração da busca: os valores padrão ("padrao") e os ajustes de cada repositório ("repos")
+BUSCA_CONFIG_FILE = os.getenv('REPOCHAT_BUSCA_CONFIG', "busca.json")
+
+# Configuração padrão da busca vetorial
+CONFIG_BUSCA = {
+    # Quantidade máxima de fragmentos retornados
+    'k': 10,
+    # Quantidade mínima de fragmentos, quando os mais próximos se destacam dos demais
+    'k_min': 4,
+    # Quantidade de candidatos: fetch_k_fator * raiz(fragmentos do repositório), entre fetch_k_min e fetch_k_max
+    'fetch_k_fator': 2.0,
+    'fetch_k_min': 20,
+    'fetch_k_max': 100,
+    # Candidatos com similaridade até essa distância da maior são considerados relevantes
+    'margem_similaridade': 0.05,
+    # Relevância Marginal Máxima (MMR): diversifica os resultados; lambda_mmr = 1 considera apenas a similaridade
+    'mmr': True,
+    'lambda_mmr': 0.5,
+}
+
+
+def config_busca(repo=None, caminho=BUSCA_CONFIG_FILE):
+    """
+    Esta função retorna a configuração da busca de um repositório: a configuração padrão, atualizada
+    com os valores padrão e os do repositório no arquivo de configuração, se ele existir. Por exemplo:
+
+        {"padrao": {"fetch_k_max": 60}, "repos": {"repochat": {"k": 6, "mmr": false}}}
+
+    Args:
+        repo (str, optional): O nome do repositório.
+        caminho (str, optional): O arquivo de configuração.
+
+    Returns:
+        dict: A configuração da busca.
+    """
+    config = dict(CONFIG_BUSCA)
+    if caminho and os.path.exists(caminho):
+        with open(caminho, encoding='utf-8') as file:
+            arquivo = json.load(file)
+        config.update(arquivo.get('padrao', {}))
+        config.update(arquivo.get('repos', {}).get(repo, {}))
+    desconhecidas = set(config) - set(CONFIG_BUSCA)
+    if desconhecidas:
+        raise ValueError(f"Opções de busca desconhecidas em {caminho}: {', '.join(sorted(desconhecidas))}")
+    return config
+
+
+def quantidade_candidatos(total, config):
+    """
+    Esta função calcula quantos candidatos são considerados na busca, proporcional à raiz do tamanho
+    do repositório: repositórios pequenos não precisam de 100 candidatos.
+
+    Args:
+        total (int): A quantidade de fragmentos do repositório.
+        config (dict): A configuração da busca.
+
+    Returns:
+        int: A quantidade de candidatos.
+    """
+    fetch_k = min(config['fetch_k_max'], max(config['fetch_k_min'], round(config['fetch_k_fator'] * math.sqrt(total))))
+    return min(total, max(fetch_k, config['k']))
+
+
+def quantidade_resultados(similaridades, config):
+    """
+    Esta função calcula quantos fragmentos são retornados a partir da dispersão das similaridades
+    dos candidatos: quando poucos se destacam, só eles (e no mínimo k_min) são retornados.
+
+    Args:
+        similaridades (np.ndarray): As similaridades dos candidatos, em ordem decrescente.
+        config (dict): A configuração da busca.
+
+    Returns:
+        int: A quantidade de fragmentos.
+    """
+    relevantes = int(np.count_nonzero(similaridades >= similaridades[0] - config['margem_similaridade']))
+    return min(len(similaridades), max(config['k_min'], min(config['k'], relevantes)))
+
+
+def mmr(similaridades, candidatos, k, lambda_mmr=0.5):
+    """
+    Esta função seleciona k candidatos pela Relevância Marginal Máxima. As similaridades entre os
+    candidatos são calculadas de uma vez, em uma única multiplicação de matrizes, e a redundância de
+    cada candidato é atualizada a cada seleção, então cada passo é uma operação vetorial.
+
+    Args:
+        similaridades (np.ndarray): A similaridade de cada candidato com a pergunta.
+        candidatos (np.ndarray): As incorporações normalizadas dos candidatos, uma por linha.
+        k (int): A quantidade de candidatos selecionados.
+        lambda_mmr (float, optional): O peso da similaridade com a pergunta em relação à diversidade.
+
+    Returns:
+        list: Os índices dos candidatos selecionados, na ordem de seleção.
+    """
+    k = min(k, len(candidatos))
+    if k <= 0:
+        return []
+    entre_candidatos = candidatos @ candidatos.T
+    selecionados = [int(np.argmax(similaridades))]
+    redundancia = entre_candidatos[selecionados[0]].copy()
+    disponiveis = np.ones(len(candidatos), dtype=bool)
+    disponiveis[selecionados[0]] = False
+    while len(selecionados) < k:
+        pontuacao = np.where(disponiveis, lambda_mmr * similaridades - (1 - lambda_mmr) * redundancia, -np.inf)
+        escolhido = int(np.argmax(pontuacao))
+        selecionados.append(escolhido)
+        disponiveis[escolhido] = False
+        np.maximum(redundancia, entre_candidatos[escolhido], out=redundancia)
+    return selecionados
+
+
+class IndiceVetorial:
+    """
+    As incorporações de um repositório em uma matriz NumPy, normalizadas uma única vez ao carregar,
+    com os textos e os metadados dos fragmentos.
+
+    A similaridade de cosseno com todos os fragmentos é um único produto matriz-vetor, sem ler o
+    dataset a cada pergunta, e a seleção dos candidatos e a MMR são operações vetoriais.
+    """
+
+    def __init__(self, matriz, textos, metadados):
+        self.matriz = matriz
+        self.textos = textos
+        self.metadados = metadados
+        # Memória aproximada do índice (a matriz e os textos), usada para limitar o cache da BaseRepos
+        self.bytes = matriz.nbytes + sum(len(texto) for texto in textos)
+
+    def __len__(self):
+        return len(self.textos)
+
+    @classmethod
+    def carregar(cls, base, tamanho_lote=10000):
+        """
+        Esta função carrega as incorporações, os textos e os metadados do dataset de um repositório.
+
+        Args:
+            base (DeepLake): A base de dados do repositório.
+            tamanho_lote (int, optional): A quantidade de fragmentos lidos de cada vez.
+
+        Returns:
+            IndiceVetorial: O índice carregado.
+        """
+        dataset = base.vectorstore.dataset
+        total = len(dataset)
+        with etapa('indice_vetorial', fragmentos=total):
+            matriz, textos, metadados = None, [], []
+            for inicio in range(0, total, tamanho_lote):
+                parte = dataset[inicio:inicio + tamanho_lote]
+                bloco = parte.embedding.numpy()
+                if matriz is None:
+                    matriz = np.empty((total, bloco.shape[1]), dtype=np.float32)
+                matriz[inicio:inicio + len(bloco)] = bloco
+                textos.extend(parte.text.data(aslist=True)['value'])
+                metadados.extend(parte.metadata.data(aslist=True)['value'])
+            if matriz is None:
+                return cls(np.empty((0, 0), dtype=np.float32), [], [])
+            normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+            matriz /= np.where(normas == 0, 1, normas)
+            return cls(matriz, textos, metadados)
+
+    def buscar(self, vetor, config):
+        """
+        Esta função busca os fragmentos mais próximos de uma incorporação.
+
+        Args:
+            vetor (list): A incorporação da pergunta.
+            config (dict): A configuração da busca.
+
+        Returns:
+            list: Os documentos encontrados.
+        """
+        if not len(self):
+            return []
+        consulta = np.asarray(vetor, dtype=np.float32)
+        consulta /= np.linalg.norm(consulta) or 1
+        similaridades = self.matriz @ consulta
+
+        # Os candidatos mais próximos, sem ordenar o repositório inteiro
+        fetch_k = quantidade_candidatos(len(self), config)
+        candidatos = np.argpartition(-similaridades, fetch_k - 1)[:fetch_k] if fetch_k < len(self) else np.arange(len(self))
+        candidatos = candidatos[np.argsort(-similaridades[candidatos])]
+
+        k = quantidade_resultados(similaridades[candidatos], config)
+        if config['mmr']:
+            selecionados = candidatos[mmr(similaridades[candidatos], self.matriz[candidatos], k, config['lambda_mmr'])]
+        else:
+            selecionados = candidatos[:k]
+        return [Document(page_content=self.textos[i], metadata=dict(self.metadados[i])) for i in selecionados]
+
+
+class RecuperadorVetorial(BaseRetriever):
+    """
+    Recuperador que incorpora a pergunta e busca os fragmentos no índice vetorial do repositório.
+
+    O índice é obtido a cada busca (obter_indice), e não guardado no recuperador: assim ele pode ser
+    descartado da memória pela BaseRepos mesmo enquanto a cadeia que usa o recuperador estiver em cache.
+    """
+
+    obter_indice: Any
+    embeddings: Any
+    config: dict
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.obter_indice().buscar(self.embeddings.embed_query(query), self.config)
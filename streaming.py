@@ -0,0 +1,46 @@
+from langchain.callbacks.base import BaseCallbackHandler
+
+
+class StreamHandler(BaseCallbackHandler):
+    """
+    Callback da LangChain que repassa a resposta do modelo token a token e os fragmentos
+    recuperados assim que a busca termina, para que as interfaces exibam a resposta
+    enquanto ela é gerada.
+
+    Apenas modelos criados com streaming=True geram tokens, então o modelo que reformula
+    a pergunta (condense_question_llm) deve ser criado sem streaming para não aparecer na resposta.
+    """
+
+    def __init__(self, ao_receber_token=None, ao_recuperar=None):
+        """
+        Args:
+            ao_receber_token (callable, optional): Chamada a cada token, com o token e o texto acumulado.
+            ao_recuperar (callable, optional): Chamada quando a busca termina, com os documentos recuperados.
+        """
+        self.ao_receber_token = ao_receber_token
+        self.ao_recuperar = ao_recuperar
+        self.texto = ""
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.texto += token
+        if self.ao_receber_token is not None:
+            self.ao_receber_token(token, self.texto)
+
+    def on_retriever_end(self, documents, **kwargs):
+        if self.ao_recuperar is not None:
+            self.ao_recuperar(documents)
+
+
+def caminhos_fontes(fontes):
+    """
+    Esta função lista, sem repetições, os arquivos de onde vieram os fragmentos recuperados.
+
+    Args:
+        fontes (list): Os documentos recuperados ou os dicionários de fontes do cache de respostas.
+
+    Returns:
+        list: Os caminhos dos arquivos, na ordem em que aparecem.
+    """
+    caminhos = [fonte.get('path') if isinstance(fonte, dict) else fonte.metadata.get('path', fonte.metadata.get('source'))
+                for fonte in fontes]
+    return list(dict.fromkeys(caminho for caminho in caminhos if caminho))
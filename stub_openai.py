@@ -0,0 +1,129 @@
+"""
+Servidor local que imita o endpoint de incorporações da API da OpenAI, para testar a
+ingestão sem acessar a rede e sem custo.
+
+As incorporações são determinísticas (derivadas do hash do texto) e o servidor pode
+responder com erros 429 aleatórios e latência artificial, para exercitar o backoff.
+
+Uso:
+    python stub_openai.py --porta 8765 --taxa-429 0.1 --latencia 0.2
+    OPENAI_API_BASE=http://localhost:8765/v1 OPENAI_API_KEY=stub streamlit run chat.py
+"""
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DIMENSAO = 1536
+
+
+def vetor_deterministico(entrada, dimensao=DIMENSAO):
+    """
+    Esta função gera um vetor normalizado e determinístico para uma entrada de incorporação.
+
+    Args:
+        entrada (str | list): O texto ou a lista de tokens enviada à API.
+        dimensao (int, optional): A dimensão do vetor.
+
+    Returns:
+        list: O vetor de incorporação.
+    """
+    semente = hashlib.sha256(json.dumps(entrada).encode('utf-8')).digest()
+    gerador = random.Random(semente)
+    vetor = [gerador.uniform(-1.0, 1.0) for _ in range(dimensao)]
+    norma = sum(v * v for v in vetor) ** 0.5
+    return [v / norma for v in vetor]
+
+
+def criar_handler(taxa_429=0.0, latencia=0.0, dimensao=DIMENSAO):
+    """
+    Esta função cria a classe que trata as requisições do servidor.
+
+    Args:
+        taxa_429 (float, optional): A probabilidade de responder com erro de limite de requisições.
+        latencia (float, optional): O tempo, em segundos, adicionado a cada resposta.
+        dimensao (int, optional): A dimensão dos vetores.
+
+    Returns:
+        type: A subclasse de BaseHTTPRequestHandler.
+    """
+    contadores = {'requisicoes': 0, 'limitadas': 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        estatisticas = contadores
+
+        def log_message(self, format, *args):
+            pass
+
+        def responder(self, status, corpo):
+            dados = json.dumps(corpo).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(dados)))
+            self.end_headers()
+            self.wfile.write(dados)
+
+        def do_POST(self):
+            corpo = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            with lock:
+                contadores['requisicoes'] += 1
+            if latencia:
+                time.sleep(latencia)
+
+            if not self.path.rstrip('/').endswith('/embeddings'):
+                self.responder(404, {'error': {'message': f"Endpoint não suportado: {self.path}"}})
+                return
+
+            if random.random() < taxa_429:
+                with lock:
+                    contadores['limitadas'] += 1
+                self.responder(429, {'error': {'message': "Rate limit reached", 'type': 'requests', 'code': 'rate_limit_exceeded'}})
+                return
+
+            entradas = corpo.get('input', [])
+            if isinstance(entradas, (str, int)) or (entradas and isinstance(entradas[0], int)):
+                entradas = [entradas]
+            self.responder(200, {
+                'object': 'list',
+                'model': corpo.get('model', 'stub'),
+                'data': [{'object': 'embedding', 'index': i, 'embedding': vetor_deterministico(entrada, dimensao)}
+                         for i, entrada in enumerate(entradas)],
+                'usage': {'prompt_tokens': 0, 'total_tokens': 0},
+            })
+
+    return Handler
+
+
+def iniciar_servidor(porta=0, taxa_429=0.0, latencia=0.0, dimensao=DIMENSAO):
+    """
+    Esta função inicia o servidor em uma thread em segundo plano.
+
+    Args:
+        porta (int, optional): A porta do servidor. Se 0, uma porta livre é escolhida.
+        taxa_429 (float, optional): A probabilidade de responder com erro de limite de requisições.
+        latencia (float, optional): O tempo, em segundos, adicionado a cada resposta.
+        dimensao (int, optional): A dimensão dos vetores.
+
+    Returns:
+        ThreadingHTTPServer: O servidor iniciado. A URL base da API é http://127.0.0.1:<porta>/v1.
+    """
+    servidor = ThreadingHTTPServer(('127.0.0.1', porta), criar_handler(taxa_429, latencia, dimensao))
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor local que imita a API de incorporações da OpenAI")
+    parser.add_argument('--porta', type=int, default=8765)
+    parser.add_argument('--taxa-429', type=float, default=0.0)
+    parser.add_argument('--latencia', type=float, default=0.0)
+    parser.add_argument('--dimensao', type=int, default=DIMENSAO)
+    args = parser.parse_args()
+
+    servidor = ThreadingHTTPServer(('127.0.0.1', args.porta), criar_handler(args.taxa_429, args.latencia, args.dimensao))
+    print(f"Servidor de incorporações em http://127.0.0.1:{args.porta}/v1")
+    servidor.serve_forever()
@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+# Os módulos do projeto ficam na raiz do repositório
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class ClienteDeepMemoryLocal:
+    """Substitui o cliente do Deep Memory, que o DeepLake consulta na Activeloop ao abrir um dataset."""
+
+    def __init__(self, token=None):
+        pass
+
+    def get_user_profile(self):
+        return {'name': 'public'}
+
+    def deepmemory_is_available(self, org_id):
+        return False
+
+
+class EncodingEspacos:
+    """Substitui o encoding do tiktoken, que é baixado na primeira utilização."""
+
+    def encode(self, texto, disallowed_special=()):
+        return texto.split()
+
+
+@pytest.fixture
+def ambiente(tmp_path, monkeypatch):
+    from deeplake.core.vectorstore import vectorstore_factory
+    import functions
+
+    # Sem rede: a ingestão grava os datasets, checkpoints e downloads em um diretório temporário
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('NO_PROXY', '127.0.0.1,localhost')
+    monkeypatch.setattr(vectorstore_factory, 'DeepMemoryBackendClient', ClienteDeepMemoryLocal)
+    monkeypatch.setattr(functions, 'obter_encoding', lambda nome="cl100k_base": EncodingEspacos())
+    return tmp_path
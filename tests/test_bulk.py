@@ -0,0 +1,56 @@
+import os
+
+from benchmark import EmbeddingsDeterministicas, compactar_como_github, gerar_repo_sintetico, iniciar_servidor_github
+from bulk import FilaIngestao, ingerir_lote
+from embeddings import Checkpoint
+from manifest import Manifesto
+from vectorstore import BaseRepos, nome_particao
+
+
+def _servir(dono, nome, semente):
+    gerar_repo_sintetico(f"{dono}-{nome}", 5, {'py': 0.5, 'md': 0.5}, semente=semente)
+    compactar_como_github(f"{dono}-{nome}", f"{dono}-{nome}.zip", f"{nome}-main")
+    servidor = iniciar_servidor_github(f"{dono}-{nome}.zip", f"{dono}/{nome}")
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}/{dono}/{nome}"
+
+
+def test_nome_particao_sem_colisoes():
+    assert nome_particao("repochat") == "repochat"
+    nomes = {nome_particao(repo) for repo in ("a/utils", "a_utils", "b/utils", "/home/a/utils", "..")}
+    assert len(nomes) == 5
+    assert all("/" not in nome and nome.strip(".") for nome in nomes)
+
+
+def test_checkpoint_de_repositorio_com_dono(ambiente):
+    checkpoint = Checkpoint("a/utils")
+    checkpoint.concluir(["1", "2"])
+    assert os.path.dirname(checkpoint.caminho) == "checkpoints"
+    assert Checkpoint("a/utils").ids == {"1", "2"}
+    assert Checkpoint("a_utils").ids == set()
+    checkpoint.remover()
+
+
+def test_ingerir_urls_com_o_mesmo_nome(ambiente):
+    servidores = []
+    try:
+        servidor_a, url_a = _servir("a", "utils", 1)
+        servidor_b, url_b = _servir("b", "utils", 2)
+        servidores = [servidor_a, servidor_b]
+        db = BaseRepos(EmbeddingsDeterministicas(16))
+        manifesto = Manifesto("manifest.db")
+        # Um repositório "utils" importado da lista antiga, sem a origem registrada, não pode ser sobrescrito
+        manifesto.registrar("utils", 7, {"antigo.py": "hash"})
+        fila = FilaIngestao("fila.db")
+        assert fila.adicionar([(url_a, None), (url_b, None)], manifesto=manifesto) == 2
+        assert ingerir_lote(db, manifesto, fila, downloads=2, ingestoes=2, max_tentativas=1) == {'concluido': 2}
+    finally:
+        for servidor in servidores:
+            servidor.shutdown()
+
+    assert [tarefa['repo'] for tarefa in fila.tarefas()] == ["a/utils", "b/utils"]
+    assert manifesto.obter("utils")['chunks'] == 7
+    assert manifesto.obter("a/utils")['source_ref'] == url_a
+    assert manifesto.obter("b/utils")['source_ref'] == url_b
+    assert manifesto.obter("a/utils")['file_hashes'] != manifesto.obter("b/utils")['file_hashes']
+    assert db.existe("a/utils") and db.existe("b/utils") and not db.existe("utils")
+    assert not os.listdir("checkpoints")
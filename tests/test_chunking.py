@@ -0,0 +1,130 @@
+from chunking import fragmentar_codigo
+
+PYTHON = (
+    "import os\n"
+    "\n"
+    "\n"
+    "def a():\n"
+    "    return 1\n"
+    "\n"
+    "\n"
+    "class B:\n"
+    "    def m(self):\n"
+    "        return 2\n"
+    "\n"
+    "    def n(self):\n"
+    "        return 3\n"
+)
+
+
+def test_arquivo_vazio():
+    assert fragmentar_codigo("", "a.py") == []
+
+
+def test_python_agrupa_definicoes_pequenas():
+    fragmentos = fragmentar_codigo(PYTHON, "a.py")
+    assert len(fragmentos) == 1
+    assert fragmentos[0].texto == PYTHON
+    assert fragmentos[0].simbolo == "a, B"
+    assert (fragmentos[0].linha_inicial, fragmentos[0].linha_final) == (1, 13)
+
+
+def test_python_subdivide_classe_nos_metodos():
+    fragmentos = fragmentar_codigo(PYTHON, "a.py", tamanho_maximo=40)
+    assert [fragmento.simbolo for fragmento in fragmentos] == ["a", "B", "B.m", "B.n"]
+    assert [(fragmento.linha_inicial, fragmento.linha_final) for fragmento in fragmentos] == [(1, 7), (8, 8), (9, 11), (12, 13)]
+    assert "".join(fragmento.texto for fragmento in fragmentos) == PYTHON
+
+
+def test_python_form_feed_nao_desloca_as_linhas():
+    texto = "def f():\n    return 1\n\x0c\n\ndef g():\n    x = 1\n    return x\n"
+    fragmentos = fragmentar_codigo(texto, "a.py", tamanho_maximo=30)
+    assert [(fragmento.simbolo, fragmento.linha_inicial, fragmento.linha_final) for fragmento in fragmentos] == [("f", 1, 4), ("g", 5, 6), ("g", 7, 7)]
+    assert "".join(fragmento.texto for fragmento in fragmentos) == texto
+
+
+def test_python_com_erro_de_sintaxe_usa_a_indentacao():
+    texto = "def f(:\n    return 1\n\ndef g():\n    return 2\n"
+    fragmentos = fragmentar_codigo(texto, "a.py", tamanho_maximo=20)
+    assert "".join(fragmento.texto for fragmento in fragmentos) == texto
+
+
+def test_chaves_subdivide_classe_nos_metodos():
+    texto = (
+        "class Conta {\n"
+        "  depositar(valor) {\n"
+        "    this.saldo += valor;\n"
+        "  }\n"
+        "  sacar(valor) {\n"
+        "    this.saldo -= valor;\n"
+        "  }\n"
+        "}\n"
+        "function soma(a, b) {\n"
+        "  return a + b;\n"
+        "}\n"
+    )
+    fragmentos = fragmentar_codigo(texto, "conta.js", tamanho_maximo=60)
+    assert [fragmento.simbolo for fragmento in fragmentos] == ["Conta", "Conta.depositar", "Conta.sacar", "soma"]
+    assert fragmentos[-1].linha_inicial == 9
+
+
+def test_chaves_em_strings_e_comentarios_sao_ignoradas():
+    texto = (
+        "function a() {\n"
+        "  const s = \"{\"; // {\n"
+        "  return s;\n"
+        "}\n"
+        "function b() {\n"
+        "  return '}';\n"
+        "}\n"
+    )
+    fragmentos = fragmentar_codigo(texto, "a.js", tamanho_maximo=60)
+    assert [fragmento.simbolo for fragmento in fragmentos] == ["a", "b"]
+
+
+def test_css_seletor_de_id_nao_e_comentario():
+    texto = "#header {\n  color: red;\n  margin: 0;\n}\n" + ".b {\n  x: 1;\n}\n"
+    fragmentos = fragmentar_codigo(texto, "estilo.css", tamanho_maximo=40)
+    assert fragmentos[0].simbolo == "#header"
+    assert (fragmentos[0].linha_inicial, fragmentos[0].linha_final) == (1, 4)
+    assert all(fragmento.simbolo is not None for fragmento in fragmentos)
+
+
+def test_shell_cerquilha_e_comentario():
+    texto = "# abre { no comentário\nfoo() {\n  echo 1\n}\nbar() {\n  echo 2\n}\n"
+    fragmentos = fragmentar_codigo(texto, "script.sh", tamanho_maximo=25)
+    assert [fragmento.simbolo for fragmento in fragmentos if fragmento.linha_inicial > 1] == ["foo", "bar"]
+
+
+
+def test_shell_cerquilha_sem_espaco_antes_nao_e_comentario():
+    texto = "foo() {\n  local n=${#arr[@]}\n  echo $n\n}\nbar() {\n  echo 1\n}\nbaz() {\n  echo 2 # fim {\n}\n"
+    fragmentos = fragmentar_codigo(texto, "script.sh", tamanho_maximo=40)
+    assert [fragmento.simbolo for fragmento in fragmentos] == ["foo", "foo, bar", "baz"]
+    assert (fragmentos[-1].linha_inicial, fragmentos[-1].linha_final) == (8, 10)
+
+
+def test_perl_ultimo_indice_nao_e_comentario():
+    texto = ("sub total {\n  my $s = 0;\n  for my $i (0..$#lista) {\n    $s += $lista[$i];\n  }\n  return $s;\n}\n"
+             "sub outra {\n  return 1;\n}\n")
+    fragmentos = fragmentar_codigo(texto, "soma.pl", tamanho_maximo=40)
+    assert [fragmento.simbolo for fragmento in fragmentos] == ["total", "total", "total", "total", "outra"]
+
+def test_markdown_por_titulos():
+    texto = "# Título\n\ntexto\n\n## Seção\n\nmais texto\n"
+    fragmentos = fragmentar_codigo(texto, "README.md", tamanho_maximo=20)
+    assert [fragmento.simbolo for fragmento in fragmentos] == ["Título", "Seção", "Seção"]
+
+
+def test_linha_maior_que_o_tamanho_maximo_e_cortada():
+    fragmentos = fragmentar_codigo("x" * 3500, "a.js", tamanho_maximo=1000)
+    assert [len(fragmento.texto) for fragmento in fragmentos] == [1000, 1000, 1000, 500]
+    assert all(fragmento.linha_inicial == 1 for fragmento in fragmentos)
+
+
+def test_quebras_de_linha_do_windows_e_mac_antigo():
+    for quebra in ("\r\n", "\r"):
+        texto = quebra.join(["def f():", "    return 1", "", "def g():", "    return 2", ""])
+        fragmentos = fragmentar_codigo(texto, "a.py", tamanho_maximo=25)
+        assert [fragmento.simbolo for fragmento in fragmentos] == ["f", "g"]
+        assert (fragmentos[1].linha_inicial, fragmentos[1].linha_final) == (4, 5)
@@ -0,0 +1,102 @@
+from filtering import FiltroArquivos, RegrasIgnorar, motivo_conteudo
+
+
+def test_padrao_sem_barra_vale_em_qualquer_nivel():
+    regras = RegrasIgnorar(["*.log", "segredo.txt"])
+    assert regras.ignorado("erro.log")
+    assert regras.ignorado("a/b/erro.log")
+    assert regras.ignorado("a/segredo.txt")
+    assert not regras.ignorado("a/erro.log.txt")
+
+
+def test_padrao_ancorado():
+    regras = RegrasIgnorar(["/gen", "docs/*.md"])
+    assert regras.ignorado("gen", diretorio=True)
+    assert not regras.ignorado("src/gen", diretorio=True)
+    assert regras.ignorado("docs/a.md")
+    assert not regras.ignorado("docs/sub/a.md")
+    assert not regras.ignorado("outro/docs/a.md")
+
+
+def test_padrao_apenas_de_diretorios():
+    regras = RegrasIgnorar(["saida/"])
+    assert regras.ignorado("saida", diretorio=True)
+    assert regras.ignorado("a/saida", diretorio=True)
+    assert not regras.ignorado("saida")
+
+
+def test_dois_asteriscos():
+    regras = RegrasIgnorar(["a/**/z.py", "**/tmp"])
+    assert regras.ignorado("a/z.py")
+    assert regras.ignorado("a/b/c/z.py")
+    assert regras.ignorado("x/y/tmp", diretorio=True)
+    assert not regras.ignorado("b/z.py")
+
+
+def test_negacao_e_ultima_regra_decide():
+    regras = RegrasIgnorar(["*.py", "!manter.py"])
+    assert regras.ignorado("a.py")
+    assert not regras.ignorado("manter.py")
+    assert not regras.ignorado("sub/manter.py")
+    regras.adicionar(["manter.py"])
+    assert regras.ignorado("manter.py")
+
+
+def test_comentarios_e_linhas_vazias():
+    regras = RegrasIgnorar(["# comentario", "", "   ", "\\#literal"])
+    assert not regras.ignorado("comentario")
+    assert regras.ignorado("#literal")
+
+
+def test_regras_relativas_ao_diretorio_do_arquivo():
+    regras = RegrasIgnorar()
+    regras.adicionar(["*.tmp", "/local"], base="pacote")
+    assert regras.ignorado("pacote/a.tmp")
+    assert regras.ignorado("pacote/sub/a.tmp")
+    assert not regras.ignorado("a.tmp")
+    assert regras.ignorado("pacote/local")
+    assert not regras.ignorado("local")
+
+
+def test_conteudo_binario():
+    assert motivo_conteudo(b"\x89PNG\r\n\x1a\n\0\0\0") == "binario"
+    assert motivo_conteudo(bytes(range(1, 8)) * 100) == "binario"
+
+
+def test_conteudo_gerado():
+    assert motivo_conteudo(b"// Code generated by protoc-gen-go. DO NOT EDIT.\npackage pb\n") == "gerado"
+    assert motivo_conteudo(b"#!/usr/bin/env python\n# @generated by ferramenta\nx = 1\n") == "gerado"
+    assert motivo_conteudo(b"/**\n * @generated\n */\nexport const x = 1;\n") == "gerado"
+
+
+def test_mencao_ao_marcador_nao_e_conteudo_gerado():
+    assert motivo_conteudo(b'MENSAGEM = "auto-generated, do not edit"\n') is None
+    assert motivo_conteudo(b'MARCADOR = b"@generated"\n') is None
+    assert motivo_conteudo(b"a = 1\n" * 5 + b"# @generated\n") is None
+
+
+def test_conteudo_minificado():
+    assert motivo_conteudo(b"a=1;b=f(a);" * 1000) == "minificado"
+    assert motivo_conteudo(b"var a = 1;\n" * 1000) is None
+
+
+def test_conteudo_de_texto():
+    assert motivo_conteudo(b"def f():\n    return 1\n") is None
+    assert motivo_conteudo("# Título\n\nOlá, ação!\n".encode("utf-8")) is None
+    assert motivo_conteudo("# Título\n\nOlá, ação!\n".encode("latin-1")) is None
+    assert motivo_conteudo(b"") is None
+
+
+def test_filtro_de_arquivos():
+    filtro = FiltroArquivos(lambda caminho: caminho.endswith((".py", ".json")), tamanho_maximo=100)
+    filtro.carregar_regras("src/.gitignore", "gerado/\n")
+    assert filtro.aceitar("src/a.py", 10)
+    assert not filtro.aceitar("src/a.txt", 10)
+    assert not filtro.aceitar("web/package-lock.json", 10)
+    assert not filtro.aceitar("node_modules/x/a.py", 10)
+    assert not filtro.aceitar("src/gerado/a.py", 10)
+    assert not filtro.aceitar("src/grande.py", 101)
+    assert not filtro.aceitar_diretorio("src/gerado")
+    assert filtro.aceitar_diretorio("gerado")
+    assert filtro.relatorio.arquivos == 4
+    assert filtro.relatorio.diretorios == 1
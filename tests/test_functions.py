@@ -0,0 +1,42 @@
+import os
+
+from benchmark import EmbeddingsDeterministicas
+from functions import db_add_repo_files, hashes_repo_db
+from manifest import Manifesto
+from vectorstore import BaseRepos
+
+
+def _escrever(caminho, texto):
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    with open(caminho, 'w', encoding='utf-8') as arquivo:
+        arquivo.write(texto)
+
+
+def _funcoes(prefixo, quantidade):
+    return "\n\n".join(f"def {prefixo}_{i}():\n    return {i}\n" for i in range(quantidade))
+
+
+def test_sincronizacao_incremental(ambiente):
+    _escrever("src/a.py", _funcoes("a", 20))
+    _escrever("src/b.py", _funcoes("b", 20))
+    _escrever("src/c.md", "# Título\n\ntexto\n")
+    db = BaseRepos(EmbeddingsDeterministicas(16))
+    manifesto = Manifesto("manifest.db")
+    db_add_repo_files(db, "repo", "src", manifesto=manifesto, tamanho_lote=4)
+    base = db.abrir("repo", manifesto.versao("repo"))
+    antes = hashes_repo_db(base)
+    assert set(antes) == {"a.py", "b.py", "c.md"}
+    # A leitura em partes agrupa os fragmentos como a leitura de uma só vez
+    assert hashes_repo_db(base, tamanho_lote=3) == antes
+
+    _escrever("src/b.py", _funcoes("b", 21))
+    _escrever("src/d.py", _funcoes("d", 2))
+    os.remove("src/c.md")
+    db_add_repo_files(db, "repo", "src", manifesto=manifesto, tamanho_lote=4)
+    depois = hashes_repo_db(db.abrir("repo", manifesto.versao("repo")), tamanho_lote=3)
+    assert set(depois) == {"a.py", "b.py", "d.py"}
+    assert depois["a.py"] == antes["a.py"]
+    assert depois["b.py"]['file_hash'] != antes["b.py"]['file_hash']
+    assert not set(depois["b.py"]['ids']) & set(antes["b.py"]['ids'])
+    assert set(manifesto.obter("repo")['file_hashes']) == {"a.py", "b.py", "d.py"}
+    assert manifesto.obter("repo")['chunks'] == sum(len(info['ids']) for info in depois.values())
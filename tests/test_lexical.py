@@ -0,0 +1,98 @@
+import pytest
+from langchain.schema import Document
+
+from lexical import IndiceLexico, fundir_rrf, simbolo_consulta
+
+
+def _documento(path, texto, symbol="", chunk_hash=None):
+    return Document(page_content=texto, metadata={'path': path, 'symbol': symbol, 'chunk_hash': chunk_hash or path})
+
+
+@pytest.fixture
+def indice(tmp_path):
+    indice = IndiceLexico(str(tmp_path / "lexico.db"))
+    indice.adicionar([
+        ("1", _documento("custos.py", "def custo_embeddings_repo(arquivos):\n    return sum(tokens)\n", "custo_embeddings_repo")),
+        ("2", _documento("chat.py", "total = custo_embeddings_repo(lista)\nprint(total)\n")),
+        ("3", _documento("readme.md", "Autenticação dos usuários com tokens de acesso.\n", "Autenticação")),
+        ("4", _documento("cliente.js", "class HttpClient {\n  get(url) {}\n}\n", "HttpClient")),
+    ])
+    yield indice
+    indice.fechar()
+
+
+def _caminhos(documentos):
+    return [documento.metadata['path'] for documento in documentos]
+
+
+def test_indice_novo_esta_vazio(tmp_path):
+    indice = IndiceLexico(str(tmp_path / "lexico.db"))
+    assert indice.vazio()
+    assert indice.buscar("qualquer coisa") == []
+    assert indice.buscar_simbolo("qualquer") == []
+    indice.fechar()
+
+
+def test_buscar_bm25(indice):
+    assert not indice.vazio()
+    assert _caminhos(indice.buscar("autenticação dos usuários"))[0] == "readme.md"
+    assert _caminhos(indice.buscar("custo_embeddings_repo"))[0] == "custos.py"
+    assert indice.buscar("o que é isso?") == []
+
+
+def test_buscar_simbolo_definicao_antes_do_uso(indice):
+    assert _caminhos(indice.buscar_simbolo("custo_embeddings_repo")) == ["custos.py", "chat.py"]
+    assert _caminhos(indice.buscar_simbolo("HttpClient.get")) == ["cliente.js"]
+
+
+def test_buscar_simbolo_por_nome_parcial(indice):
+    assert _caminhos(indice.buscar_simbolo("embeddings")) == ["custos.py", "chat.py"]
+    assert indice.buscar_simbolo("xy") == []
+
+
+def test_substituir_e_remover(indice):
+    indice.adicionar([("2", _documento("chat.py", "print('sem uso')\n"))])
+    assert _caminhos(indice.buscar_simbolo("custo_embeddings_repo")) == ["custos.py"]
+    indice.remover(["1"])
+    assert indice.buscar_simbolo("custo_embeddings_repo") == []
+    assert indice.buscar_simbolo("embeddings") == []
+    indice.remover(["2", "3", "4"])
+    assert indice.vazio()
+
+
+def test_indice_persistente(tmp_path):
+    caminho = str(tmp_path / "lexico.db")
+    indice = IndiceLexico(caminho)
+    indice.adicionar([("1", _documento("a.py", "def escanear_repo():\n    pass\n", "escanear_repo"))])
+    indice.fechar()
+    indice = IndiceLexico(caminho)
+    assert _caminhos(indice.buscar_simbolo("escanear_repo")) == ["a.py"]
+    indice.fechar()
+
+
+@pytest.mark.parametrize("consulta, simbolo", [
+    ("custo_embeddings_repo", "custo_embeddings_repo"),
+    ("`main`", "main"),
+    ("`f()`", "f"),
+    ("escanear_repo()?", "escanear_repo"),
+    ("functions.escanear_repo", "functions.escanear_repo"),
+    ("onde getUser é usada?", "getUser"),
+    ("where is HttpClient defined?", "HttpClient"),
+    ("onde `main` é chamada?", "main"),
+])
+def test_simbolo_consulta(consulta, simbolo):
+    assert simbolo_consulta(consulta) == simbolo
+
+
+@pytest.mark.parametrize("consulta", ["Explain", "README", "authentication?", "os.path", "Explain authentication",
+                                      "`README", "como funciona o custo_embeddings_repo?"])
+def test_consulta_que_nao_e_simbolo(consulta):
+    assert simbolo_consulta(consulta) is None
+
+
+def test_fundir_rrf():
+    a, b, c = _documento("a.py", "a"), _documento("b.py", "b"), _documento("c.py", "c")
+    # "b" aparece bem colocado nas duas listas e fica à frente de "a", o primeiro de apenas uma delas
+    assert _caminhos(fundir_rrf([[a, b, c], [b, c]], k=3)) == ["b.py", "c.py", "a.py"]
+    assert _caminhos(fundir_rrf([[a], []], k=1)) == ["a.py"]
+    assert fundir_rrf([[], []], k=3) == []
@@ -0,0 +1,65 @@
+import threading
+
+import vectorstore
+from benchmark import EmbeddingsDeterministicas
+from functions import db_add_repo_files
+from vectorstore import BaseRepos
+
+
+def _escrever(caminho, texto):
+    with open(caminho, 'w', encoding='utf-8') as arquivo:
+        arquivo.write(texto)
+
+
+def test_abrir_nao_bloqueia_os_outros_repositorios(ambiente, monkeypatch):
+    db = BaseRepos(EmbeddingsDeterministicas(16))
+    for repo in ("lento", "rapido"):
+        ambiente.joinpath(repo).mkdir()
+        _escrever(ambiente / repo / "a.py", f"def {repo}():\n    return 1\n")
+        db_add_repo_files(db, repo, repo)
+
+    liberar = threading.Event()
+    abrindo = threading.Event()
+    deeplake = vectorstore.DeepLake
+
+    def deeplake_lento(dataset_path, **kwargs):
+        if dataset_path == db.caminho("lento"):
+            abrindo.set()
+            assert liberar.wait(5)
+        return deeplake(dataset_path=dataset_path, **kwargs)
+
+    monkeypatch.setattr(vectorstore, 'DeepLake', deeplake_lento)
+    resultado = {}
+    thread = threading.Thread(target=lambda: resultado.setdefault('lento', db.abrir("lento", 1)))
+    thread.start()
+    try:
+        assert abrindo.wait(30)
+        # Enquanto o dataset "lento" é aberto, os outros repositórios continuam acessíveis
+        assert len(db.abrir("rapido", 1).vectorstore) == 1
+    finally:
+        liberar.set()
+        thread.join()
+    assert db.abrir("lento", 1) is resultado['lento']
+
+
+def test_dataset_aberto_durante_uma_gravacao_nao_e_guardado(ambiente, monkeypatch):
+    db = BaseRepos(EmbeddingsDeterministicas(16))
+    ambiente.joinpath("repo").mkdir()
+    _escrever(ambiente / "repo" / "a.py", "def f():\n    return 1\n")
+    db_add_repo_files(db, "repo", "repo")
+
+    deeplake = vectorstore.DeepLake
+
+    def deeplake_invalidado(dataset_path, **kwargs):
+        base = deeplake(dataset_path=dataset_path, **kwargs)
+        # Uma gravação termina (em outra thread) enquanto o dataset é aberto
+        gravacao = threading.Thread(target=db.invalidar, args=("repo",), daemon=True)
+        gravacao.start()
+        gravacao.join(5)
+        assert not gravacao.is_alive()
+        return base
+
+    monkeypatch.setattr(vectorstore, 'DeepLake', deeplake_invalidado)
+    antiga = db.abrir("repo", 1)
+    monkeypatch.setattr(vectorstore, 'DeepLake', deeplake)
+    assert db.abrir("repo", 1) is not antiga
@@ -0,0 +1,291 @@
+import os
+import re
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from filelock import FileLock
+from langchain.vectorstores import DeepLake
+from lexical import IndiceLexico
+from retrieval import IndiceVetorial, RecuperadorVetorial, config_busca
+
+# Diretório onde fica o dataset DeepLake de cada repositório
+DB_DIR = "deeplake_repos"
+
+# Dataset único usado antes da separação por repositório
+LEGACY_DB_DIR = "deeplake"
+
+# Quantidade máxima de repositórios com o dataset aberto (e as incorporações carregadas) ao mesmo tempo
+MAX_REPOS_ABERTOS = int(os.getenv('REPOCHAT_MAX_REPOS_ABERTOS', 32))
+
+# Memória máxima, em MB, das incorporações carregadas para a busca, somando todos os repositórios
+MAX_MEMORIA_VETORIAL_MB = int(os.getenv('REPOCHAT_MAX_MEMORIA_VETORIAL_MB', 2048))
+
+
+def nome_particao(repo):
+    """
+    Esta função converte o nome de um repositório no nome do diretório do seu dataset.
+
+    Args:
+        repo (str): O nome do repositório.
+
+    Returns:
+        str: O nome do diretório, apenas com letras, números, ".", "_" e "-".
+    """
+    nome = re.sub(r'[^A-Za-z0-9._-]', '_', repo)
+    # Nomes alterados pela conversão ("dono/repo", caminhos locais) recebem o hash do nome original,
+    # para não usarem o mesmo diretório de outro repositório (como "dono_repo")
+    if nome != repo or not nome.strip('.'):
+        nome = f"{nome[-100:]}-{hashlib.sha1(repo.encode('utf-8')).hexdigest()[:8]}"
+    return nome
+
+
+class BaseRepos:
+    """
+    Base de dados vetorial particionada por repositório: cada repositório fica em um dataset
+    DeepLake próprio, em DB_DIR/<repositório>.
+
+    Uma busca abre e percorre apenas o dataset do repositório selecionado, então o custo de
+    cada pergunta não depende de quantos repositórios estão indexados, e remover um repositório
+    é apenas apagar o seu diretório. Ao lado de cada dataset fica o índice lexical do repositório
+    (<repositório>.lexico.db).
+
+    Uma única instância pode ser compartilhada por todas as sessões do processo: os datasets são
+    abertos somente para leitura uma única vez por versão do índice e ficam em cache, assim como as
+    incorporações carregadas para a busca (IndiceVetorial) e os recuperadores. As gravações passam por escrita(), que garante um único escritor por repositório,
+    entre threads e entre processos, e descarta os objetos de leitura ao terminar.
+
+    Os caches são LRU: no máximo `max_repos` repositórios ficam abertos, e as incorporações carregadas
+    ocupam no máximo `max_memoria_mb` (sempre cabe ao menos um repositório). Os repositórios usados há
+    mais tempo são descartados e carregados novamente na próxima busca.
+    """
+
+    def __init__(self, embeddings, diretorio=DB_DIR, max_repos=MAX_REPOS_ABERTOS, max_memoria_mb=MAX_MEMORIA_VETORIAL_MB):
+        self.embeddings = embeddings
+        self.diretorio = diretorio
+        self.max_repos = max_repos
+        self.max_memoria = max_memoria_mb * 1024 * 1024
+        self._bases = OrderedDict()
+        self._recuperadores = {}
+        self._vetoriais = OrderedDict()
+        self._travas_escrita = {}
+        self._lexicos = {}
+        # Quantas vezes os objetos de leitura de cada repositório foram descartados por invalidar()
+        self._geracoes = {}
+        self._lock = threading.Lock()
+        os.makedirs(diretorio, exist_ok=True)
+
+    def caminho(self, repo):
+        """Retorna o caminho do dataset de um repositório."""
+        return os.path.join(self.diretorio, nome_particao(repo))
+
+    def existe(self, repo):
+        """Retorna True se o repositório já tiver um dataset."""
+        return os.path.isdir(self.caminho(repo))
+
+    def abrir(self, repo, versao=None):
+        """
+        Abre o dataset de um repositório somente para leitura. O dataset aberto é compartilhado e só é
+        aberto novamente quando a versão informada muda (por exemplo, depois de uma ingestão em outro processo).
+
+        Args:
+            repo (str): O nome do repositório.
+            versao (int, optional): A versão do índice do repositório no manifesto.
+
+        Returns:
+            DeepLake: A base de dados do repositório.
+        """
+        with self._lock:
+            aberta = self._bases.get(repo)
+            if aberta is not None and aberta[0] == versao:
+                self._bases.move_to_end(repo)
+                return aberta[1]
+            geracao = self._geracoes.get(repo, 0)
+        # O dataset é aberto fora da trava, para não bloquear as buscas e gravações nos outros repositórios
+        base = DeepLake(dataset_path=self.caminho(repo), embedding=self.embeddings, read_only=True, verbose=False)
+        with self._lock:
+            # Um dataset aberto antes de uma gravação terminar (invalidar) não é guardado
+            if self._geracoes.get(repo, 0) != geracao:
+                return base
+            aberta = self._bases.get(repo)
+            if aberta is None or aberta[0] != versao:
+                self._recuperadores.pop(repo, None)
+                self._vetoriais.pop(repo, None)
+                aberta = self._bases[repo] = (versao, base)
+            self._bases.move_to_end(repo)
+            # Descarta os repositórios usados há mais tempo
+            while len(self._bases) > self.max_repos:
+                self._descartar(next(iter(self._bases)))
+            return aberta[1]
+
+    def lexico(self, repo):
+        """
+        Abre (ou cria) o índice lexical de um repositório, guardado ao lado do seu dataset.
+        O índice aberto é compartilhado e vê as gravações de outros processos.
+
+        Args:
+            repo (str): O nome do repositório.
+
+        Returns:
+            IndiceLexico: O índice lexical do repositório.
+        """
+        with self._lock:
+            if repo not in self._lexicos:
+                self._lexicos[repo] = IndiceLexico(f"{self.caminho(repo)}.lexico.db")
+            return self._lexicos[repo]
+
+    def vetorial(self, repo, versao=None):
+        """
+        Retorna as incorporações de um repositório carregadas para a busca, uma única vez por versão do índice.
+
+        Args:
+            repo (str): O nome do repositório.
+            versao (int, optional): A versão do índice do repositório no manifesto.
+
+        Returns:
+            IndiceVetorial: O índice vetorial do repositório.
+        """
+        base = self.abrir(repo, versao)
+        with self._lock:
+            carregado = self._vetoriais.get(repo)
+            if carregado is not None and carregado[0] is base:
+                self._vetoriais.move_to_end(repo)
+        if carregado is None or carregado[0] is not base:
+            # O carregamento acontece fora da trava, para não bloquear as buscas nos outros repositórios
+            carregado = (base, IndiceVetorial.carregar(base))
+            with self._lock:
+                if self._bases.get(repo, (None, None))[1] is base:
+                    self._vetoriais[repo] = carregado
+                    self._vetoriais.move_to_end(repo)
+                    # Descarta as incorporações usadas há mais tempo até caberem no limite de memória
+                    while len(self._vetoriais) > 1 and \
+                            sum(indice.bytes for _, indice in self._vetoriais.values()) > self.max_memoria:
+                        self._vetoriais.popitem(last=False)
+        return carregado[1]
+
+    def recuperador(self, repo, versao=None, config=None):
+        """
+        Retorna o recuperador vetorial de um repositório, criado uma única vez por versão do índice e configuração.
+
+        Args:
+            repo (str): O nome do repositório.
+            versao (int, optional): A versão do índice do repositório no manifesto.
+            config (dict, optional): A configuração da busca (por padrão, a do repositório em config_busca).
+
+        Returns:
+            RecuperadorVetorial: O recuperador do repositório.
+        """
+        config = config or config_busca(repo)
+        # Carrega as incorporações antes da primeira pergunta; o recuperador as obtém a cada busca
+        self.vetorial(repo, versao)
+        chave = (versao, repr(sorted(config.items())))
+        with self._lock:
+            recuperadores = self._recuperadores.setdefault(repo, {})
+            if chave not in recuperadores:
+                recuperadores[chave] = RecuperadorVetorial(obter_indice=lambda: self.vetorial(repo, versao),
+                                                           embeddings=self.embeddings, config=config)
+            return recuperadores[chave]
+
+    def _descartar(self, repo):
+        # Chamada com self._lock
+        self._bases.pop(repo, None)
+        self._vetoriais.pop(repo, None)
+        self._recuperadores.pop(repo, None)
+
+    def invalidar(self, repo):
+        """Descarta o dataset aberto, as incorporações carregadas e os recuperadores de um repositório."""
+        with self._lock:
+            self._descartar(repo)
+            self._geracoes[repo] = self._geracoes.get(repo, 0) + 1
+
+    @contextmanager
+    def escrita(self, repo):
+        """
+        Abre o dataset de um repositório para gravação, com um único escritor por repositório:
+        a trava é um arquivo ao lado do dataset, então também vale entre processos.
+        Ao final, os objetos de leitura do repositório são descartados.
+
+        Args:
+            repo (str): O nome do repositório.
+
+        Yields:
+            DeepLake: A base de dados do repositório, aberta para gravação.
+        """
+        with self._trava_escrita(repo):
+            try:
+                yield DeepLake(dataset_path=self.caminho(repo), embedding=self.embeddings, verbose=False)
+            finally:
+                self.invalidar(repo)
+
+    @contextmanager
+    def _trava_escrita(self, repo):
+        with self._lock:
+            trava = self._travas_escrita.setdefault(repo, threading.Lock())
+        with trava, FileLock(f"{self.caminho(repo)}.lock"):
+            yield
+
+    def remover(self, repo):
+        """Apaga o dataset de um repositório."""
+        with self._trava_escrita(repo):
+            shutil.rmtree(self.caminho(repo), ignore_errors=True)
+            self.invalidar(repo)
+            with self._lock:
+                lexico = self._lexicos.pop(repo, None)
+            if lexico is not None:
+                lexico.fechar()
+            for sufixo in ("", "-wal", "-shm"):
+                if os.path.exists(f"{self.caminho(repo)}.lexico.db{sufixo}"):
+                    os.remove(f"{self.caminho(repo)}.lexico.db{sufixo}")
+
+    def repos(self):
+        """Retorna os nomes dos diretórios dos datasets existentes."""
+        return sorted(nome for nome in os.listdir(self.diretorio) if os.path.isdir(os.path.join(self.diretorio, nome)))
+
+
+def migrar_base_legada(bases, caminho=LEGACY_DB_DIR, tamanho_lote=1000):
+    """
+    Esta função copia os fragmentos do dataset único antigo para o dataset de cada repositório,
+    sem gerar as incorporações novamente. Depois da migração, o diretório antigo é renomeado
+    para "<caminho>_migrado", então a migração acontece uma única vez.
+
+    Args:
+        bases (BaseRepos): A base de dados particionada.
+        caminho (str, optional): O diretório do dataset antigo.
+        tamanho_lote (int, optional): A quantidade de fragmentos copiados de cada vez.
+
+    Returns:
+        dict: A quantidade de fragmentos migrados por repositório.
+    """
+    if not os.path.isdir(caminho):
+        return {}
+
+    print("Migrando a base de dados antiga para uma base por repositório...")
+    antiga = DeepLake(dataset_path=caminho, embedding=bases.embeddings, read_only=True, verbose=False)
+    dataset = antiga.vectorstore.dataset
+
+    migrados = {}
+    for inicio in range(0, len(dataset), tamanho_lote):
+        parte = dataset[inicio:inicio + tamanho_lote]
+        linhas = {}
+        for texto, metadata, embedding, id in zip(parte.text.data(aslist=True)['value'],
+                                                  parte.metadata.data(aslist=True)['value'],
+                                                  parte.embedding.numpy(aslist=True),
+                                                  parte.id.data(aslist=True)['value']):
+            repo = metadata.get('repo')
+            if repo is None:
+                continue
+            linha = linhas.setdefault(repo, {'text': [], 'metadata': [], 'embedding': [], 'id': []})
+            linha['text'].append(texto)
+            linha['metadata'].append(metadata)
+            linha['embedding'].append(embedding)
+            linha['id'].append(id)
+
+        for repo, linha in linhas.items():
+            with bases.escrita(repo) as base:
+                base.vectorstore.add(**linha)
+            migrados[repo] = migrados.get(repo, 0) + len(linha['id'])
+
+    os.rename(caminho, f"{caminho}_migrado")
+    print(f"Migração concluída: {migrados}")
+    return migrados